@@ -0,0 +1,60 @@
+"""
+Cached public user cards (name and picture) for lists that show other users.
+
+Cards are fetched in bulk: one cache get_many for the ids on a page and one
+values() query for the misses. A user's card is dropped from the cache when
+the user is saved or deleted (see signals.refresh_user_card).
+"""
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+
+from .models import User
+
+CARD_FIELDS = ("user_id", "email", "full_name", "username", "profile_pic", "profile_pic_url")
+CARD_CACHE_TTL = 600
+CARD_CACHE_VERSION = 2  # bump when CARD_FIELDS changes, so no stale-shaped card is read
+
+
+def card_cache_key(user_id) -> str:
+    return f"user:card:{CARD_CACHE_VERSION}:{user_id}"
+
+
+def get_user_cards(user_ids) -> dict:
+    """{user_id: card} for the ids that exist; cards are CARD_FIELDS values() rows."""
+    user_ids = set(user_ids)
+    if not user_ids:
+        return {}
+    cards = {card["user_id"]: card for card in cache.get_many([card_cache_key(pk) for pk in user_ids]).values()}
+    missing = user_ids - cards.keys()
+    if missing:
+        fetched = {row["user_id"]: row for row in User.objects.filter(pk__in=missing).values(*CARD_FIELDS)}
+        cache.set_many({card_cache_key(pk): card for pk, card in fetched.items()}, CARD_CACHE_TTL)
+        cards.update(fetched)
+    return cards
+
+
+def card_of(user) -> dict:
+    """The card of a User instance already loaded, without a query."""
+    card = {field: getattr(user, field) for field in CARD_FIELDS}
+    card["profile_pic"] = user.profile_pic.name
+    return card
+
+
+def missing_card(user_id) -> dict:
+    """Stand-in card for a user that no longer exists."""
+    return {**dict.fromkeys(CARD_FIELDS), "user_id": user_id}
+
+
+def invalidate_user_card(user_id):
+    cache.delete(card_cache_key(user_id))
+
+
+def display_name(card) -> str:
+    return card["full_name"] or card["username"]
+
+
+def picture_url(card):
+    """The external picture URL, else the uploaded one."""
+    if card["profile_pic_url"]:
+        return card["profile_pic_url"]
+    return default_storage.url(card["profile_pic"]) if card["profile_pic"] else None
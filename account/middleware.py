@@ -0,0 +1,93 @@
+"""
+JWT authentication for WebSocket connections.
+
+The simplejwt access token comes from the ``token`` query parameter (browsers
+cannot set headers on the handshake) or an ``Authorization: Bearer`` header.
+It is validated once per connection and scope["user"] gets a WebSocketUser:
+a slim identity cached in Redis, so consumers never read the user table per
+frame.
+"""
+import logging
+from urllib.parse import parse_qs
+
+from channels.db import database_sync_to_async
+from channels.middleware import BaseMiddleware
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+from .models import User
+
+logger = logging.getLogger(__name__)
+
+IDENTITY_FIELDS = ("user_id", "email", "username", "full_name", "profile_pic", "is_active")
+IDENTITY_CACHE_TTL = 300
+
+
+def identity_cache_key(user_id) -> str:
+    return f"ws:identity:{user_id}"
+
+
+class WebSocketUser:
+    """Just enough of a User for consumers: ids and the public profile card."""
+
+    is_authenticated = True
+    is_anonymous = False
+
+    def __init__(self, values: dict):
+        for field in IDENTITY_FIELDS:
+            setattr(self, field, values.get(field))
+        self.pk = self.user_id
+
+    def __repr__(self):
+        return f"<WebSocketUser {self.user_id}>"
+
+
+def get_identity(user_id):
+    """Cached identity for an active user, or None."""
+    key = identity_cache_key(user_id)
+    values = cache.get(key)
+    if values is None:
+        values = User.objects.filter(pk=user_id).values(*IDENTITY_FIELDS).first()
+        if values is None:
+            return None
+        cache.set(key, values, IDENTITY_CACHE_TTL)
+    return WebSocketUser(values) if values["is_active"] else None
+
+
+def invalidate_identity(user_id):
+    cache.delete(identity_cache_key(user_id))
+
+
+def get_raw_token(scope):
+    token = parse_qs(scope.get("query_string", b"").decode()).get("token")
+    if token:
+        return token[0]
+    for name, value in scope.get("headers", []):
+        if name == b"authorization":
+            parts = value.decode().split()
+            if len(parts) == 2 and parts[0] in api_settings.AUTH_HEADER_TYPES:
+                return parts[1]
+    return None
+
+
+class JWTAuthMiddleware(BaseMiddleware):
+    """Put the user of a valid access token (or AnonymousUser) in scope["user"]."""
+
+    async def __call__(self, scope, receive, send):
+        scope = dict(scope)
+        scope["user"] = await self.authenticate(scope)
+        return await super().__call__(scope, receive, send)
+
+    async def authenticate(self, scope):
+        raw = get_raw_token(scope)
+        if not raw:
+            return AnonymousUser()
+        try:
+            user_id = AccessToken(raw)[api_settings.USER_ID_CLAIM]
+        except (TokenError, KeyError):
+            logger.info("Rejected WebSocket token")
+            return AnonymousUser()
+        return await database_sync_to_async(get_identity)(user_id) or AnonymousUser()
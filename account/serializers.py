@@ -7,6 +7,7 @@ from django.contrib.auth import get_user_model
 from .utils import generate_otp, get_otp_expiry, send_otp_email, generate_tokens_for_user, validate_image, generate_username
 from .models import User
 from rest_framework.exceptions import ValidationError
+from subscription.services import EntitlementService
 from rest_framework import serializers
 
 
@@ -39,6 +40,9 @@ class UserSerializer(serializers.ModelSerializer):
         child=serializers.ChoiceField(choices=User.LOOKING_FOR_CHOICES),
         required=False
     )
+    # from the cached entitlement, so expiry shows without a webhook writing the user row
+    is_subscribed = serializers.SerializerMethodField()
+    subscription_expiry = serializers.SerializerMethodField()
 
     class Meta:
         model = User
@@ -82,6 +86,13 @@ class UserSerializer(serializers.ModelSerializer):
             "updated_at",
         ]
 
+    def get_is_subscribed(self, obj):
+        return EntitlementService.get(obj.pk)["is_active"]
+
+    def get_subscription_expiry(self, obj):
+        expires_at = EntitlementService.get(obj.pk)["expires_at"]
+        return serializers.DateTimeField().to_representation(expires_at) if expires_at else None
+
     def to_representation(self, instance):
         """Ensure looking_for renders as list instead of comma string."""
         rep = super().to_representation(instance)
@@ -1,27 +1,41 @@
-from django.db import transaction
+from django.db import connection, transaction
 from django.core.exceptions import ObjectDoesNotExist
+from django.utils import timezone
 from .models import User, UserLike
+from notification.models import Notification
+from notification.services import enqueue_notification
 import logging
 
 logger = logging.getLogger(__name__)
 
 class UserLikeService:
     @staticmethod
-    @transaction.atomic
     def like_user(user_from: User, user_to_id: int):
+        """
+        Like with a single INSERT ... SELECT ... ON CONFLICT DO NOTHING and return
+        the like id. The notification is queued after commit and written in
+        batches by notification.tasks.flush_notifications.
+        """
         if user_from.user_id == user_to_id:   # <-- change here
             raise ValueError("You cannot like yourself.")
 
-        try:
-            user_to = User.objects.get(user_id=user_to_id)
-        except User.DoesNotExist:
-            raise ValueError("User not found.")
-
-        obj, created = UserLike.objects.get_or_create(user_from=user_from, user_to=user_to)
-        if not created:
+        ops = connection.ops
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {ops.quote_name(UserLike._meta.db_table)} (user_from_id, user_to_id, created_at) "
+                f"SELECT %s, user_id, %s FROM {ops.quote_name(User._meta.db_table)} WHERE user_id = %s "
+                f"ON CONFLICT (user_from_id, user_to_id) DO NOTHING RETURNING id",
+                [user_from.user_id, ops.adapt_datetimefield_value(timezone.now()), user_to_id],
+            )
+            row = cursor.fetchone()
+        if row is None:
+            # only the failure path pays for telling the two cases apart
+            if not User.objects.filter(user_id=user_to_id).exists():
+                raise ValueError("User not found.")
             raise ValueError("You have already liked this user.")
 
-        return obj
+        enqueue_notification(user_to_id, user_from.user_id, Notification.TYPE_LIKE, row[0])
+        return row[0]
 
     @staticmethod
     @transaction.atomic
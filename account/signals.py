@@ -1,17 +1,25 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
-from django.contrib.contenttypes.models import ContentType
 
-from .models import UserLike
+from .cards import invalidate_user_card
+from .middleware import invalidate_identity
+from .models import User, UserLike
 from notification.models import Notification
+from notification.services import enqueue_notification
 
 @receiver(post_save, sender=UserLike)
 def create_like_notification(sender, instance, created, **kwargs):
+    # likes made through UserLikeService.like_user enqueue directly (raw INSERT, no signal)
     if created:
-        Notification.objects.create(
-            sender=instance.user_from,
-            receiver=instance.user_to,
-            content_type=ContentType.objects.get_for_model(UserLike),
-            object_id=instance.id,
-            message=f"{instance.user_from.get_full_name()} liked your profile"
-        )
+        enqueue_notification(instance.user_to_id, instance.user_from_id, Notification.TYPE_LIKE, instance.id)
+
+
+@receiver(post_save, sender=User)
+def refresh_websocket_identity(sender, instance, **kwargs):
+    invalidate_identity(instance.pk)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def refresh_user_card(sender, instance, **kwargs):
+    invalidate_user_card(instance.pk)
@@ -669,6 +669,7 @@ from django.core.cache import cache
 
 from .models import User
 from .serializers import UserListLiteSerializer
+from subscription.services import EntitlementService
 
 class UserListStatsAPIView(APIView):
     permission_classes = [IsAdminUser]
@@ -685,8 +686,9 @@ class UserListStatsAPIView(APIView):
         stats = User.objects.aggregate(
             total_users=Count("user_id"),
             total_verified_users=Count("user_id", filter=Q(is_verified=True)),
-            total_subscribers=Count("user_id", filter=Q(is_subscribed=True)),
         )
+        # subscriptions that have not expired, not the is_subscribed flag a webhook last wrote
+        stats["total_subscribers"] = EntitlementService.active_subscriptions().count()
 
         return Response({
             "success": True,
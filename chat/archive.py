@@ -0,0 +1,204 @@
+"""
+Cold storage for old chat messages.
+
+archive_old_messages() moves messages older than CHAT_ARCHIVE_AFTER_DAYS out
+of the Message table into per-thread MessageArchiveSegment files: gzip JSONL
+written as one gzip member per block of CHAT_ARCHIVE_BLOCK_MESSAGES rows,
+with the byte offset of every block kept on the segment. The thread keeps a
+stub (archived_until, archived_message_count) so history pages only look at
+the archive once they run past the hot rows, and then inflate just the
+blocks they need.
+"""
+import gzip
+import io
+import json
+import logging
+from datetime import timedelta
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import Count, F, Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import ChatThread, Message, MessageArchiveSegment
+
+logger = logging.getLogger(__name__)
+
+# Message columns kept in the archive; the sender card is looked up on read
+ARCHIVE_FIELDS = (
+    "id", "sender_id", "content", "message_type", "attachment", "is_read", "is_like", "seq", "reaction_counts",
+    "created_at",
+)
+BLOCK_CACHE_SIZE = 256  # inflated blocks kept per process; segments never change
+
+
+def _encode(row) -> str:
+    return json.dumps({**row, "created_at": row["created_at"].isoformat()}, separators=(",", ":"))
+
+
+def _key(row):
+    return row["created_at"], row["id"]
+
+
+def _block_key(block):
+    return parse_datetime(block[2]), block[3]
+
+
+# writing
+
+def write_segment(thread_id, rows) -> MessageArchiveSegment:
+    """Write rows (ARCHIVE_FIELDS values, oldest first) as a segment file; the row is not saved."""
+    block_size = settings.CHAT_ARCHIVE_BLOCK_MESSAGES
+    buffer, blocks = io.BytesIO(), []
+    for start in range(0, len(rows), block_size):
+        block = rows[start:start + block_size]
+        data = gzip.compress("".join(_encode(row) + "\n" for row in block).encode())
+        ids = [row["id"] for row in block]
+        blocks.append([buffer.tell(), len(data), block[0]["created_at"].isoformat(), block[0]["id"], min(ids), max(ids)])
+        buffer.write(data)
+
+    ids = [row["id"] for row in rows]
+    segment = MessageArchiveSegment(
+        thread_id=thread_id,
+        message_count=len(rows),
+        first_created_at=rows[0]["created_at"],
+        last_created_at=rows[-1]["created_at"],
+        min_message_id=min(ids),
+        max_message_id=max(ids),
+        blocks=blocks,
+        size=buffer.tell(),
+    )
+    segment.file.save(f"{thread_id}/{rows[0]['id']}-{rows[-1]['id']}.jsonl.gz", ContentFile(buffer.getvalue()), save=False)
+    return segment
+
+
+def archive_thread(thread_id, cutoff) -> int:
+    """Move the thread's messages created before cutoff into segments."""
+    segment_size = settings.CHAT_ARCHIVE_SEGMENT_MESSAGES
+    archived = 0
+    while True:
+        with transaction.atomic():
+            rows = list(
+                Message.objects.select_for_update()
+                .filter(thread_id=thread_id, created_at__lt=cutoff)
+                .order_by("created_at", "id")
+                .values(*ARCHIVE_FIELDS)[:segment_size]
+            )
+            if not rows:
+                break
+            segment = write_segment(thread_id, rows)
+            try:
+                segment.save()
+                # cascades to reactions and search postings; counts live on in reaction_counts
+                Message.objects.filter(pk__in=[row["id"] for row in rows]).delete()
+                ChatThread.objects.filter(pk=thread_id).update(
+                    archived_until=segment.last_created_at,
+                    archived_message_count=F("archived_message_count") + len(rows),
+                )
+            except Exception:
+                segment.file.delete(save=False)
+                raise
+        archived += len(rows)
+        if len(rows) < segment_size:
+            break
+    return archived
+
+
+def archive_old_messages(now=None) -> int:
+    """
+    Archive threads with at least CHAT_ARCHIVE_MIN_MESSAGES messages past the
+    cutoff, or whose last message is past it (quiet threads go fully cold).
+    """
+    cutoff = (now or timezone.now()) - timedelta(days=settings.CHAT_ARCHIVE_AFTER_DAYS)
+    candidates = (
+        Message.objects.filter(created_at__lt=cutoff)
+        .values("thread_id")
+        .annotate(old=Count("id"))
+        .filter(Q(old__gte=settings.CHAT_ARCHIVE_MIN_MESSAGES) | Q(thread__last_message_at__lt=cutoff))
+        .order_by("-old")
+        .values_list("thread_id", flat=True)[:settings.CHAT_ARCHIVE_THREADS_PER_RUN]
+    )
+    archived = 0
+    for thread_id in list(candidates):
+        try:
+            archived += archive_thread(thread_id, cutoff)
+        except Exception:
+            logger.exception("Failed to archive messages of thread %s", thread_id)
+    return archived
+
+
+# reading
+
+@lru_cache(maxsize=BLOCK_CACHE_SIZE)
+def read_block(name, offset, length) -> tuple:
+    """Rows of one block, oldest first."""
+    with default_storage.open(name, "rb") as fh:
+        fh.seek(offset)
+        data = gzip.decompress(fh.read(length))
+    rows = []
+    for line in data.splitlines():
+        row = json.loads(line)
+        row["created_at"] = parse_datetime(row["created_at"])
+        rows.append(row)
+    return tuple(rows)
+
+
+def _hydrate(thread_id, rows) -> list:
+    """Shape archive rows like Message.values(*MESSAGE_PROJECTION) rows."""
+    return [{**row, "thread_id": thread_id} for row in rows]
+
+
+def find_message(thread_id, message_id):
+    """The archived row of message_id, or None."""
+    segments = MessageArchiveSegment.objects.filter(
+        thread_id=thread_id, min_message_id__lte=message_id, max_message_id__gte=message_id
+    )
+    for segment in segments:
+        for offset, length, _, _, min_id, max_id in segment.blocks:
+            if min_id <= message_id <= max_id:
+                for row in read_block(segment.file.name, offset, length):
+                    if row["id"] == message_id:
+                        return _hydrate(thread_id, [row])[0]
+    return None
+
+
+def rows_before(thread_id, key=None, limit=30) -> list:
+    """Up to limit archived rows older than key (created_at, id), newest first."""
+    segments = MessageArchiveSegment.objects.filter(thread_id=thread_id).order_by("-first_created_at", "-id")
+    if key is not None:
+        segments = segments.filter(first_created_at__lte=key[0])
+    rows = []
+    for segment in segments:
+        for block in reversed(segment.blocks):
+            if key is not None and _block_key(block) >= key:
+                continue
+            for row in reversed(read_block(segment.file.name, block[0], block[1])):
+                if key is None or _key(row) < key:
+                    rows.append(row)
+                    if len(rows) == limit:
+                        return _hydrate(thread_id, rows)
+    return _hydrate(thread_id, rows)
+
+
+def rows_after(thread_id, key, limit=30) -> list:
+    """Up to limit archived rows newer than key (created_at, id), oldest first."""
+    segments = MessageArchiveSegment.objects.filter(
+        thread_id=thread_id, last_created_at__gte=key[0]
+    ).order_by("first_created_at", "id")
+    rows = []
+    for segment in segments:
+        blocks = segment.blocks
+        for index, block in enumerate(blocks):
+            # every row of this block is older than the next block's first row
+            if index + 1 < len(blocks) and _block_key(blocks[index + 1]) <= key:
+                continue
+            for row in read_block(segment.file.name, block[0], block[1]):
+                if _key(row) > key:
+                    rows.append(row)
+                    if len(rows) == limit:
+                        return _hydrate(thread_id, rows)
+    return _hydrate(thread_id, rows)
@@ -0,0 +1,285 @@
+"""
+Write-behind buffering for chat messages (settings.CHAT_WRITE_BEHIND).
+
+Messages get their primary key and per-thread sequence number up front, are
+broadcast immediately and persisted later with bulk_create, so WebSocket
+throughput does not wait on a commit per message.
+
+A batch that fails is retried row by row. Rows that can never be written
+(e.g. the thread was deleted meanwhile) and rows still failing after
+MAX_ATTEMPTS flushes go to the DEAD_LETTER_KEY Redis list instead of
+blocking the buffer. Once MAX_PENDING messages are waiting, consumers fall
+back to saving synchronously.
+"""
+import asyncio
+import json
+import logging
+import weakref
+
+import redis.asyncio as aioredis
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db import DataError, IntegrityError, NotSupportedError, connection, transaction
+from django.db.models import Max
+from django_redis import get_redis_connection
+
+from .models import ChatThread, Message, MessageReaction
+from .search import index_messages
+from .services import UnreadCounterService
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = getattr(settings, "CHAT_WRITE_BEHIND_BATCH_SIZE", 200)
+FLUSH_INTERVAL_MS = getattr(settings, "CHAT_WRITE_BEHIND_FLUSH_MS", 250)
+ID_BLOCK_SIZE = getattr(settings, "CHAT_WRITE_BEHIND_ID_BLOCK", 500)
+MAX_PENDING = getattr(settings, "CHAT_WRITE_BEHIND_MAX_PENDING", 5000)
+MAX_ATTEMPTS = getattr(settings, "CHAT_WRITE_BEHIND_MAX_ATTEMPTS", 20)
+
+DEAD_LETTER_KEY = "chat:write_behind:dead"
+
+_redis_clients = weakref.WeakKeyDictionary()
+
+
+def get_redis():
+    """Async Redis client for the running event loop."""
+    loop = asyncio.get_running_loop()
+    client = _redis_clients.get(loop)
+    if client is None:
+        client = aioredis.from_url(settings.CACHES["default"]["LOCATION"])
+        _redis_clients[loop] = client
+    return client
+
+
+def thread_seq_key(thread_id) -> str:
+    return f"chat:thread:{thread_id}:seq"
+
+
+# KEYS: seq counter; ARGV: seed (optional). Returns nil when the counter
+# is missing and no seed was given, so the caller can seed it from the DB.
+_NEXT_SEQ = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    if not ARGV[1] then return false end
+    redis.call('SETNX', KEYS[1], ARGV[1])
+end
+return redis.call('INCR', KEYS[1])
+"""
+
+
+def _max_thread_seq(thread_id) -> int:
+    # messages and reactions share the thread's sequence
+    return max(
+        Message.objects.filter(thread_id=thread_id).aggregate(m=Max("seq"))["m"] or 0,
+        MessageReaction.objects.filter(message__thread_id=thread_id).aggregate(m=Max("seq"))["m"] or 0,
+    )
+
+
+async def allocate_thread_seq(thread_id) -> int:
+    """Next sequence number of a thread (Redis INCR, seeded from the DB once)."""
+    client = get_redis()
+    key = thread_seq_key(thread_id)
+    seq = await client.eval(_NEXT_SEQ, 1, key)
+    if seq is None:
+        seed = await database_sync_to_async(_max_thread_seq)(thread_id)
+        seq = await client.eval(_NEXT_SEQ, 1, key, seed)
+    return int(seq)
+
+
+def next_thread_seq(thread_id) -> int:
+    """Blocking twin of allocate_thread_seq for views and worker threads."""
+    client = get_redis_connection("default")
+    key = thread_seq_key(thread_id)
+    seq = client.eval(_NEXT_SEQ, 1, key)
+    if seq is None:
+        seq = client.eval(_NEXT_SEQ, 1, key, _max_thread_seq(thread_id))
+    return int(seq)
+
+
+class MessageIdAllocator:
+    """
+    Hands out Message primary keys from blocks reserved on the table's own
+    PostgreSQL sequence, so they never collide with rows inserted elsewhere.
+    """
+
+    def __init__(self, block_size=ID_BLOCK_SIZE):
+        self.block_size = block_size
+        self._ids = []
+        self._lock = None
+        self._loop = None
+
+    @staticmethod
+    def _reserve_block(size):
+        if connection.vendor != "postgresql":
+            raise NotSupportedError("CHAT_WRITE_BEHIND requires PostgreSQL sequences.")
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT nextval(pg_get_serial_sequence(%s, 'id')) FROM generate_series(1, %s)",
+                [Message._meta.db_table, size],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+    async def next_id(self) -> int:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop, self._lock = loop, asyncio.Lock()
+        async with self._lock:
+            if not self._ids:
+                self._ids = await database_sync_to_async(self._reserve_block)(self.block_size)
+            return self._ids.pop(0)
+
+
+class MessageWriteBuffer:
+    """Per-process buffer flushed every BATCH_SIZE messages or FLUSH_INTERVAL_MS."""
+
+    def __init__(self, batch_size=BATCH_SIZE, flush_interval_ms=FLUSH_INTERVAL_MS,
+                 max_pending=MAX_PENDING, max_attempts=MAX_ATTEMPTS):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval_ms / 1000
+        self.max_pending = max_pending
+        self.max_attempts = max_attempts
+        self._pending = []
+        self._attempts = {}  # message id -> failed flushes
+        self._lock = None
+        self._task = None
+        self._loop = None
+
+    def _ensure_flusher(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop or self._task is None or self._task.done():
+            self._loop = loop
+            self._lock = asyncio.Lock()
+            self._task = loop.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self._flush_logged()
+
+    def accepting(self) -> bool:
+        """False while the buffer is full; callers then save synchronously."""
+        return len(self._pending) < self.max_pending
+
+    async def add(self, message: Message):
+        self._ensure_flusher()
+        self._pending.append(message)
+        if len(self._pending) >= self.batch_size:
+            # never make the sender wait on the DB; the lock orders flushes
+            self._loop.create_task(self._flush_logged())
+
+    async def _flush_logged(self):
+        try:
+            await self.flush()
+        except Exception:
+            logger.exception("Chat write-behind flush failed; retrying next tick")
+
+    async def flush(self) -> int:
+        if not self._pending:
+            return 0
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            batch, self._pending = self._pending, []
+            try:
+                await database_sync_to_async(self._write)(batch)
+            except Exception:
+                logger.exception("Chat write-behind batch of %s failed; writing rows one by one", len(batch))
+                written, retry, dead = await database_sync_to_async(self._write_each)(batch)
+                # retried rows go back in front so they keep their order
+                self._pending = retry + self._pending
+                await self._dead_letter(dead)
+                return written
+            for message in batch:
+                self._attempts.pop(message.pk, None)
+            return len(batch)
+
+    @staticmethod
+    def _write(batch):
+        with transaction.atomic():
+            Message.objects.bulk_create(batch, batch_size=BATCH_SIZE)
+            ChatThread.record_messages(batch)
+            index_messages(batch)
+            UnreadCounterService.record_messages(batch)
+
+    def _write_each(self, batch):
+        """
+        Write a failed batch one row per transaction. Returns (written, rows
+        to retry, rows to dead-letter). Integrity and data errors never heal,
+        so those rows are dropped at once; any other error (the database
+        being unavailable) stops the pass and the rest is retried later.
+        """
+        written, retry, dead = 0, [], []
+        for index, message in enumerate(batch):
+            try:
+                self._write([message])
+            except (IntegrityError, DataError):
+                logger.exception("Dropping chat message %s that cannot be written", message.pk)
+                dead.append(message)
+                continue
+            except Exception:
+                logger.exception("Chat write-behind row write failed; retrying the rest later")
+                for pending in batch[index:]:
+                    attempts = self._attempts.get(pending.pk, 0) + 1
+                    if attempts >= self.max_attempts:
+                        self._attempts.pop(pending.pk, None)
+                        dead.append(pending)
+                    else:
+                        self._attempts[pending.pk] = attempts
+                        retry.append(pending)
+                break
+            self._attempts.pop(message.pk, None)
+            written += 1
+        return written, retry, dead
+
+    async def _dead_letter(self, messages):
+        if not messages:
+            return
+        entries = [
+            json.dumps({
+                "id": message.pk,
+                "thread_id": message.thread_id,
+                "sender_id": message.sender_id,
+                "content": message.content,
+                "message_type": message.message_type,
+                "seq": message.seq,
+                "created_at": message.created_at.isoformat(),
+            })
+            for message in messages
+        ]
+        try:
+            await get_redis().rpush(DEAD_LETTER_KEY, *entries)
+            logger.error("Moved %s unwritable chat messages to %s", len(entries), DEAD_LETTER_KEY)
+        except Exception:
+            logger.exception("Failed to dead-letter chat messages: %s", entries)
+
+    async def close(self):
+        """Stop the flusher and write everything still buffered."""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        for _ in range(self.max_attempts):
+            if not self._pending:
+                break
+            await self._flush_logged()
+        # whatever still fails would be lost with the process
+        batch, self._pending = self._pending, []
+        await self._dead_letter(batch)
+
+
+message_buffer = MessageWriteBuffer()
+message_ids = MessageIdAllocator()
+
+
+class LifespanApp:
+    """ASGI lifespan handler that flushes buffered messages on shutdown."""
+
+    async def __call__(self, scope, receive, send):
+        while True:
+            event = await receive()
+            if event["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif event["type"] == "lifespan.shutdown":
+                try:
+                    await message_buffer.close()
+                except Exception:
+                    logger.exception("Failed to flush buffered chat messages on shutdown")
+                await send({"type": "lifespan.shutdown.complete"})
+                return
@@ -1,138 +1,651 @@
+import asyncio
 import json
 import base64
 import logging
+import time
+from collections import OrderedDict
+from urllib.parse import parse_qs
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
 from django.core.files.base import ContentFile
-from django.contrib.auth import get_user_model
-from .models import ChatThread, Message, MessageReaction
+from django.conf import settings
+from django.db import transaction
+from notification import services as notifications
+from . import ephemeral, presence, ratelimit
+from .buffer import allocate_thread_seq, message_buffer, message_ids, next_thread_seq
+from .models import ChatAttachment, ChatThread, Message, MessageReaction
+from .search import index_messages
+from .services import (
+    AttachmentError,
+    build_message_payload,
+    claim_attachment,
+    create_attachment_from_bytes,
+    load_thread_participants,
+    parse_attachment_frame,
+    SYNC_DEFAULT_LIMIT,
+    sync_thread,
+    thread_groups,
+    UnreadCounterService,
+    upsert_reaction,
+)
 
 logger = logging.getLogger(__name__)
-User = get_user_model()
 
 
-class ChatConsumer(AsyncWebsocketConsumer):
-    async def connect(self):
-        self.thread_id = self.scope["url_route"]["kwargs"]["thread_id"]
-        self.room_group_name = f"chat_{self.thread_id}"
+def parse_frame(text_data):
+    """Decode a JSON text frame into a dict, or None."""
+    try:
+        data = json.loads(text_data)
+    except json.JSONDecodeError:
+        return None
+    return data if isinstance(data, dict) else None
 
-        await self.channel_layer.group_add(self.room_group_name, self.channel_name)
-        await self.accept()
-        logger.info(f"WebSocket connected: thread {self.thread_id}")
 
-    async def disconnect(self, close_code):
-        await self.channel_layer.group_discard(self.room_group_name, self.channel_name)
-        logger.info(f"WebSocket disconnected: thread {self.thread_id} code={close_code}")
+class ThreadEventsMixin:
+    """
+    Message, reaction, attachment, ephemeral event and presence handling
+    shared by the per-thread and the per-user socket. Every handler takes the
+    thread id and its participants ({user_id: user card}); events are fanned
+    out to the groups from services.thread_groups so both kinds of socket
+    receive them.
+    """
 
-    async def receive(self, text_data=None, bytes_data=None):
-        if not text_data:
+    # at-least-once delivery for clients connecting with ?ack=1
+    ACK_TIMEOUT = 5.0
+    MAX_RESENDS = 3
+    MAX_UNACKED = 500
+
+    def get_user_id(self):
+        # identity set once per connection by account.middleware.JWTAuthMiddleware
+        return self.scope["user"].pk
+
+    # frames that hit the database also count against the per-user Redis bucket
+    WRITE_FRAMES = ("message", "reaction", "sync", "attachment")
+
+    def start_session(self):
+        self.typing_sent = {}
+        self.bucket = ratelimit.connection_bucket()
+        self.strikes = 0
+        self.throttle_sent = 0.0
+        self.rate_limited = False
+        self.unacked = OrderedDict()  # (thread_id, seq) -> [frame, sent_at, attempts]
+        self.ack_enabled = parse_qs(self.scope.get("query_string", b"").decode()).get("ack") == ["1"]
+        self.resend_task = asyncio.ensure_future(self.resend_unacked()) if self.ack_enabled else None
+
+    def end_session(self):
+        if getattr(self, "resend_task", None) is not None:
+            self.resend_task.cancel()
+
+    async def go_online(self):
+        """Register this socket in the user's presence set and keep its entry alive."""
+        if await presence.mark_online(self.get_user_id(), self.channel_name):
+            await self.announce_presence(True)
+        self.heartbeat_task = asyncio.ensure_future(self.presence_heartbeat())
+
+    async def go_offline(self):
+        if getattr(self, "heartbeat_task", None) is not None:
+            self.heartbeat_task.cancel()
+        try:
+            if await presence.mark_offline(self.get_user_id(), self.channel_name):
+                await self.announce_presence(False)
+        except Exception:
+            logger.exception("Failed to update presence for user %s", self.get_user_id())
+
+    async def presence_heartbeat(self):
+        while True:
+            await asyncio.sleep(settings.CHAT_PRESENCE_HEARTBEAT_SECONDS)
+            try:
+                await presence.heartbeat(self.get_user_id(), self.channel_name)
+            except Exception:
+                logger.exception("Failed to refresh presence for user %s", self.get_user_id())
+
+    async def announce_presence(self, online):
+        user_id = self.get_user_id()
+        partner_ids = await database_sync_to_async(presence.set_online)(user_id, online)
+        for partner_id in partner_ids:
+            await self.channel_layer.group_send(
+                f"user_{partner_id}",
+                {"type": "presence_update", "user_id": user_id, "online": online},
+            )
+
+    async def admit(self, frame_type) -> bool:
+        """
+        Take rate-limit tokens for one incoming frame. Refused frames get a
+        throttle frame (at most once a second, the rest are dropped) and
+        CHAT_RATE_LIMIT_MAX_STRIKES refusals in a row close the socket.
+        """
+        if self.rate_limited:
+            return False
+        retry_after = None
+        if not self.bucket.consume():
+            retry_after = self.bucket.retry_after()
+        elif frame_type in self.WRITE_FRAMES and not await ratelimit.take_user_token(self.get_user_id()):
+            retry_after = 1.0 / settings.CHAT_USER_RATE_LIMIT_PER_SECOND
+        if retry_after is None:
+            self.strikes = 0
+            return True
+
+        self.strikes += 1
+        if self.strikes >= settings.CHAT_RATE_LIMIT_MAX_STRIKES:
+            self.rate_limited = True
+            await ratelimit.record(ratelimit.CLOSED)
+            await self.close(code=ratelimit.CLOSE_RATE_LIMITED)
+            return False
+        now = time.monotonic()
+        if now - self.throttle_sent < 1.0:
+            await ratelimit.record(ratelimit.DROPPED)
+            return False
+        self.throttle_sent = now
+        await ratelimit.record(ratelimit.THROTTLED)
+        await self.send(json.dumps({"type": "throttled", "retry_after": round(retry_after, 3)}))
+        return False
+
+    async def send_tracked(self, thread_id, seq, frame: str):
+        """Send a sequenced frame and, with acks on, keep it until the client acks its seq."""
+        await self.send(frame)
+        if self.ack_enabled and seq is not None:
+            self.unacked[(thread_id, seq)] = [frame, time.monotonic(), 0]
+            while len(self.unacked) > self.MAX_UNACKED:
+                # the client falls back to a sync frame on reconnect
+                self.unacked.popitem(last=False)
+
+    async def resend_unacked(self):
+        while True:
+            await asyncio.sleep(self.ACK_TIMEOUT / 2)
+            now = time.monotonic()
+            for key, entry in list(self.unacked.items()):
+                if now - entry[1] < self.ACK_TIMEOUT:
+                    continue
+                if entry[2] >= self.MAX_RESENDS:
+                    self.unacked.pop(key, None)
+                    continue
+                entry[1], entry[2] = now, entry[2] + 1
+                await self.send(entry[0])
+
+    async def handle_ack(self, thread_id, participants, data):
+        """{"type": "ack", "seq": N}: everything of the thread up to seq arrived."""
+        try:
+            seq = int(data.get("seq"))
+        except (TypeError, ValueError):
+            await self.send_error("seq is required", thread_id)
             return
+        for key in [key for key in self.unacked if key[0] == thread_id and key[1] <= seq]:
+            del self.unacked[key]
 
+    async def handle_sync(self, thread_id, participants, data):
+        """{"type": "sync", "since_seq": N}: changes after N, see services.sync_thread."""
         try:
-            data = json.loads(text_data)
-        except json.JSONDecodeError:
-            await self.send(json.dumps({"error": "Invalid JSON"}))
+            since_seq = int(data.get("since_seq") or 0)
+            limit = int(data.get("limit") or SYNC_DEFAULT_LIMIT)
+        except (TypeError, ValueError):
+            await self.send_error("since_seq and limit must be integers", thread_id)
             return
+        result = await database_sync_to_async(sync_thread)(thread_id, since_seq, limit)
+        await self.send(json.dumps({"type": "sync", **result}))
 
-        msg_type = data.get("type", "message")
-        if msg_type == "message":
-            await self.handle_message(data)
-        elif msg_type == "reaction":
-            await self.handle_reaction(data)
+    async def send_error(self, error, thread_id=None, **extra):
+        payload = {"error": error, **extra}
+        if thread_id is not None:
+            payload["thread_id"] = thread_id
+        await self.send(json.dumps(payload))
+
+    async def broadcast(self, thread_id, participants, event):
+        event["thread_id"] = thread_id
+        for group in thread_groups(thread_id, participants):
+            await self.channel_layer.group_send(group, event)
+
+    @staticmethod
+    def get_sender_card(participants, sender_id):
+        # membership comes from the per-connection participant cache
+        try:
+            return participants[int(sender_id)]
+        except (KeyError, TypeError, ValueError):
+            raise PermissionError("Sender is not in the thread")
 
-    async def handle_message(self, data):
+    async def handle_attachment_frame(self, thread_id, participants, header, payload):
+        """
+        Binary frame: 2-byte big-endian header length, JSON header
+        ({"name": "photo.jpg", "client_ref": ...}), then the raw file bytes.
+        Replies with an attachment_token to reference from a message.
+        """
+        sender_id = self.get_user_id()
+        client_ref = header.get("client_ref")
+        try:
+            token = await self.save_attachment(thread_id, participants, sender_id, header.get("name"), payload)
+        except (AttachmentError, PermissionError) as e:
+            await self.send_error(str(e), thread_id, client_ref=client_ref)
+            return
+        except Exception as e:
+            logger.exception("Failed to store attachment")
+            await self.send_error(str(e), thread_id, client_ref=client_ref)
+            return
+
+        await self.send(json.dumps({
+            "type": "attachment_uploaded",
+            "thread_id": thread_id,
+            "attachment_token": str(token),
+            "client_ref": client_ref,
+        }))
+
+    async def handle_message(self, thread_id, participants, data):
         message_text = data.get("message", "")
         attachment_b64 = data.get("attachment")
-        # use .pk (works regardless of primary key field name)
-        sender_id = getattr(self.scope.get("user", None), "pk", None) or data.get("sender_id")
+        attachment_token = data.get("attachment_token")
+        sender_id = self.get_user_id()
 
-        # Auto-detect message type
-        if attachment_b64:
+        # Auto-detect message type; attachments are decoded/stored off the event loop
+        if attachment_b64 or attachment_token:
             message_type = Message.MESSAGE_IMAGE
-            try:
-                format, imgstr = attachment_b64.split(";base64,")
-                ext = format.split("/")[-1]
-                attachment_file = ContentFile(base64.b64decode(imgstr), name=f"msg_{sender_id}.{ext}")
-            except Exception:
-                await self.send(json.dumps({"error": "Invalid base64 image"}))
-                return
         else:
             message_type = Message.MESSAGE_TEXT
-            attachment_file = None
 
         if message_type == Message.MESSAGE_TEXT and not message_text:
-            await self.send(json.dumps({"error": "Text message cannot be empty"}))
+            await self.send_error("Text message cannot be empty", thread_id)
             return
 
         try:
-            msg = await self.save_message(sender_id, message_text, message_type, attachment_file)
-            serialized = await self.serialize_message(msg)
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {"type": "chat_message", "message": serialized},
+            if settings.CHAT_WRITE_BEHIND and message_type == Message.MESSAGE_TEXT and message_buffer.accepting():
+                await self.buffer_message(thread_id, participants, sender_id, message_text)
+                return
+            serialized = await self.save_message(
+                thread_id, participants, sender_id, message_text, attachment_b64, attachment_token
             )
+            await self.broadcast(thread_id, participants, {"type": "chat_message", "message": serialized})
+        except (AttachmentError, PermissionError) as e:
+            await self.send_error(str(e), thread_id)
         except Exception as e:
             logger.exception("Failed to save message")
-            await self.send(json.dumps({"error": str(e)}))
+            await self.send_error(str(e), thread_id)
 
-    async def handle_reaction(self, data):
+    async def handle_reaction(self, thread_id, participants, data):
         reaction_data = data.get("reaction")
         if not reaction_data:
-            await self.send(json.dumps({"error": "Reaction data required"}))
+            await self.send_error("Reaction data required", thread_id)
             return
 
-        sender_id = getattr(self.scope.get("user", None), "pk", None) or data.get("sender_id")
+        sender_id = self.get_user_id()
         message_id = reaction_data.get("message_id")
         reaction_type = reaction_data.get("reaction")
 
         try:
-            reaction = await self.save_reaction(sender_id, message_id, reaction_type)
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {"type": "chat_reaction", "reaction": reaction},
-            )
+            self.get_sender_card(participants, sender_id)
+            reaction = await self.save_reaction(thread_id, sender_id, message_id, reaction_type)
+            await self.broadcast(thread_id, participants, {"type": "chat_reaction", "reaction": reaction})
+        except (Message.DoesNotExist, PermissionError, ValueError) as e:
+            await self.send_error(str(e), thread_id)
         except Exception as e:
             logger.exception("Failed to save reaction")
-            await self.send(json.dumps({"error": str(e)}))
+            await self.send_error(str(e), thread_id)
+
+    # forward an unchanged typing state at most this often
+    TYPING_REPEAT_SECONDS = 3.0
+
+    async def handle_ephemeral(self, thread_id, participants, data):
+        """
+        typing / delivered / read frames. Nothing is written to the database:
+        they are relayed over the channel layer, and read cursors are
+        coalesced in Redis until chat.tasks.flush_read_cursors applies them.
+
+            {"type": "typing", "is_typing": true}
+            {"type": "delivered", "up_to_seq": 57}
+            {"type": "read", "up_to_seq": 57}
+
+        up_to_message_id is still accepted in place of up_to_seq.
+        """
+        kind = data.get("type")
+        user_id = self.get_user_id()
+        event = {"type": "chat_ephemeral", "event": kind, "user_id": user_id}
+
+        if kind == ephemeral.TYPING:
+            is_typing = bool(data.get("is_typing", True))
+            now = time.monotonic()
+            last = self.typing_sent.get(thread_id)
+            if last and last[0] == is_typing and now - last[1] < self.TYPING_REPEAT_SECONDS:
+                return
+            self.typing_sent[thread_id] = (is_typing, now)
+            event["is_typing"] = is_typing
+        else:
+            try:
+                up_to = data.get("up_to_message_id")
+                up_to = int(up_to) if up_to is not None else None
+                up_to_seq = data.get("up_to_seq")
+                up_to_seq = int(up_to_seq) if up_to_seq is not None else None
+            except (TypeError, ValueError):
+                up_to = up_to_seq = None
+            if up_to is None and up_to_seq is None:
+                await self.send_error("up_to_seq or up_to_message_id is required", thread_id)
+                return
+            if kind == ephemeral.READ:
+                if up_to_seq is None:
+                    # message ids are not ordered under write-behind; cursors keep seqs
+                    try:
+                        up_to_seq = await database_sync_to_async(UnreadCounterService.message_seq)(thread_id, up_to)
+                    except Message.DoesNotExist:
+                        await self.send_error("Message not found", thread_id)
+                        return
+                    # a message older than seq numbers: every such message counts as read
+                    up_to_seq = up_to_seq or 0
+                if not await ephemeral.advance_read_cursor(thread_id, user_id, up_to_seq):
+                    return
+                event["type"] = "chat_read"
+            event["up_to_message_id"] = up_to
+            event["up_to_seq"] = up_to_seq
+
+        await self.broadcast(thread_id, participants, event)
+
+    async def buffer_message(self, thread_id, participants, sender_id, content):
+        """Broadcast first, persist later through the write-behind buffer."""
+        sender_card = self.get_sender_card(participants, sender_id)
+        msg = Message(
+            id=await message_ids.next_id(),
+            thread_id=thread_id,
+            sender_id=sender_card["user_id"],
+            content=content,
+            message_type=Message.MESSAGE_TEXT,
+            seq=await allocate_thread_seq(thread_id),
+        )
+        await self.broadcast(
+            thread_id, participants,
+            {"type": "chat_message", "message": build_message_payload(msg, sender_card)},
+        )
+        await message_buffer.add(msg)
+
+    @database_sync_to_async
+    def save_attachment(self, thread_id, participants, sender_id, name, data):
+        sender_card = self.get_sender_card(participants, sender_id)
+        attachment = create_attachment_from_bytes(sender_card["user_id"], thread_id, name, data)
+        return attachment.token
+
+    @database_sync_to_async
+    def save_message(self, thread_id, participants, sender_id, content, attachment_b64=None, attachment_token=None):
+        # INSERT + inbox UPDATE in one transaction; sender and thread are never re-read
+        sender_card = self.get_sender_card(participants, sender_id)
+        upload = None
+        attachment = None
+        if attachment_token:
+            upload = claim_attachment(attachment_token, sender_card["user_id"], thread_id)
+            attachment = upload.file.name
+        elif attachment_b64:
+            try:
+                format, imgstr = attachment_b64.split(";base64,")
+                ext = format.split("/")[-1]
+                attachment = ContentFile(base64.b64decode(imgstr), name=f"msg_{sender_card['user_id']}.{ext}")
+            except Exception:
+                raise AttachmentError("Invalid base64 image")
+
+        with transaction.atomic():
+            msg = Message.objects.create(
+                thread_id=thread_id,
+                sender_id=sender_card["user_id"],
+                content=content or "",
+                message_type=Message.MESSAGE_IMAGE if attachment else Message.MESSAGE_TEXT,
+                attachment=attachment,
+                seq=next_thread_seq(thread_id),
+            )
+            ChatThread.record_messages([msg])
+            index_messages([msg])
+            UnreadCounterService.record_messages([msg], {thread_id: tuple(participants)})
+            if upload is not None:
+                ChatAttachment.objects.filter(pk=upload.pk).update(message=msg)
+        return build_message_payload(msg, sender_card)
+
+    @database_sync_to_async
+    def save_reaction(self, thread_id, user_id, message_id, reaction_type):
+        max_length = MessageReaction._meta.get_field("reaction").max_length
+        if not isinstance(reaction_type, str) or not 0 < len(reaction_type) <= max_length:
+            raise ValueError("Invalid reaction")
+        seq = next_thread_seq(thread_id)
+        counts = upsert_reaction(thread_id, message_id, user_id, reaction_type, seq)
+        if counts is None:
+            raise Message.DoesNotExist("Message not found in this thread")
+        return {
+            "message_id": message_id,
+            "user_id": user_id,
+            "reaction": reaction_type,
+            "seq": seq,
+            "reaction_counts": counts,
+        }
+
+
+class ChatConsumer(ThreadEventsMixin, AsyncWebsocketConsumer):
+    """One socket per thread (ws/chat/<thread_id>/). Prefer UserConsumer."""
+
+    async def connect(self):
+        self.thread_id = int(self.scope["url_route"]["kwargs"]["thread_id"])
+        self.room_group_name = f"chat_{self.thread_id}"
+
+        user = self.scope.get("user", None)
+        if user is None or not user.is_authenticated:
+            await self.close()
+            return
+
+        # thread membership and sender cards are loaded once per connection
+        self.participants = await database_sync_to_async(load_thread_participants)(self.thread_id)
+        if user.pk not in self.participants:
+            self.participants = None
+            await self.close()
+            return
+
+        self.start_session()
+        await self.channel_layer.group_add(self.room_group_name, self.channel_name)
+        await self.accept()
+        await self.go_online()
+        logger.info(f"WebSocket connected: thread {self.thread_id}")
+
+    async def disconnect(self, close_code):
+        if not getattr(self, "participants", None):
+            return
+        self.end_session()
+        await self.channel_layer.group_discard(self.room_group_name, self.channel_name)
+        await self.go_offline()
+        logger.info(f"WebSocket disconnected: thread {self.thread_id} code={close_code}")
+
+    async def receive(self, text_data=None, bytes_data=None):
+        if bytes_data:
+            if not await self.admit("attachment"):
+                return
+            try:
+                header, payload = parse_attachment_frame(bytes_data)
+            except AttachmentError as e:
+                await self.send_error(str(e))
+                return
+            await self.handle_attachment_frame(self.thread_id, self.participants, header, payload)
+            return
+        if not text_data:
+            return
+
+        data = parse_frame(text_data)
+        msg_type = data.get("type", "message") if data is not None else None
+        if not await self.admit(msg_type):
+            return
+        if data is None:
+            await self.send_error("Invalid JSON")
+            return
+
+        if msg_type == "message":
+            await self.handle_message(self.thread_id, self.participants, data)
+        elif msg_type == "reaction":
+            await self.handle_reaction(self.thread_id, self.participants, data)
+        elif msg_type in ephemeral.EVENT_TYPES:
+            await self.handle_ephemeral(self.thread_id, self.participants, data)
+        elif msg_type == "sync":
+            await self.handle_sync(self.thread_id, self.participants, data)
+        elif msg_type == "ack":
+            await self.handle_ack(self.thread_id, self.participants, data)
 
     async def chat_message(self, event):
-        await self.send(json.dumps(event["message"]))
+        await self.send_tracked(self.thread_id, event["message"].get("seq"), json.dumps(event["message"]))
 
     async def chat_reaction(self, event):
-        await self.send(json.dumps({"reaction": event["reaction"]}))
+        await self.send_tracked(self.thread_id, event["reaction"].get("seq"), json.dumps({"reaction": event["reaction"]}))
 
-    @database_sync_to_async
-    def save_message(self, sender_id, content, message_type, attachment):
-        # use pk lookups so custom user PK name doesn't matter
-        sender = User.objects.get(pk=sender_id)
-        thread = ChatThread.objects.get(pk=self.thread_id)
-        # thread.user_a_id and thread.user_b_id are the integer FK columns; compare with sender.pk
-        if sender.pk not in (thread.user_a_id, thread.user_b_id):
-            raise PermissionError("Sender is not in the thread")
+    async def chat_ephemeral(self, event):
+        if event["event"] == ephemeral.TYPING and event["user_id"] == self.get_user_id():
+            return
+        await self.send(json.dumps({
+            "type": event["event"],
+            "thread_id": self.thread_id,
+            **{k: v for k, v in event.items() if k in ("user_id", "is_typing", "up_to_message_id", "up_to_seq")},
+        }))
+
+    async def chat_read(self, event):
+        await self.send(json.dumps({
+            "type": "read",
+            "thread_id": self.thread_id,
+            "user_id": event["user_id"],
+            "up_to_message_id": event["up_to_message_id"],
+            "up_to_seq": event.get("up_to_seq"),
+        }))
+
+
+class UserConsumer(ThreadEventsMixin, AsyncWebsocketConsumer):
+    """
+    One socket per user (ws/user/) carrying all of their threads,
+    notifications and presence. Every frame names its thread:
+
+        {"type": "message", "thread_id": 12, "message": "hi"}
+        {"type": "reaction", "thread_id": 12, "reaction": {"message_id": 5, "reaction": "like"}}
+        {"type": "typing", "thread_id": 12, "is_typing": true}
+        {"type": "read", "thread_id": 12, "up_to_seq": 43}
+        {"type": "sync", "thread_id": 12, "since_seq": 40}
+        {"type": "ack", "thread_id": 12, "seq": 44}
+
+    Binary attachment frames carry "thread_id" in their JSON header.
+    Connect with ?ack=1 to have unacknowledged messages and reactions resent.
 
-        msg = Message.objects.create(
-            thread=thread,
-            sender=sender,
-            content=content or "",
-            message_type=message_type,
-            attachment=attachment
+    The socket opens with {"type": "notifications", "notifications": [...],
+    "unread_count": N} and then gets a "notification" frame with the
+    unread_delta for every notification created, updated, read or deleted.
+    """
+
+    # threads whose participants are kept in memory per connection
+    MAX_CACHED_THREADS = 256
+
+    async def connect(self):
+        user = self.scope.get("user", None)
+        if user is None or not user.is_authenticated:
+            await self.close()
+            return
+
+        self.user_id = user.pk
+        self.group_name = f"user_{self.user_id}"
+        self.threads = {}
+        self.start_session()
+
+        await self.channel_layer.group_add(self.group_name, self.channel_name)
+        await self.accept()
+        snapshot = await database_sync_to_async(notifications.snapshot)(self.user_id)
+        await self.send(json.dumps({"type": "notifications", **snapshot}))
+        await self.go_online()
+        logger.info(f"WebSocket connected: user {self.user_id}")
+
+    async def disconnect(self, close_code):
+        if not hasattr(self, "group_name"):
+            return
+        self.end_session()
+        await self.channel_layer.group_discard(self.group_name, self.channel_name)
+        await self.go_offline()
+        logger.info(f"WebSocket disconnected: user {self.user_id} code={close_code}")
+
+    async def send_error(self, error, thread_id=None, **extra):
+        await self.send(json.dumps({"type": "error", "thread_id": thread_id, "error": error, **extra}))
+
+    async def get_thread(self, thread_id):
+        """Participants of a thread this user belongs to, or None."""
+        try:
+            thread_id = int(thread_id)
+        except (TypeError, ValueError):
+            return None, None
+        participants = self.threads.get(thread_id)
+        if participants is None:
+            participants = await database_sync_to_async(load_thread_participants)(thread_id)
+            if self.user_id not in participants:
+                return thread_id, None
+            if len(self.threads) >= self.MAX_CACHED_THREADS:
+                self.threads.pop(next(iter(self.threads)))
+            self.threads[thread_id] = participants
+        return thread_id, participants
+
+    async def receive(self, text_data=None, bytes_data=None):
+        if bytes_data:
+            if not await self.admit("attachment"):
+                return
+            try:
+                header, payload = parse_attachment_frame(bytes_data)
+            except AttachmentError as e:
+                await self.send_error(str(e))
+                return
+            thread_id, participants = await self.get_thread(header.get("thread_id"))
+            if participants is None:
+                await self.send_error("Unknown thread", thread_id, client_ref=header.get("client_ref"))
+                return
+            await self.handle_attachment_frame(thread_id, participants, header, payload)
+            return
+        if not text_data:
+            return
+
+        data = parse_frame(text_data)
+        msg_type = data.get("type", "message") if data is not None else None
+        if not await self.admit(msg_type):
+            return
+        if data is None:
+            await self.send_error("Invalid JSON")
+            return
+
+        handler = {
+            "message": self.handle_message,
+            "reaction": self.handle_reaction,
+            "sync": self.handle_sync,
+            "ack": self.handle_ack,
+            **dict.fromkeys(ephemeral.EVENT_TYPES, self.handle_ephemeral),
+        }.get(msg_type)
+        if handler is None:
+            await self.send_error(f"Unknown frame type: {msg_type}")
+            return
+
+        thread_id, participants = await self.get_thread(data.get("thread_id"))
+        if participants is None:
+            await self.send_error("Unknown thread", thread_id)
+            return
+        await handler(thread_id, participants, data)
+
+    async def chat_message(self, event):
+        thread_id, message = event["thread_id"], event["message"]
+        await self.send_tracked(
+            thread_id, message.get("seq"), json.dumps({"type": "message", "thread_id": thread_id, "message": message})
         )
-        msg = Message.objects.select_related("sender", "thread").prefetch_related("reactions").get(pk=msg.pk)
-        msg._prefetched_reactions = list(msg.reactions.all())
-        return msg
 
-    @database_sync_to_async
-    def save_reaction(self, user_id, message_id, reaction_type):
-        user = User.objects.get(pk=user_id)
-        message = Message.objects.get(pk=message_id)
-        reaction, _ = MessageReaction.objects.update_or_create(
-            message=message,
-            user=user,
-            defaults={"reaction": reaction_type}
+    async def chat_reaction(self, event):
+        thread_id, reaction = event["thread_id"], event["reaction"]
+        await self.send_tracked(
+            thread_id, reaction.get("seq"), json.dumps({"type": "reaction", "thread_id": thread_id, "reaction": reaction})
         )
-        return {"message_id": message_id, "user_id": user_id, "reaction": reaction_type}
 
-    @database_sync_to_async
-    def serialize_message(self, msg):
-        from .serializers import MessageSerializer
-        return MessageSerializer(msg).data
+    async def chat_ephemeral(self, event):
+        if event["event"] == ephemeral.TYPING and event["user_id"] == self.get_user_id():
+            return
+        await self.send(json.dumps({
+            "type": event["event"],
+            "thread_id": event["thread_id"],
+            **{k: v for k, v in event.items() if k in ("user_id", "is_typing", "up_to_message_id", "up_to_seq")},
+        }))
+
+    async def chat_read(self, event):
+        await self.send(json.dumps({
+            "type": "read",
+            "thread_id": event["thread_id"],
+            "user_id": event["user_id"],
+            "up_to_message_id": event["up_to_message_id"],
+            "up_to_seq": event.get("up_to_seq"),
+        }))
+
+    async def presence_update(self, event):
+        await self.send(json.dumps({"type": "presence", "user_id": event["user_id"], "online": event["online"]}))
+
+    async def notification_message(self, event):
+        await self.send(json.dumps({
+            "type": "notification",
+            "event": event.get("event", notifications.CREATED),
+            "notification": event["notification"],
+            "unread_delta": event.get("unread_delta", 0),
+        }))
@@ -0,0 +1,77 @@
+"""
+Ephemeral chat events: typing, delivered and read.
+
+They travel over the channel layer only. Read cursors are additionally kept
+in one Redis hash (thread_id:user_id -> highest seq read) and applied
+to Message.is_read in bulk by chat.tasks.flush_read_cursors, so read and
+typing traffic never writes to the database on the socket path.
+"""
+import logging
+
+from django_redis import get_redis_connection
+
+from .buffer import get_redis
+from .models import ChatThread
+from .services import UnreadCounterService
+
+logger = logging.getLogger(__name__)
+
+TYPING = "typing"
+DELIVERED = "delivered"
+READ = "read"
+EVENT_TYPES = (TYPING, DELIVERED, READ)
+
+READ_CURSORS_KEY = "chat:read_cursors"
+
+# KEYS: cursors hash; ARGV: field, seq. Only moves a cursor forward.
+_ADVANCE_CURSOR = """
+local cur = redis.call('HGET', KEYS[1], ARGV[1])
+if cur and tonumber(cur) >= tonumber(ARGV[2]) then return 0 end
+redis.call('HSET', KEYS[1], ARGV[1], ARGV[2])
+return 1
+"""
+
+# KEYS: cursors hash. Read and clear in one step so no cursor is lost.
+_POP_CURSORS = """
+local cursors = redis.call('HGETALL', KEYS[1])
+redis.call('DEL', KEYS[1])
+return cursors
+"""
+
+
+def cursor_field(thread_id, user_id) -> str:
+    return f"{thread_id}:{user_id}"
+
+
+async def advance_read_cursor(thread_id, user_id, seq) -> bool:
+    """Record that user_id has read thread_id up to seq; False if not newer."""
+    advanced = await get_redis().eval(
+        _ADVANCE_CURSOR, 1, READ_CURSORS_KEY, cursor_field(thread_id, user_id), int(seq)
+    )
+    return bool(advanced)
+
+
+def flush_read_cursors() -> int:
+    """Apply pending read cursors with one bulk UPDATE per (thread, reader)."""
+    client = get_redis_connection("default")
+    raw = client.eval(_POP_CURSORS, 1, READ_CURSORS_KEY)
+    cursors = {}
+    for field, seq in zip(raw[::2], raw[1::2]):
+        thread_id, user_id = (int(part) for part in field.decode().split(":"))
+        cursors[(thread_id, user_id)] = int(seq)
+    if not cursors:
+        return 0
+
+    threads = ChatThread.objects.only("id", "user_a_id", "user_b_id").in_bulk({t for t, _ in cursors})
+    marked = 0
+    for (thread_id, user_id), seq in cursors.items():
+        thread = threads.get(thread_id)
+        if thread is None:
+            continue
+        try:
+            marked += UnreadCounterService.mark_read(user_id, thread, up_to_seq=seq)
+        except Exception:
+            logger.exception("Failed to apply read cursor %s:%s", thread_id, user_id)
+            # put it back for the next run unless a newer cursor arrived meanwhile
+            client.eval(_ADVANCE_CURSOR, 1, READ_CURSORS_KEY, cursor_field(thread_id, user_id), seq)
+    return marked
@@ -0,0 +1,59 @@
+import json
+import time
+import uuid
+
+from asgiref.sync import async_to_sync
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+
+from chat.models import ChatThread
+from chat.routing import websocket_urlpatterns
+
+User = get_user_model()
+
+IN_MEMORY_LAYERS = {"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}}
+
+
+class Command(BaseCommand):
+    help = "Measure ChatConsumer messages per second for a single worker"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--messages", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        suffix = uuid.uuid4().hex[:8]
+        sender = User.objects.create(email=f"bench-a-{suffix}@example.com", username=f"bench_a_{suffix}")
+        receiver = User.objects.create(email=f"bench-b-{suffix}@example.com", username=f"bench_b_{suffix}")
+        thread = ChatThread.get_or_create_thread(sender, receiver)
+        try:
+            # measure the write path, not the rate limiter
+            with override_settings(
+                CHANNEL_LAYERS=IN_MEMORY_LAYERS, CHAT_RATE_LIMIT_PER_SECOND=0, CHAT_USER_RATE_LIMIT_PER_SECOND=0
+            ):
+                elapsed = async_to_sync(self.run_benchmark)(thread.pk, sender, options["messages"])
+            rate = options["messages"] / elapsed
+            self.stdout.write(f"{options['messages']} messages in {elapsed:.2f}s -> {rate:.1f} msg/s per worker")
+        finally:
+            # cascades to the thread and its messages
+            User.objects.filter(pk__in=[sender.pk, receiver.pk]).delete()
+
+    async def run_benchmark(self, thread_id, sender, count):
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), f"/ws/chat/{thread_id}/")
+        communicator.scope["user"] = sender
+        connected, _ = await communicator.connect()
+        if not connected:
+            raise RuntimeError("WebSocket connection was rejected")
+
+        started = time.perf_counter()
+        for i in range(count):
+            await communicator.send_to(text_data=json.dumps({"type": "message", "message": f"benchmark {i}"}))
+            reply = json.loads(await communicator.receive_from(timeout=10))
+            if "error" in reply:
+                raise RuntimeError(reply["error"])
+        elapsed = time.perf_counter() - started
+
+        await communicator.disconnect()
+        return elapsed
@@ -0,0 +1,287 @@
+import asyncio
+import itertools
+import json
+import random
+import resource
+import time
+import uuid
+
+from asgiref.sync import async_to_sync
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import override_settings
+
+from account.middleware import IDENTITY_FIELDS, WebSocketUser
+from chat.models import ChatThread
+from chat.routing import websocket_urlpatterns
+
+User = get_user_model()
+
+IN_MEMORY_LAYERS = {"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}}
+PAGE_SIZE = resource.getpagesize()
+
+
+def rss_mb() -> float:
+    """Current resident set size (Linux /proc), else the peak from getrusage."""
+    try:
+        with open("/proc/self/statm") as fh:
+            return int(fh.read().split()[1]) * PAGE_SIZE / 1024 / 1024
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def percentile(sorted_values, pct) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class QueryCounter:
+    """connection.execute_wrapper hook counting SQL statements."""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class Stats:
+    def __init__(self):
+        self.sent = 0
+        self.delivered = 0
+        self.errors = 0
+        self.throttled = 0
+        self.latencies = []   # seconds, sender send -> recipient receive
+        self.window = []      # latencies since the last soak sample
+        self.pending = {}     # token -> send time
+
+    def delivered_after(self, latency):
+        self.delivered += 1
+        self.latencies.append(latency)
+        self.window.append(latency)
+
+    def take_window(self):
+        window, self.window = self.window, []
+        return window
+
+
+class Command(BaseCommand):
+    help = (
+        "Load/soak test the chat sockets: N users across M threads sending at a fixed rate "
+        "through WebsocketCommunicator, reporting throughput, latency percentiles, DB queries and RSS"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=20)
+        parser.add_argument("--threads", type=int, default=10)
+        parser.add_argument("--rate", type=float, default=1.0, help="messages per second per user")
+        parser.add_argument("--duration", type=float, default=30.0, help="seconds of sending")
+        parser.add_argument("--layer", choices=["memory", "redis"], default="memory")
+        parser.add_argument("--socket", choices=["user", "thread"], default="user",
+                            help="one ws/user/ socket per user, or one ws/chat/<id>/ socket per user and thread")
+        parser.add_argument("--sample-every", type=float, default=5.0, help="seconds between soak samples")
+        parser.add_argument("--rate-limits", action="store_true", help="keep CHAT_*RATE_LIMIT* settings on")
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        users, threads = options["users"], options["threads"]
+        if users < 2:
+            raise CommandError("--users must be at least 2")
+        if threads < 1 or threads > users * (users - 1) // 2:
+            raise CommandError("--threads must be between 1 and users*(users-1)/2")
+
+        layers = IN_MEMORY_LAYERS if options["layer"] == "memory" else settings.CHANNEL_LAYERS
+        overrides = {"CHANNEL_LAYERS": layers}
+        if not options["rate_limits"]:
+            overrides.update(CHAT_RATE_LIMIT_PER_SECOND=0, CHAT_USER_RATE_LIMIT_PER_SECOND=0)
+
+        rng = random.Random(options["seed"])
+        suffix = uuid.uuid4().hex[:8]
+        created = User.objects.bulk_create([
+            User(email=f"load-{suffix}-{i}@example.com", username=f"load_{suffix}_{i}") for i in range(users)
+        ])
+        user_ids = list(User.objects.filter(email__startswith=f"load-{suffix}-").values_list("pk", flat=True))
+        try:
+            pairs = rng.sample(list(itertools.combinations(user_ids, 2)), threads)
+            thread_ids = [
+                ChatThread.get_or_create_thread(User(pk=a), User(pk=b)).pk for a, b in pairs
+            ]
+            identities = {
+                row["user_id"]: WebSocketUser(row)
+                for row in User.objects.filter(pk__in=user_ids).values(*IDENTITY_FIELDS)
+            }
+            membership = {user_id: [] for user_id in user_ids}
+            for thread_id, (a, b) in zip(thread_ids, pairs):
+                membership[a].append(thread_id)
+                membership[b].append(thread_id)
+
+            counter = QueryCounter()
+            with override_settings(**overrides), connection.execute_wrapper(counter):
+                report = async_to_sync(self.run_load)(identities, membership, counter, options, rng)
+            self.print_report(report, options)
+        finally:
+            # cascades to the threads and their messages
+            User.objects.filter(pk__in=[u.pk for u in created] + user_ids).delete()
+
+    async def run_load(self, identities, membership, counter, options, rng):
+        app = URLRouter(websocket_urlpatterns)
+        stats = Stats()
+        rss_start = rss_mb()
+
+        # open every socket, timing the handshakes
+        sockets = {}  # user_id -> {thread_id or None: communicator}
+        connect_times = []
+        for user_id, thread_ids in membership.items():
+            paths = {None: "/ws/user/"} if options["socket"] == "user" else {
+                thread_id: f"/ws/chat/{thread_id}/" for thread_id in thread_ids
+            }
+            sockets[user_id] = {}
+            for key, path in paths.items():
+                communicator = WebsocketCommunicator(app, path)
+                communicator.scope["user"] = identities[user_id]
+                started = time.perf_counter()
+                connected, _ = await communicator.connect()
+                if not connected:
+                    raise CommandError(f"Socket {path} for user {user_id} was rejected")
+                connect_times.append(time.perf_counter() - started)
+                sockets[user_id][key] = communicator
+        socket_count = sum(len(s) for s in sockets.values())
+
+        readers = [
+            asyncio.ensure_future(self.read_frames(communicator, user_id, stats))
+            for user_id, by_thread in sockets.items() for communicator in by_thread.values()
+        ]
+
+        samples = []
+        queries_before = counter.count
+        started = time.perf_counter()
+        deadline = started + options["duration"]
+        senders = [
+            asyncio.ensure_future(self.send_messages(user_id, membership[user_id], sockets[user_id],
+                                                     options["rate"], deadline, stats, rng))
+            for user_id in membership if membership[user_id]
+        ]
+        sampler = asyncio.ensure_future(self.sample(stats, counter, options["sample_every"], started, samples))
+
+        await asyncio.gather(*senders)
+        # give in-flight messages a moment to arrive
+        drain_until = time.perf_counter() + 5
+        while stats.pending and time.perf_counter() < drain_until:
+            await asyncio.sleep(0.05)
+        elapsed = time.perf_counter() - started
+        sampler.cancel()
+
+        for reader in readers:
+            reader.cancel()
+        for by_thread in sockets.values():
+            for communicator in by_thread.values():
+                await communicator.disconnect()
+
+        return {
+            "sockets": socket_count,
+            "connect_times": sorted(connect_times),
+            "elapsed": elapsed,
+            "queries": counter.count - queries_before,
+            "rss_start": rss_start,
+            "rss_end": rss_mb(),
+            "samples": samples,
+            "stats": stats,
+        }
+
+    async def send_messages(self, user_id, thread_ids, sockets, rate, deadline, stats, rng):
+        interval = 1.0 / rate if rate > 0 else None
+        next_send = time.perf_counter() + rng.random() * (interval or 0)
+        while time.perf_counter() < deadline:
+            if interval:
+                await asyncio.sleep(max(0.0, next_send - time.perf_counter()))
+                next_send += interval
+            thread_id = rng.choice(thread_ids)
+            token = uuid.uuid4().hex
+            frame = {"type": "message", "thread_id": thread_id, "message": f"load {token}"}
+            communicator = sockets.get(None) or sockets[thread_id]
+            stats.pending[token] = time.perf_counter()
+            stats.sent += 1
+            await communicator.send_to(text_data=json.dumps(frame))
+            if not interval:
+                await asyncio.sleep(0)
+
+    async def read_frames(self, communicator, user_id, stats):
+        # read the output queue directly: receive_from() cancels the app on timeout
+        while True:
+            output = await communicator.output_queue.get()
+            if output.get("type") != "websocket.send" or not output.get("text"):
+                continue
+            frame = json.loads(output["text"])
+            kind = frame.get("type")
+            if kind == "throttled":
+                stats.throttled += 1
+                continue
+            if "error" in frame:
+                stats.errors += 1
+                continue
+            payload = frame.get("message") if kind == "message" else frame
+            if not isinstance(payload, dict) or payload.get("sender", {}).get("user_id") in (None, user_id):
+                continue  # echo of our own message, or not a chat message
+            token = payload.get("content", "").rpartition(" ")[2]
+            sent_at = stats.pending.pop(token, None)
+            if sent_at is not None:
+                stats.delivered_after(time.perf_counter() - sent_at)
+
+    async def sample(self, stats, counter, every, started, samples):
+        last_delivered, last_queries, last_time = 0, counter.count, time.perf_counter()
+        while True:
+            await asyncio.sleep(every)
+            now = time.perf_counter()
+            window = sorted(stats.take_window())
+            sample = {
+                "t": now - started,
+                "rate": (stats.delivered - last_delivered) / (now - last_time),
+                "p50": percentile(window, 50),
+                "p99": percentile(window, 99),
+                "queries": counter.count - last_queries,
+                "rss": rss_mb(),
+            }
+            samples.append(sample)
+            self.stdout.write(
+                f"[{sample['t']:7.1f}s] {sample['rate']:8.1f} msg/s  p50 {sample['p50'] * 1000:7.2f} ms  "
+                f"p99 {sample['p99'] * 1000:7.2f} ms  {sample['queries']:6d} queries  RSS {sample['rss']:7.1f} MB"
+            )
+            last_delivered, last_queries, last_time = stats.delivered, counter.count, now
+
+    def print_report(self, report, options):
+        stats = report["stats"]
+        latencies = sorted(stats.latencies)
+        connects = report["connect_times"]
+        ms = 1000
+        self.stdout.write("")
+        self.stdout.write(
+            f"layer={options['layer']} socket={options['socket']} users={options['users']} "
+            f"threads={options['threads']} rate={options['rate']}/s/user duration={options['duration']}s"
+        )
+        self.stdout.write(
+            f"sockets:     {report['sockets']} open, connect p50 {percentile(connects, 50) * ms:.2f} ms "
+            f"p99 {percentile(connects, 99) * ms:.2f} ms"
+        )
+        self.stdout.write(
+            f"messages:    {stats.sent} sent, {stats.delivered} delivered, {len(stats.pending)} lost, "
+            f"{stats.throttled} throttled, {stats.errors} errors"
+        )
+        self.stdout.write(f"throughput:  {stats.delivered / report['elapsed']:.1f} msg/s delivered")
+        self.stdout.write(
+            "latency:     " + "  ".join(
+                f"p{pct} {percentile(latencies, pct) * ms:.2f} ms" for pct in (50, 90, 95, 99)
+            ) + f"  max {(latencies[-1] if latencies else 0) * ms:.2f} ms"
+        )
+        per_message = report["queries"] / stats.sent if stats.sent else 0
+        self.stdout.write(f"db queries:  {report['queries']} total, {per_message:.2f} per message")
+        self.stdout.write(
+            f"rss:         {report['rss_start']:.1f} MB -> {report['rss_end']:.1f} MB, "
+            f"peak {max([report['rss_end']] + [sample['rss'] for sample in report['samples']]):.1f} MB"
+        )
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from chat.models import Message, MessageSearchTerm
+from chat.search import index_messages
+
+
+class Command(BaseCommand):
+    help = "(Re)build the chat search postings, e.g. for messages written before the index existed"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--thread", type=int, help="only this thread")
+        parser.add_argument("--chunk-size", type=int, default=2000)
+
+    def handle(self, *args, **options):
+        messages = Message.objects.only("id", "thread_id", "content").order_by("id")
+        if options["thread"]:
+            messages = messages.filter(thread_id=options["thread"])
+
+        last_id, indexed, postings = 0, 0, 0
+        while True:
+            chunk = list(messages.filter(id__gt=last_id)[:options["chunk_size"]])
+            if not chunk:
+                break
+            with transaction.atomic():
+                MessageSearchTerm.objects.filter(message_id__in=[m.pk for m in chunk]).delete()
+                postings += index_messages(chunk)
+            indexed += len(chunk)
+            last_id = chunk[-1].pk
+
+        self.stdout.write(self.style.SUCCESS(f"Indexed {indexed} messages ({postings} postings)"))
@@ -0,0 +1,78 @@
+# Generated by Django 5.2.6 on 2026-10-19 08:46
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_inbox(apps, schema_editor):
+    ChatThread = apps.get_model("chat", "ChatThread")
+    Message = apps.get_model("chat", "Message")
+    for thread in ChatThread.objects.all().iterator():
+        last = Message.objects.filter(thread_id=thread.pk).order_by("-created_at", "-id").first()
+        if last is None:
+            continue
+        unread = Message.objects.filter(thread_id=thread.pk, is_read=False)
+        ChatThread.objects.filter(pk=thread.pk).update(
+            last_message_id=last.pk,
+            last_message_sender_id=last.sender_id,
+            last_message_type=last.message_type,
+            last_message_snippet=(last.content or "")[:120],
+            last_message_at=last.created_at,
+            unread_count_a=unread.filter(sender_id=thread.user_b_id).count(),
+            unread_count_b=unread.filter(sender_id=thread.user_a_id).count(),
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0003_chatattachment'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatthread',
+            name='last_message_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='chatthread',
+            name='last_message_id',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='chatthread',
+            name='last_message_sender_id',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='chatthread',
+            name='last_message_snippet',
+            field=models.CharField(blank=True, max_length=120),
+        ),
+        migrations.AddField(
+            model_name='chatthread',
+            name='last_message_type',
+            field=models.CharField(blank=True, max_length=20),
+        ),
+        migrations.AddField(
+            model_name='chatthread',
+            name='unread_count_a',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='chatthread',
+            name='unread_count_b',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='chatthread',
+            index=models.Index(fields=['user_a', '-updated_at'], name='chat_chatth_user_a__1e144d_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='chatthread',
+            index=models.Index(fields=['user_b', '-updated_at'], name='chat_chatth_user_b__f37aca_idx'),
+        ),
+        migrations.RunPython(backfill_inbox, migrations.RunPython.noop),
+    ]
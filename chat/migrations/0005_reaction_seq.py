@@ -0,0 +1,48 @@
+# Generated by Django 5.2.6 on 2026-10-19 08:56
+
+from django.db import migrations, models
+
+
+def backfill_seq(apps, schema_editor):
+    """
+    Number every thread that still has messages without a seq, in send order,
+    and drop its Redis counter so the next allocation reseeds from the DB.
+    """
+    Message = apps.get_model("chat", "Message")
+    thread_ids = list(
+        Message.objects.filter(seq__isnull=True).values_list("thread_id", flat=True).distinct()
+    )
+    for thread_id in thread_ids:
+        batch = []
+        messages = Message.objects.filter(thread_id=thread_id).order_by("created_at", "id").only("id")
+        for seq, message in enumerate(messages.iterator(), start=1):
+            message.seq = seq
+            batch.append(message)
+            if len(batch) >= 1000:
+                Message.objects.bulk_update(batch, ["seq"])
+                batch = []
+        Message.objects.bulk_update(batch, ["seq"])
+
+    if thread_ids:
+        try:
+            from django_redis import get_redis_connection
+            get_redis_connection("default").delete(*(f"chat:thread:{t}:seq" for t in thread_ids))
+        except Exception:
+            pass  # counters are only cached when CHAT_WRITE_BEHIND ran
+
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0004_thread_inbox_fields'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='messagereaction',
+            name='seq',
+            field=models.PositiveBigIntegerField(blank=True, null=True),
+        ),
+        migrations.RunPython(backfill_seq, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.6 on 2026-10-19 09:00
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def backfill_reaction_counts(apps, schema_editor):
+    Message = apps.get_model("chat", "Message")
+    MessageReaction = apps.get_model("chat", "MessageReaction")
+    counts = {}
+    rows = MessageReaction.objects.values("message_id", "reaction").annotate(n=Count("id")).order_by()
+    for row in rows.iterator():
+        counts.setdefault(row["message_id"], {})[row["reaction"]] = row["n"]
+    batch = [Message(id=message_id, reaction_counts=value) for message_id, value in counts.items()]
+    Message.objects.bulk_update(batch, ["reaction_counts"], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0005_reaction_seq'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='reaction_counts',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.RunPython(backfill_reaction_counts, migrations.RunPython.noop),
+    ]
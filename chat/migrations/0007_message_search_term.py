@@ -0,0 +1,27 @@
+# Generated by Django 5.2.6 on 2026-10-19 09:04
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0006_message_reaction_counts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MessageSearchTerm',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(max_length=32)),
+                ('count', models.PositiveSmallIntegerField(default=1)),
+                ('message', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_terms', to='chat.message')),
+                ('thread', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_terms', to='chat.chatthread')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['thread', 'term', '-message'], name='chat_messag_thread__fb6a2b_idx')],
+            },
+        ),
+    ]
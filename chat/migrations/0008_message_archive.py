@@ -0,0 +1,44 @@
+# Generated by Django 5.2.6 on 2026-10-19 09:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0007_message_search_term'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatthread',
+            name='archived_message_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='chatthread',
+            name='archived_until',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='MessageArchiveSegment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('file', models.FileField(upload_to='chat_archive')),
+                ('message_count', models.PositiveIntegerField()),
+                ('first_created_at', models.DateTimeField()),
+                ('last_created_at', models.DateTimeField()),
+                ('min_message_id', models.BigIntegerField()),
+                ('max_message_id', models.BigIntegerField()),
+                ('blocks', models.JSONField(default=list)),
+                ('size', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('thread', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archive_segments', to='chat.chatthread')),
+            ],
+            options={
+                'ordering': ['first_created_at'],
+                'indexes': [models.Index(fields=['thread', 'first_created_at'], name='chat_messag_thread__d589d0_idx')],
+            },
+        ),
+    ]
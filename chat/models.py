@@ -1,4 +1,5 @@
-from django.db import models
+import uuid
+from django.db import connection, models
 from django.conf import settings
 from django.utils import timezone
 from django.contrib.auth import get_user_model
@@ -6,14 +7,34 @@ from django.contrib.auth import get_user_model
 User = get_user_model()
 
 class ChatThread(models.Model):
+    SNIPPET_LENGTH = 120
+
     user_a = models.ForeignKey(User, related_name="threads_as_a", on_delete=models.CASCADE)
     user_b = models.ForeignKey(User, related_name="threads_as_b", on_delete=models.CASCADE)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    # denormalized inbox state, written in the same transaction as the message
+    last_message_id = models.BigIntegerField(null=True, blank=True)
+    last_message_sender_id = models.IntegerField(null=True, blank=True)
+    last_message_type = models.CharField(max_length=20, blank=True)
+    last_message_snippet = models.CharField(max_length=SNIPPET_LENGTH, blank=True)
+    last_message_at = models.DateTimeField(null=True, blank=True)
+    unread_count_a = models.PositiveIntegerField(default=0)  # unread by user_a
+    unread_count_b = models.PositiveIntegerField(default=0)  # unread by user_b
+
+    # cold storage stub: messages up to archived_until live in MessageArchiveSegment files
+    archived_until = models.DateTimeField(null=True, blank=True)
+    archived_message_count = models.PositiveIntegerField(default=0)
+
     class Meta:
         unique_together = [("user_a", "user_b")]
-        indexes = [models.Index(fields=["user_a", "user_b"]), models.Index(fields=["updated_at"])]
+        indexes = [
+            models.Index(fields=["user_a", "user_b"]),
+            models.Index(fields=["updated_at"]),
+            models.Index(fields=["user_a", "-updated_at"]),
+            models.Index(fields=["user_b", "-updated_at"]),
+        ]
         ordering = ["-updated_at"]
 
     def __str__(self):
@@ -28,6 +49,64 @@ class ChatThread(models.Model):
             thread, _ = cls.objects.get_or_create(user_a=a, user_b=b)
         return thread
 
+    def unread_count_for(self, user_id) -> int:
+        return self.unread_count_a if user_id == self.user_a_id else self.unread_count_b
+
+    @classmethod
+    def record_messages(cls, messages):
+        """
+        Update last-message fields and the recipients' unread counts for newly
+        inserted messages: one UPDATE per thread. Call it inside the
+        transaction that inserts the messages.
+
+        Hand-written SQL: this runs for every chat message and the equivalent
+        Case/When ORM expression costs more to compile than the query itself.
+        """
+        by_thread = {}
+        for message in messages:
+            by_thread.setdefault(message.thread_id, []).append(message)
+
+        ops = connection.ops
+        table = ops.quote_name(cls._meta.db_table)
+        now = ops.adapt_datetimefield_value(timezone.now())
+        with connection.cursor() as cursor:
+            for thread_id, batch in by_thread.items():
+                last = max(batch, key=lambda m: (m.created_at, m.pk))
+                sent = {}
+                for message in batch:
+                    sent[message.sender_id] = sent.get(message.sender_id, 0) + 1
+
+                # messages sent by user_b are unread for user_a and vice versa
+                when = " ".join("WHEN {} = %s THEN %s" for _ in sent)
+                unread_params = [value for item in sent.items() for value in item]
+                # out-of-order flushes must not move the preview backwards;
+                # every SET expression sees the row as it was before the UPDATE
+                newer = "CASE WHEN last_message_at IS NULL OR last_message_at <= %s THEN %s ELSE {} END"
+                last_at = ops.adapt_datetimefield_value(last.created_at)
+                cursor.execute(
+                    f"UPDATE {table} SET "
+                    f"unread_count_a = unread_count_a + CASE {when.format(*['user_b_id'] * len(sent))} ELSE 0 END, "
+                    f"unread_count_b = unread_count_b + CASE {when.format(*['user_a_id'] * len(sent))} ELSE 0 END, "
+                    f"last_message_id = {newer.format('last_message_id')}, "
+                    f"last_message_sender_id = {newer.format('last_message_sender_id')}, "
+                    f"last_message_type = {newer.format('last_message_type')}, "
+                    f"last_message_snippet = {newer.format('last_message_snippet')}, "
+                    f"last_message_at = {newer.format('last_message_at')}, "
+                    f"updated_at = %s "
+                    f"WHERE id = %s",
+                    [
+                        *unread_params,
+                        *unread_params,
+                        last_at, last.pk,
+                        last_at, last.sender_id,
+                        last_at, last.message_type,
+                        last_at, (last.content or "")[:cls.SNIPPET_LENGTH],
+                        last_at, last_at,
+                        now,
+                        thread_id,
+                    ],
+                )
+
 class Message(models.Model):
     MESSAGE_TEXT = "text"
     MESSAGE_IMAGE = "image"
@@ -40,11 +119,17 @@ class Message(models.Model):
     attachment = models.ImageField(upload_to="chat_attachments", null=True, blank=True)
     is_read = models.BooleanField(default=False)
     is_like = models.BooleanField(default=False)
+    seq = models.PositiveBigIntegerField(null=True, blank=True)  # per-thread sequence number
+    reaction_counts = models.JSONField(default=dict, blank=True)  # {"like": 2}, kept by upsert_reaction
     created_at = models.DateTimeField(default=timezone.now)
 
     class Meta:
         ordering = ["created_at"]
-        indexes = [models.Index(fields=["thread", "created_at"]), models.Index(fields=["sender", "created_at"])]
+        indexes = [
+            models.Index(fields=["thread", "created_at"]),
+            models.Index(fields=["sender", "created_at"]),
+            models.Index(fields=["thread", "seq"]),
+        ]
 
     def __str__(self):
         return f"Message {self.pk} in Thread {self.thread_id}"
@@ -53,7 +138,63 @@ class MessageReaction(models.Model):
     message = models.ForeignKey(Message, related_name="reactions", on_delete=models.CASCADE)
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     reaction = models.CharField(max_length=20)  # like, heart, emoji name
+    seq = models.PositiveBigIntegerField(null=True, blank=True)  # thread sequence of the last change
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
         unique_together = ("message", "user")
+
+
+class MessageSearchTerm(models.Model):
+    """Inverted index posting: `term` occurs `count` times in `message` (see chat.search)."""
+    thread = models.ForeignKey(ChatThread, related_name="search_terms", on_delete=models.CASCADE)
+    message = models.ForeignKey(Message, related_name="search_terms", on_delete=models.CASCADE)
+    term = models.CharField(max_length=32)
+    count = models.PositiveSmallIntegerField(default=1)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["thread", "term", "-message"]),
+        ]
+
+
+class MessageArchiveSegment(models.Model):
+    """
+    Archived messages of one thread: gzip JSONL, one gzip member per block of
+    rows so a page read inflates only the blocks it needs (see chat.archive).
+    Rows are ordered by (created_at, id) like the history pages.
+    """
+    thread = models.ForeignKey(ChatThread, related_name="archive_segments", on_delete=models.CASCADE)
+    file = models.FileField(upload_to="chat_archive")
+    message_count = models.PositiveIntegerField()
+    first_created_at = models.DateTimeField()
+    last_created_at = models.DateTimeField()
+    min_message_id = models.BigIntegerField()
+    max_message_id = models.BigIntegerField()
+    # one entry per block: [offset, length, first created_at (ISO), first id, min id, max id]
+    blocks = models.JSONField(default=list)
+    size = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ["first_created_at"]
+        indexes = [
+            models.Index(fields=["thread", "first_created_at"]),
+        ]
+
+    def __str__(self):
+        return f"Archive segment {self.pk} of Thread {self.thread_id} ({self.message_count} messages)"
+
+
+class ChatAttachment(models.Model):
+    """Attachment uploaded ahead of its message; the message references it by token."""
+    token = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    thread = models.ForeignKey(ChatThread, related_name="attachments", on_delete=models.CASCADE)
+    uploader = models.ForeignKey(User, related_name="chat_attachments", on_delete=models.CASCADE)
+    file = models.ImageField(upload_to="chat_attachments")
+    size = models.PositiveIntegerField(default=0)
+    message = models.OneToOneField(Message, related_name="upload", null=True, blank=True, on_delete=models.SET_NULL)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Attachment {self.token} in Thread {self.thread_id}"
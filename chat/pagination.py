@@ -1,7 +1,95 @@
 # chat/pagination.py
-from rest_framework.pagination import PageNumberPagination
+from django.db.models import Q
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import CursorPagination
 
-class MessagePagination(PageNumberPagination):
+from . import archive
+from .models import Message
+
+
+class MessagePagination:
+    """
+    Keyset pagination over the (thread, created_at) index for infinite scroll.
+
+    ?before=<message_id> returns the page of older messages, ?after=<message_id>
+    the page of newer ones, and no anchor the latest page. Rows are always
+    returned oldest first, like the full history used to be.
+
+    Given the thread, pages that run past the hot rows continue into its
+    archive segments (see chat.archive); archived messages are always older
+    than the hot ones, so the archive simply extends the keyset.
+    """
+    page_size = 30
+    page_size_query_param = "page_size"
+    max_page_size = 100
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except (TypeError, ValueError):
+            raise ValidationError({self.page_size_query_param: "Must be an integer."})
+        return max(1, min(size, self.max_page_size))
+
+    @staticmethod
+    def _anchor(queryset, message_id, param, thread=None):
+        try:
+            message_id = int(message_id)
+        except (TypeError, ValueError):
+            raise ValidationError({param: "Must be a message id."})
+        try:
+            return queryset.filter(pk=message_id).values_list("created_at", "id").get()
+        except Message.DoesNotExist:
+            row = archive.find_message(thread.pk, message_id) if thread is not None else None
+            if row is None:
+                raise ValidationError({param: "Message not found in this thread."})
+            return row["created_at"], row["id"]
+
+    def paginate_queryset(self, queryset, request, thread=None):
+        """Return (page queryset slice as a list, pagination meta)."""
+        size = self.get_page_size(request)
+        before = request.query_params.get("before")
+        after = request.query_params.get("after")
+        if before and after:
+            raise ValidationError({"before": "Use either 'before' or 'after', not both."})
+        if thread is not None and thread.archived_until is None:
+            thread = None  # nothing archived, the hot rows are the whole history
+
+        if after:
+            created_at, pk = self._anchor(queryset, after, "after", thread)
+            rows = []
+            if thread is not None and created_at <= thread.archived_until:
+                rows = archive.rows_after(thread.pk, (created_at, pk), size + 1)
+            if len(rows) <= size:
+                rows += list(
+                    queryset.filter(Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=pk))
+                    .order_by("created_at", "id")[:size + 1 - len(rows)]
+                )
+            has_newer, has_older = len(rows) > size, True
+            rows = rows[:size]
+        else:
+            key = None
+            if before:
+                created_at, pk = key = self._anchor(queryset, before, "before", thread)
+                queryset = queryset.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk))
+            rows = list(queryset.order_by("-created_at", "-id")[:size + 1])
+            if thread is not None and len(rows) <= size:
+                rows += archive.rows_before(thread.pk, key, size + 1 - len(rows))
+            has_older, has_newer = len(rows) > size, bool(before)
+            rows = rows[:size][::-1]
+
+        meta = {
+            "page_size": size,
+            "has_older": has_older,
+            "has_newer": has_newer,
+            "before": rows[0]["id"] if rows else None,
+            "after": rows[-1]["id"] if rows else None,
+        }
+        return rows, meta
+
+
+class ThreadPagination(CursorPagination):
+    """Inbox pages ordered by most recent activity."""
     page_size = 20
     page_size_query_param = "page_size"
     max_page_size = 100
+    ordering = ("-updated_at", "-id")
@@ -0,0 +1,98 @@
+"""
+Online presence for chat sockets.
+
+Each user has a sorted set in Redis of their open connections (several
+devices or tabs may be connected at once): channel name -> last heartbeat.
+A socket refreshes its entry every CHAT_PRESENCE_HEARTBEAT_SECONDS, and
+entries older than CHAT_PRESENCE_TIMEOUT_SECONDS are trimmed, so the
+connections of a worker that died without running disconnect() expire on
+their own. Only the first connection and the last one going away touch the
+database and notify chat partners.
+"""
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db.models import Q
+
+from .buffer import get_redis
+from .models import ChatThread
+
+User = get_user_model()
+
+# KEYS: presence set; ARGV: channel name, now, stale before, TTL.
+# Add the connection; returns the live connections, this one included.
+_CONNECT = """
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[3])
+redis.call('ZADD', KEYS[1], ARGV[2], ARGV[1])
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+return redis.call('ZCARD', KEYS[1])
+"""
+
+# KEYS: presence set; ARGV: channel name, stale before. Returns the live connections left.
+_DISCONNECT = """
+redis.call('ZREM', KEYS[1], ARGV[1])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[2])
+local left = redis.call('ZCARD', KEYS[1])
+if left == 0 then redis.call('DEL', KEYS[1]) end
+return left
+"""
+
+
+def presence_key(user_id) -> str:
+    return f"chat:presence:{user_id}"
+
+
+def stale_before(now=None) -> float:
+    """Heartbeats older than this belong to connections that are gone."""
+    return (now or time.time()) - settings.CHAT_PRESENCE_TIMEOUT_SECONDS
+
+
+async def mark_online(user_id, channel_name) -> bool:
+    """Register a connection; True if the user just came online."""
+    now = time.time()
+    connections = await get_redis().eval(
+        _CONNECT, 1, presence_key(user_id), channel_name, now, stale_before(now),
+        settings.CHAT_PRESENCE_TIMEOUT_SECONDS,
+    )
+    return int(connections) == 1
+
+
+async def heartbeat(user_id, channel_name):
+    """Keep a connection's entry alive."""
+    async with get_redis().pipeline(transaction=True) as pipe:
+        pipe.zadd(presence_key(user_id), {channel_name: time.time()})
+        pipe.expire(presence_key(user_id), settings.CHAT_PRESENCE_TIMEOUT_SECONDS)
+        await pipe.execute()
+
+
+async def mark_offline(user_id, channel_name) -> bool:
+    """Drop a connection; True if the user has no live connection left."""
+    left = await get_redis().eval(_DISCONNECT, 1, presence_key(user_id), channel_name, stale_before())
+    return int(left) == 0
+
+
+async def online_user_ids(user_ids) -> set:
+    """The subset of user_ids with a live socket (one pipeline)."""
+    user_ids = list(user_ids)
+    if not user_ids:
+        return set()
+    since = stale_before()
+    async with get_redis().pipeline(transaction=False) as pipe:
+        for user_id in user_ids:
+            pipe.zcount(presence_key(user_id), since, "+inf")
+        counts = await pipe.execute()
+    return {user_id for user_id, count in zip(user_ids, counts) if count}
+
+
+def chat_partner_ids(user_id) -> list:
+    rows = ChatThread.objects.filter(Q(user_a_id=user_id) | Q(user_b_id=user_id)).values_list(
+        "user_a_id", "user_b_id"
+    )
+    return list({a if b == user_id else b for a, b in rows})
+
+
+def set_online(user_id, online: bool) -> list:
+    """Persist User.is_online and return the partners to notify."""
+    User.objects.filter(pk=user_id).update(is_online=online)
+    return chat_partner_ids(user_id)
@@ -0,0 +1,100 @@
+"""
+Token-bucket rate limiting for chat sockets.
+
+Every frame takes a token from an in-memory bucket of its connection; frames
+that write (messages, reactions, attachments, sync) also take one from the
+sender's bucket in Redis, shared by all of their connections across workers.
+Refusals are counted in the chat:metrics hash (see views.ChatMetricsAPIView).
+"""
+import logging
+import time
+
+from django.conf import settings
+from django_redis import get_redis_connection
+
+from .buffer import get_redis
+
+logger = logging.getLogger(__name__)
+
+METRICS_KEY = "chat:metrics"
+THROTTLED = "throttled"  # refused with a throttle frame
+DROPPED = "dropped"      # refused silently, a throttle frame was sent just before
+CLOSED = "closed"        # sockets closed for sustained abuse
+
+# close code sent to clients that keep sending while throttled
+CLOSE_RATE_LIMITED = 4429
+
+
+class TokenBucket:
+    """In-memory bucket refilled at `rate` tokens per second up to `burst`."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def consume(self, tokens=1) -> bool:
+        if not self.rate:
+            return True
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < tokens:
+            return False
+        self.tokens -= tokens
+        return True
+
+    def retry_after(self, tokens=1) -> float:
+        return max(0.0, (tokens - self.tokens) / self.rate) if self.rate else 0.0
+
+
+# KEYS: bucket hash; ARGV: rate, burst, now. Returns 1 if a token was taken.
+_TAKE_TOKEN = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1]) or burst
+local ts = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+local allowed = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+return allowed
+"""
+
+
+def connection_bucket() -> TokenBucket:
+    return TokenBucket(
+        getattr(settings, "CHAT_RATE_LIMIT_PER_SECOND", 0),
+        getattr(settings, "CHAT_RATE_LIMIT_BURST", 0),
+    )
+
+
+async def take_user_token(user_id) -> bool:
+    """Take a token from the user's cross-worker bucket in Redis."""
+    rate = getattr(settings, "CHAT_USER_RATE_LIMIT_PER_SECOND", 0)
+    if not rate:
+        return True
+    burst = getattr(settings, "CHAT_USER_RATE_LIMIT_BURST", rate)
+    allowed = await get_redis().eval(_TAKE_TOKEN, 1, f"chat:ratelimit:{user_id}", rate, burst, time.time())
+    return bool(allowed)
+
+
+async def record(metric):
+    try:
+        await get_redis().hincrby(METRICS_KEY, metric, 1)
+    except Exception:
+        logger.exception("Failed to record chat metric %s", metric)
+
+
+def read_metrics() -> dict:
+    raw = get_redis_connection("default").hgetall(METRICS_KEY)
+    metrics = dict.fromkeys((THROTTLED, DROPPED, CLOSED), 0)
+    metrics.update({key.decode(): int(value) for key, value in raw.items()})
+    return metrics
@@ -1,6 +1,7 @@
 from django.urls import re_path
-from .consumers import ChatConsumer
+from .consumers import ChatConsumer, UserConsumer
 
 websocket_urlpatterns = [
+    re_path(r"ws/user/$", UserConsumer.as_asgi()),
     re_path(r"ws/chat/(?P<thread_id>\d+)/$", ChatConsumer.as_asgi()),
 ]
@@ -0,0 +1,124 @@
+"""
+Message search over a per-thread inverted index.
+
+Every message's content is split into terms and stored as MessageSearchTerm
+postings (thread, term, message, count) in the same transaction as the
+message. A search only reads the postings of the user's own threads through
+the (thread, term) index, so its cost follows the size of their history, not
+the message table.
+"""
+import math
+import re
+import unicodedata
+from collections import Counter
+
+from django.db.models import Q
+
+from .models import ChatThread, Message, MessageSearchTerm
+from .services import format_datetime
+
+TERM_MIN_LENGTH = 2
+TERM_MAX_LENGTH = MessageSearchTerm._meta.get_field("term").max_length
+MAX_QUERY_TERMS = 8
+MAX_POSTINGS = 5000  # newest postings considered per search
+SEARCH_DEFAULT_LIMIT = 20
+SEARCH_MAX_LIMIT = 100
+SNIPPET_LENGTH = 120
+
+STOP_WORDS = frozenset(
+    "a an and are as at be but by for if in is it of on or so that the this to was we with you".split()
+)
+
+_WORD = re.compile(r"\w+")
+
+
+def normalize(text: str) -> str:
+    """Casefold and strip accents so "Café" and "cafe" index the same."""
+    decomposed = unicodedata.normalize("NFKD", text.casefold())
+    return "".join(ch for ch in decomposed if not unicodedata.combining(ch))
+
+
+def tokenize(text: str) -> Counter:
+    """Term -> occurrences in text."""
+    return Counter(
+        word for word in _WORD.findall(normalize(text or ""))
+        if TERM_MIN_LENGTH <= len(word) <= TERM_MAX_LENGTH and word not in STOP_WORDS
+    )
+
+
+def index_messages(messages):
+    """Write the postings of freshly saved messages; call inside their transaction."""
+    postings = [
+        MessageSearchTerm(thread_id=message.thread_id, message_id=message.pk, term=term, count=count)
+        for message in messages if message.content
+        for term, count in tokenize(message.content).items()
+    ]
+    MessageSearchTerm.objects.bulk_create(postings, batch_size=1000)
+    return len(postings)
+
+
+def make_snippet(content: str, terms) -> str:
+    """SNIPPET_LENGTH characters of content around the first matching term."""
+    folded = normalize(content)
+    positions = [m.start() for m in _WORD.finditer(folded) if m.group() in terms]
+    # normalize() can change the length (ligatures, accents); fall back to the start
+    start = positions[0] if positions and len(folded) == len(content) else 0
+    start = max(0, start - SNIPPET_LENGTH // 4)
+    snippet = content[start:start + SNIPPET_LENGTH].strip()
+    if start > 0:
+        snippet = "…" + snippet
+    if start + SNIPPET_LENGTH < len(content):
+        snippet += "…"
+    return snippet
+
+
+def search_messages(user_id, query: str, thread_id=None, limit=SEARCH_DEFAULT_LIMIT) -> list:
+    """
+    Messages of user_id's threads matching query, best first.
+
+    Ranked by the number of distinct query terms matched, then a tf-idf
+    score where document frequencies come from the user's own postings,
+    then recency.
+    """
+    terms = list(tokenize(query))[:MAX_QUERY_TERMS]
+    if not terms:
+        return []
+    limit = max(1, min(limit, SEARCH_MAX_LIMIT))
+
+    threads = ChatThread.objects.filter(Q(user_a_id=user_id) | Q(user_b_id=user_id))
+    if thread_id is not None:
+        threads = threads.filter(pk=thread_id)
+    postings = list(
+        MessageSearchTerm.objects.filter(thread_id__in=threads.values("id"), term__in=terms)
+        .order_by("-message_id")
+        .values_list("message_id", "term", "count")[:MAX_POSTINGS]
+    )
+    if not postings:
+        return []
+
+    document_frequency = Counter(term for _, term, _ in postings)
+    documents = len({message_id for message_id, _, _ in postings})
+    matched, scores = {}, Counter()
+    for message_id, term, count in postings:
+        matched.setdefault(message_id, set()).add(term)
+        scores[message_id] += (1 + math.log(count)) * math.log(1 + documents / document_frequency[term])
+    ranked = sorted(matched, key=lambda message_id: (len(matched[message_id]), scores[message_id], message_id),
+                    reverse=True)[:limit]
+
+    rows = Message.objects.filter(pk__in=ranked).values("id", "thread_id", "sender_id", "content", "created_at")
+    by_id = {row["id"]: row for row in rows}
+    results = []
+    for message_id in ranked:
+        row = by_id.get(message_id)
+        if row is None:  # deleted since the postings were read
+            continue
+        results.append({
+            "message_id": message_id,
+            "thread_id": row["thread_id"],
+            "sender_id": row["sender_id"],
+            "snippet": make_snippet(row["content"], matched[message_id]),
+            "matched_terms": sorted(matched[message_id]),
+            "score": round(scores[message_id], 4),
+            "created_at": format_datetime(row["created_at"]),
+        })
+    return results
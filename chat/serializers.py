@@ -1,6 +1,11 @@
+from django.db import transaction
 from rest_framework import serializers
 from django.contrib.auth import get_user_model
 from .models import ChatThread, Message, MessageReaction
+from .buffer import next_thread_seq
+from .search import index_messages
+from .services import UnreadCounterService, user_card
+from account.cards import card_of
 
 User = get_user_model()
 
@@ -9,25 +14,23 @@ class SimpleUserSerializer(serializers.ModelSerializer):
         model = User
         fields = ["user_id", "email", "username", "full_name", "profile_pic"]  # updated id → user_id
 
+    def to_representation(self, instance):
+        # same card and picture rule as socket and history payloads
+        return user_card(card_of(instance), self.context.get("request"))
+
 
 
 class MessageSerializer(serializers.ModelSerializer):
     message_id = serializers.IntegerField(source="id", read_only=True)
     sender = SimpleUserSerializer(read_only=True)
-    reactions = serializers.SerializerMethodField()
 
     class Meta:
         model = Message
         fields = [
             "message_id", "thread", "sender", "content", "message_type", "attachment",
-            "is_read", "is_like", "created_at", "reactions"
+            "is_read", "is_like", "seq", "created_at", "reaction_counts"
         ]
-        read_only_fields = ["message_id", "sender", "created_at", "is_read", "reactions"]
-
-    def get_reactions(self, obj):
-        reactions = getattr(obj, "_prefetched_reactions", obj.reactions.all())
-        # r.user_id is correct because MessageReaction.user_id refers to FK column
-        return [{"user_id": r.user_id, "reaction": r.reaction} for r in reactions]
+        read_only_fields = ["message_id", "sender", "seq", "created_at", "is_read", "reaction_counts"]
 
     def validate(self, attrs):
         mt = attrs.get("message_type", Message.MESSAGE_TEXT)
@@ -40,8 +43,13 @@ class MessageSerializer(serializers.ModelSerializer):
     def create(self, validated_data):
         user = self.context["request"].user
         validated_data["sender"] = user
-        message = super().create(validated_data)
-        ChatThread.objects.filter(pk=message.thread_id).update(updated_at=message.created_at)
+        validated_data["seq"] = next_thread_seq(validated_data["thread"].pk)
+        with transaction.atomic():
+            message = super().create(validated_data)
+            ChatThread.record_messages([message])
+            index_messages([message])
+            thread = message.thread
+            UnreadCounterService.record_messages([message], {thread.pk: (thread.user_a_id, thread.user_b_id)})
         return message
 
 
@@ -50,10 +58,11 @@ class ThreadListSerializer(serializers.ModelSerializer):
     thread_id = serializers.IntegerField(source="id", read_only=True)
     other_user = serializers.SerializerMethodField()
     last_message = serializers.SerializerMethodField()
+    unread_count = serializers.SerializerMethodField()
 
     class Meta:
         model = ChatThread
-        fields = ["thread_id", "other_user", "updated_at", "last_message"]
+        fields = ["thread_id", "other_user", "updated_at", "last_message", "unread_count"]
 
     def get_other_user(self, obj):
         request_user = self.context.get("request").user
@@ -63,5 +72,22 @@ class ThreadListSerializer(serializers.ModelSerializer):
         return SimpleUserSerializer(other).data
 
     def get_last_message(self, obj):
-        last = obj.messages.order_by("-created_at").first()
-        return MessageSerializer(last).data if last else None
+        # denormalized on the thread, see ChatThread.record_messages
+        if obj.last_message_id is None:
+            return None
+        return {
+            "message_id": obj.last_message_id,
+            "sender_id": obj.last_message_sender_id,
+            "message_type": obj.last_message_type,
+            "content": obj.last_message_snippet,
+            "created_at": serializers.DateTimeField().to_representation(obj.last_message_at),
+        }
+
+    def get_unread_count(self, obj):
+        return obj.unread_count_for(self.context.get("request").user.pk)
+
+
+
+class AttachmentUploadSerializer(serializers.Serializer):
+    thread = serializers.IntegerField()
+    file = serializers.FileField()
@@ -0,0 +1,390 @@
+import json
+import logging
+import os
+import struct
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.exceptions import ValidationError
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from django.db.models import Count, Q
+from django.utils import timezone
+from django_redis import get_redis_connection
+from PIL import Image
+from rest_framework import serializers
+
+from account.cards import get_user_cards, missing_card, picture_url
+from notification.push import PUSH_QUEUE_KEY, push_event, trim_queue
+
+from .models import ChatAttachment, ChatThread, Message, MessageReaction
+
+logger = logging.getLogger(__name__)
+
+_datetime_field = serializers.DateTimeField()
+
+
+def file_url(name, request=None):
+    """Same URL a serializer FileField renders (absolute when a request is given)."""
+    if not name:
+        return None
+    url = default_storage.url(name)
+    return request.build_absolute_uri(url) if request is not None else url
+
+
+def user_card(card: dict, request=None) -> dict:
+    """The SimpleUserSerializer representation of an account.cards card."""
+    picture = picture_url(card)
+    return {
+        "user_id": card["user_id"],
+        "email": card["email"],
+        "username": card["username"],
+        "full_name": card["full_name"],
+        "profile_pic": request.build_absolute_uri(picture) if picture and request is not None else picture,
+    }
+
+
+def load_thread_participants(thread_id) -> dict:
+    """Return {user_id: user card} for both participants of a thread (empty if missing)."""
+    participants = ChatThread.objects.filter(pk=thread_id).values_list("user_a_id", "user_b_id").first()
+    if participants is None:
+        return {}
+    return {user_id: user_card(card) for user_id, card in get_user_cards(participants).items()}
+
+
+def thread_groups(thread_id, participant_ids) -> list:
+    """
+    Channel-layer groups that receive a thread's events: the legacy
+    per-thread socket group plus each participant's per-user socket group.
+    """
+    return [f"chat_{thread_id}", *(f"user_{user_id}" for user_id in participant_ids)]
+
+
+def format_datetime(value):
+    return _datetime_field.to_representation(value)
+
+
+def build_message_payload(message, sender_card: dict) -> dict:
+    """
+    Build the MessageSerializer representation from an in-memory Message,
+    without re-reading the row or its relations.
+    """
+    return {
+        "message_id": message.pk,
+        "thread": message.thread_id,
+        "sender": sender_card,
+        "content": message.content,
+        "message_type": message.message_type,
+        "attachment": message.attachment.url if message.attachment else None,
+        "is_read": message.is_read,
+        "is_like": message.is_like,
+        "seq": message.seq,
+        "created_at": format_datetime(message.created_at),
+        "reaction_counts": message.reaction_counts or {},
+    }
+
+
+# Message.values() projection for history pages (no model instances; senders come from account.cards)
+MESSAGE_PROJECTION = (
+    "id", "thread_id", "sender_id", "content", "message_type", "attachment", "is_read", "is_like", "seq",
+    "reaction_counts", "created_at",
+)
+
+
+def message_rows_to_payload(rows, request=None) -> list:
+    """Serialize MESSAGE_PROJECTION rows; reactions come from Message.reaction_counts."""
+    rows = list(rows)
+    cards = get_user_cards(row["sender_id"] for row in rows)
+    return [
+        {
+            "message_id": row["id"],
+            "thread": row["thread_id"],
+            "sender": user_card(cards.get(row["sender_id"]) or missing_card(row["sender_id"]), request),
+            "content": row["content"],
+            "message_type": row["message_type"],
+            "attachment": file_url(row["attachment"], request),
+            "is_read": row["is_read"],
+            "is_like": row["is_like"],
+            "seq": row["seq"],
+            "created_at": format_datetime(row["created_at"]),
+            "reaction_counts": row["reaction_counts"] or {},
+        }
+        for row in rows
+    ]
+
+
+# reactions
+
+def upsert_reaction(thread_id, message_id, user_id, reaction, seq):
+    """
+    Set user_id's reaction on a message of thread_id with a single
+    INSERT ... SELECT ... ON CONFLICT, by ids only, and refresh the message's
+    reaction_counts in the same transaction. Returns the new counts, or None
+    if the message is not in the thread.
+    """
+    ops = connection.ops
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {ops.quote_name(MessageReaction._meta.db_table)} "
+                f"(message_id, user_id, reaction, seq, created_at) "
+                f"SELECT id, %s, %s, %s, %s FROM {ops.quote_name(Message._meta.db_table)} "
+                f"WHERE id = %s AND thread_id = %s "
+                f"ON CONFLICT (message_id, user_id) DO UPDATE "
+                f"SET reaction = EXCLUDED.reaction, seq = EXCLUDED.seq, created_at = EXCLUDED.created_at",
+                [user_id, reaction, seq, ops.adapt_datetimefield_value(timezone.now()), message_id, thread_id],
+            )
+            if cursor.rowcount == 0:
+                return None
+        # two participants per thread, so this is at most a couple of rows
+        counts = dict(
+            MessageReaction.objects.filter(message_id=message_id)
+            .values_list("reaction").annotate(n=Count("id")).order_by()
+        )
+        Message.objects.filter(pk=message_id).update(reaction_counts=counts)
+    return counts
+
+
+# reconnect sync
+
+SYNC_DEFAULT_LIMIT = 200
+SYNC_MAX_LIMIT = 500
+
+
+def sync_thread(thread_id, since_seq: int, limit=SYNC_DEFAULT_LIMIT, request=None) -> dict:
+    """
+    Messages and reaction changes of a thread with seq > since_seq, oldest
+    first, at most `limit` of them together. The client stores last_seq and
+    asks again while has_more is true.
+
+    Seqs are taken from Redis before their row commits (and write-behind
+    messages are written up to a flush later), so a missing seq may still
+    show up. last_seq stops before a gap until the change after it is
+    CHAT_SYNC_GAP_GRACE_SECONDS old; by then the missing seq belongs to a
+    rolled-back, dead-lettered or superseded change and is skipped.
+    """
+    limit = max(1, min(int(limit), SYNC_MAX_LIMIT))
+    messages = list(
+        Message.objects.filter(thread_id=thread_id, seq__gt=since_seq)
+        .order_by("seq").values(*MESSAGE_PROJECTION)[:limit + 1]
+    )
+    reactions = list(
+        MessageReaction.objects.filter(message__thread_id=thread_id, seq__gt=since_seq)
+        .order_by("seq").values("message_id", "user_id", "reaction", "seq", "created_at")[:limit + 1]
+    )
+
+    # take the first `limit` changes of both streams, up to a recent gap, so last_seq is a safe cursor
+    changes = sorted((row["seq"], row["created_at"]) for row in messages + reactions)
+    settled_before = timezone.now() - timedelta(seconds=settings.CHAT_SYNC_GAP_GRACE_SECONDS)
+    last_seq, taken = since_seq, 0
+    for seq, created_at in changes[:limit]:
+        if seq > last_seq + 1 and created_at > settled_before:
+            break
+        last_seq, taken = seq, taken + 1
+    has_more = taken == limit and len(changes) > limit
+    messages = [row for row in messages if row["seq"] <= last_seq]
+    reactions = [
+        {field: row[field] for field in ("message_id", "user_id", "reaction", "seq")}
+        for row in reactions if row["seq"] <= last_seq
+    ]
+
+    return {
+        "thread_id": thread_id,
+        "messages": message_rows_to_payload(messages, request),
+        "reactions": reactions,
+        "last_seq": last_seq,
+        "has_more": has_more,
+    }
+
+
+# attachments
+
+ATTACHMENT_MAX_SIZE = getattr(settings, "CHAT_ATTACHMENT_MAX_SIZE", 10 * 1024 * 1024)
+ATTACHMENT_EXTENSIONS = ("jpg", "jpeg", "png", "gif", "webp")
+
+# Binary WebSocket frame: 2-byte big-endian header length, JSON header, raw bytes
+_FRAME_HEADER_LENGTH = struct.Struct("!H")
+
+
+class AttachmentError(Exception):
+    pass
+
+
+def parse_attachment_frame(frame: bytes):
+    """Split a binary attachment frame into (header dict, payload bytes)."""
+    if len(frame) < _FRAME_HEADER_LENGTH.size:
+        raise AttachmentError("Attachment frame is too short")
+    (length,) = _FRAME_HEADER_LENGTH.unpack_from(frame)
+    start = _FRAME_HEADER_LENGTH.size
+    try:
+        header = json.loads(frame[start:start + length])
+    except (UnicodeDecodeError, json.JSONDecodeError):
+        raise AttachmentError("Invalid attachment frame header")
+    if not isinstance(header, dict):
+        raise AttachmentError("Invalid attachment frame header")
+    return header, frame[start + length:]
+
+
+def create_attachment(uploader_id, thread_id, file) -> ChatAttachment:
+    """
+    Validate and store an attachment upload. Blocking (storage write and
+    image check): call it from a worker thread, never the event loop.
+    """
+    name = os.path.basename(file.name or "")
+    ext = name.rsplit(".", 1)[-1].lower() if "." in name else ""
+    if ext not in ATTACHMENT_EXTENSIONS:
+        raise AttachmentError(f"Unsupported attachment type. Allowed: {', '.join(ATTACHMENT_EXTENSIONS)}.")
+    if not file.size or file.size > ATTACHMENT_MAX_SIZE:
+        raise AttachmentError(f"Attachment must be between 1 byte and {ATTACHMENT_MAX_SIZE} bytes.")
+
+    try:
+        file.seek(0)
+        Image.open(file).verify()
+        file.seek(0)
+    except Exception:
+        raise AttachmentError("Attachment is not a valid image.")
+
+    attachment = ChatAttachment(thread_id=thread_id, uploader_id=uploader_id, size=file.size)
+    attachment.file.save(f"msg_{uploader_id}.{ext}", file, save=False)
+    attachment.save()
+    return attachment
+
+
+def create_attachment_from_bytes(uploader_id, thread_id, name, data: bytes) -> ChatAttachment:
+    return create_attachment(uploader_id, thread_id, ContentFile(data, name=name or ""))
+
+
+def claim_attachment(token, uploader_id, thread_id) -> ChatAttachment:
+    """Fetch an unused attachment of this uploader and thread by token."""
+    try:
+        return ChatAttachment.objects.get(
+            token=token, uploader_id=uploader_id, thread_id=thread_id, message__isnull=True
+        )
+    except (ChatAttachment.DoesNotExist, ValueError, ValidationError):
+        raise AttachmentError("Unknown or already used attachment token")
+
+
+# unread counters and read receipts
+
+
+class UnreadCounterService:
+    """
+    Per-user unread counters in one Redis hash, chat:unread:{user_id}
+    (thread_id -> count). Increments are atomic HINCRBYs issued after the
+    message commits; the total badge is a single HVALS. The per-thread
+    counts on ChatThread stay the durable copy.
+    """
+
+    @staticmethod
+    def key(user_id) -> str:
+        return f"chat:unread:{user_id}"
+
+    @staticmethod
+    def _redis():
+        return get_redis_connection("default")
+
+    @classmethod
+    def record_messages(cls, messages, participants=None):
+        """
+        Count new messages for their recipients once the surrounding
+        transaction commits. `participants` maps thread_id to both user ids;
+        threads missing from it are looked up in one query.
+        """
+        participants = dict(participants or {})
+        missing = {m.thread_id for m in messages} - participants.keys()
+        if missing:
+            for row in ChatThread.objects.filter(pk__in=missing).values("id", "user_a_id", "user_b_id"):
+                participants[row["id"]] = (row["user_a_id"], row["user_b_id"])
+
+        increments = {}
+        pushes = []
+        for message in messages:
+            recipients = [user_id for user_id in participants.get(message.thread_id, ()) if user_id != message.sender_id]
+            for user_id in recipients:
+                key = (user_id, message.thread_id)
+                increments[key] = increments.get(key, 0) + 1
+            if recipients:
+                pushes.append(cls._push_event(message, recipients))
+        if increments:
+            transaction.on_commit(lambda: cls._apply(increments, pushes))
+
+    @staticmethod
+    def _push_event(message, recipients) -> str:
+        # one push per thread and device: newer messages replace older ones
+        body = "Sent a photo" if message.message_type == Message.MESSAGE_IMAGE else message.content[:120]
+        return push_event(
+            recipients, body, sender_id=message.sender_id,
+            data={"type": "chat_message", "thread_id": message.thread_id, "message_id": message.pk},
+            collapse_key=f"chat:{message.thread_id}",
+        )
+
+    @classmethod
+    def _apply(cls, increments, pushes=()):
+        pipe = cls._redis().pipeline(transaction=False)
+        for (user_id, thread_id), count in increments.items():
+            pipe.hincrby(cls.key(user_id), thread_id, count)
+        if pushes:
+            pipe.rpush(PUSH_QUEUE_KEY, *pushes)
+            trim_queue(pipe)
+        try:
+            pipe.execute()
+        except Exception:
+            # the ChatThread counts are still right; the badge heals on mark_read
+            logger.exception("Failed to update unread counters")
+
+    @classmethod
+    def counts(cls, user_id) -> dict:
+        """{thread_id: unread count} for every thread with unread messages."""
+        raw = cls._redis().hgetall(cls.key(user_id))
+        return {int(thread_id): int(count) for thread_id, count in raw.items() if int(count) > 0}
+
+    @classmethod
+    def total(cls, user_id) -> int:
+        return sum(int(count) for count in cls._redis().hvals(cls.key(user_id)))
+
+    @staticmethod
+    def message_seq(thread_id, message_id):
+        """seq of a message in the thread (None for rows older than seq); raises Message.DoesNotExist."""
+        return Message.objects.values_list("seq", flat=True).get(pk=message_id, thread_id=thread_id)
+
+    @classmethod
+    def mark_read(cls, user_id, thread: ChatThread, up_to_message_id=None, up_to_seq=None) -> int:
+        """
+        Mark the other participant's messages in `thread` read, up to and
+        including `up_to_seq` or the message `up_to_message_id` (everything
+        when neither is given). One bulk UPDATE; returns the number of
+        messages marked.
+
+        The bound is a seq, not an id: write-behind ids come from
+        per-process blocks, so a later message can have a smaller id.
+        """
+        unread = Message.objects.filter(thread_id=thread.pk, is_read=False).exclude(sender_id=user_id)
+        read = None
+        if up_to_seq is None and up_to_message_id is not None:
+            up_to_seq = cls.message_seq(thread.pk, up_to_message_id)
+            if up_to_seq is None:
+                # rows from before seq existed came from one id sequence
+                read = Q(seq__isnull=True, pk__lte=up_to_message_id)
+        if up_to_seq is not None:
+            # rows without a seq are older than any row with one
+            read = Q(seq__isnull=True) | Q(seq__lte=up_to_seq)
+        with transaction.atomic():
+            if read is None:
+                marked = unread.update(is_read=True)
+                remaining = 0
+            else:
+                marked = unread.filter(read).update(is_read=True)
+                remaining = unread.count()
+            field = "unread_count_a" if user_id == thread.user_a_id else "unread_count_b"
+            ChatThread.objects.filter(pk=thread.pk).update(**{field: remaining})
+            transaction.on_commit(lambda: cls._reset(user_id, thread.pk, remaining))
+        return marked
+
+    @classmethod
+    def _reset(cls, user_id, thread_id, remaining):
+        client = cls._redis()
+        if remaining:
+            client.hset(cls.key(user_id), thread_id, remaining)
+        else:
+            client.hdel(cls.key(user_id), thread_id)
@@ -0,0 +1,26 @@
+from celery import shared_task
+from . import archive
+from .ephemeral import flush_read_cursors as apply_read_cursors
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task
+def flush_read_cursors():
+    """
+    Apply read cursors coalesced in Redis by the WebSocket "read" frames
+    """
+    marked = apply_read_cursors()
+    if marked:
+        logger.info(f"Marked {marked} chat messages read.")
+
+
+@shared_task
+def archive_old_messages():
+    """
+    Move chat messages older than CHAT_ARCHIVE_AFTER_DAYS to archive segments
+    """
+    archived = archive.archive_old_messages()
+    if archived:
+        logger.info(f"Archived {archived} chat messages.")
@@ -1,3 +1,43 @@
-from django.test import TestCase
+from datetime import timedelta
 
-# Create your tests here.
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from account.models import User
+from .models import ChatThread, Message
+from .services import sync_thread
+
+LOCMEM_CACHES = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+
+
+@override_settings(CACHES=LOCMEM_CACHES, CHAT_SYNC_GAP_GRACE_SECONDS=10)
+class SyncThreadGapTests(TestCase):
+    def setUp(self):
+        self.alex = User.objects.create(email="alex@example.com", username="alex")
+        self.sam = User.objects.create(email="sam@example.com", username="sam")
+        self.thread = ChatThread.get_or_create_thread(self.alex, self.sam)
+
+    def write(self, seq, age=0):
+        return Message.objects.create(
+            thread=self.thread, sender=self.alex, content=f"m{seq}", seq=seq,
+            created_at=timezone.now() - timedelta(seconds=age),
+        )
+
+    def synced_seqs(self, since_seq=0):
+        result = sync_thread(self.thread.pk, since_seq)
+        return [message["seq"] for message in result["messages"]], result["last_seq"]
+
+    def test_cursor_stops_before_a_recent_gap(self):
+        # seq 3 is taken but not written yet, e.g. still in the write-behind buffer
+        for seq in (1, 2, 4):
+            self.write(seq)
+        self.assertEqual(self.synced_seqs(), ([1, 2], 2))
+
+        self.write(3)
+        self.assertEqual(self.synced_seqs(since_seq=2), ([3, 4], 4))
+
+    def test_an_old_gap_is_skipped(self):
+        # seq 3 was rolled back or dead-lettered
+        for seq in (1, 2, 4):
+            self.write(seq, age=60)
+        self.assertEqual(self.synced_seqs(), ([1, 2, 4], 4))
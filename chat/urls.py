@@ -1,8 +1,23 @@
 # chat/urls.py
 from django.urls import path
-from .views import ThreadListCreateAPIView, MessageListCreateAPIView
+from .views import (
+    ThreadListCreateAPIView,
+    MessageListCreateAPIView,
+    AttachmentUploadAPIView,
+    ThreadReadAPIView,
+    ThreadSyncAPIView,
+    MessageSearchAPIView,
+    UnreadCountAPIView,
+    ChatMetricsAPIView,
+)
 
 urlpatterns = [
     path("threads/", ThreadListCreateAPIView.as_view(), name="thread-list-create"),
     path("messages/", MessageListCreateAPIView.as_view(), name="message-list-create"),
+    path("attachments/", AttachmentUploadAPIView.as_view(), name="attachment-upload"),
+    path("threads/<int:thread_id>/read/", ThreadReadAPIView.as_view(), name="thread-read"),
+    path("threads/<int:thread_id>/sync/", ThreadSyncAPIView.as_view(), name="thread-sync"),
+    path("search/", MessageSearchAPIView.as_view(), name="message-search"),
+    path("unread/", UnreadCountAPIView.as_view(), name="unread-count"),
+    path("metrics/", ChatMetricsAPIView.as_view(), name="chat-metrics"),
 ]
@@ -1,12 +1,25 @@
 import logging
 from django.shortcuts import get_object_or_404
-from django.core.cache import cache
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
 from rest_framework.views import APIView
 from rest_framework import permissions
 from django.db.models import Q
+from . import ratelimit
 from .models import ChatThread, Message
-from .serializers import ThreadListSerializer, MessageSerializer
-from .pagination import MessagePagination
+from .serializers import ThreadListSerializer, MessageSerializer, AttachmentUploadSerializer
+from .services import (
+    AttachmentError,
+    MESSAGE_PROJECTION,
+    UnreadCounterService,
+    create_attachment,
+    message_rows_to_payload,
+    SYNC_DEFAULT_LIMIT,
+    sync_thread,
+    thread_groups,
+)
+from .search import SEARCH_DEFAULT_LIMIT, search_messages
+from .pagination import MessagePagination, ThreadPagination
 from core.utils import ResponseHandler  
 
 logger = logging.getLogger(__name__)
@@ -16,9 +29,17 @@ class ThreadListCreateAPIView(APIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def get(self, request):
-        threads = ChatThread.objects.filter(Q(user_a=request.user) | Q(user_b=request.user))
-        serializer = ThreadListSerializer(threads, many=True, context={"request": request})
-        return ResponseHandler.success(data=serializer.data)
+        threads = (
+            ChatThread.objects.filter(Q(user_a=request.user) | Q(user_b=request.user))
+            .select_related("user_a", "user_b")
+        )
+        paginator = ThreadPagination()
+        page = paginator.paginate_queryset(threads, request, view=self)
+        serializer = ThreadListSerializer(page, many=True, context={"request": request})
+        return ResponseHandler.success(
+            data=serializer.data,
+            extra={"next": paginator.get_next_link(), "previous": paginator.get_previous_link()},
+        )
 
     def post(self, request):
         other_id = request.data.get("other_user_id")
@@ -49,27 +70,131 @@ class MessageListCreateAPIView(APIView):
         if request.user.pk not in [thread.user_a_id, thread.user_b_id]:
             return ResponseHandler.forbidden(message="You are not a participant in this thread.")
 
-        messages = (
-            Message.objects.filter(thread=thread)
-            .select_related("sender")
-            .order_by("created_at")
+        paginator = self.pagination_class()
+        rows, meta = paginator.paginate_queryset(
+            Message.objects.filter(thread=thread).values(*MESSAGE_PROJECTION), request, thread
         )
-
-        serializer = MessageSerializer(messages, many=True, context={"request": request})
-        return ResponseHandler.success(data=serializer.data)
+        return ResponseHandler.success(data=message_rows_to_payload(rows, request), extra=meta)
 
     def post(self, request):
         serializer = MessageSerializer(data=request.data, context={"request": request})
         serializer.is_valid(raise_exception=True)
-        message = serializer.save()
+        serializer.save()  # unread counters are updated in MessageSerializer.create
+        return ResponseHandler.created(data=serializer.data)
 
-        # Update unread count atomically
-        thread = message.thread
-        receiver_id = thread.user_b_id if message.sender_id == thread.user_a_id else thread.user_a_id
-        key = f"chat:unread:{receiver_id}:{thread.pk}"
-        if cache.get(key) is not None:
-            cache.incr(key, 1)
-        else:
-            cache.set(key, 1, timeout=7*24*3600)
 
-        return ResponseHandler.created(data=serializer.data)
+class AttachmentUploadAPIView(APIView):
+    """
+    Upload an attachment out of band; the returned attachment_token is sent
+    over the WebSocket as {"type": "message", "attachment_token": ...}.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request):
+        serializer = AttachmentUploadSerializer(data=request.data)
+        if not serializer.is_valid():
+            return ResponseHandler.bad_request(errors=serializer.errors)
+
+        thread = get_object_or_404(ChatThread, pk=serializer.validated_data["thread"])
+        if request.user.pk not in [thread.user_a_id, thread.user_b_id]:
+            return ResponseHandler.forbidden(message="You are not a participant in this thread.")
+
+        try:
+            attachment = create_attachment(request.user.pk, thread.pk, serializer.validated_data["file"])
+        except AttachmentError as e:
+            return ResponseHandler.bad_request(message=str(e))
+
+        return ResponseHandler.created(data={
+            "attachment_token": str(attachment.token),
+            "attachment": attachment.file.url,
+        })
+
+
+class ThreadReadAPIView(APIView):
+    """Mark the other participant's messages read, optionally only up to a seq (or a message id)."""
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request, thread_id):
+        thread = get_object_or_404(ChatThread.objects.only("id", "user_a_id", "user_b_id"), pk=thread_id)
+        if request.user.pk not in [thread.user_a_id, thread.user_b_id]:
+            return ResponseHandler.forbidden(message="You are not a participant in this thread.")
+
+        bounds = {}
+        for field, error in (("up_to_seq", "Must be a seq number."), ("up_to_message_id", "Must be a message id.")):
+            value = request.data.get(field)
+            if value is not None:
+                try:
+                    bounds[field] = int(value)
+                except (TypeError, ValueError):
+                    return ResponseHandler.bad_request(errors={field: error})
+
+        try:
+            marked = UnreadCounterService.mark_read(request.user.pk, thread, **bounds)
+        except Message.DoesNotExist:
+            return ResponseHandler.bad_request(errors={"up_to_message_id": "No such message in this thread."})
+        try:
+            channel_layer = get_channel_layer()
+            event = {
+                "type": "chat_read", "thread_id": thread.pk, "user_id": request.user.pk,
+                "up_to_message_id": bounds.get("up_to_message_id"), "up_to_seq": bounds.get("up_to_seq"),
+            }
+            for group in thread_groups(thread.pk, (thread.user_a_id, thread.user_b_id)):
+                async_to_sync(channel_layer.group_send)(group, event)
+        except Exception:
+            # the read state is committed; a missed receipt is not worth a 500
+            logger.exception("Failed to broadcast read receipt for thread %s", thread.pk)
+        return ResponseHandler.success(data={"thread_id": thread.pk, "marked_read": marked})
+
+
+class ThreadSyncAPIView(APIView):
+    """Messages and reactions after ?since_seq=N, for catching up after a reconnect."""
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request, thread_id):
+        thread = get_object_or_404(ChatThread.objects.only("id", "user_a_id", "user_b_id"), pk=thread_id)
+        if request.user.pk not in [thread.user_a_id, thread.user_b_id]:
+            return ResponseHandler.forbidden(message="You are not a participant in this thread.")
+
+        try:
+            since_seq = int(request.query_params.get("since_seq", 0))
+            limit = int(request.query_params.get("limit", SYNC_DEFAULT_LIMIT))
+        except (TypeError, ValueError):
+            return ResponseHandler.bad_request(errors={"since_seq": "since_seq and limit must be integers."})
+
+        return ResponseHandler.success(data=sync_thread(thread.pk, since_seq, limit, request))
+
+
+class MessageSearchAPIView(APIView):
+    """Ranked message ids with snippets for ?q=, across the user's threads or one ?thread=."""
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request):
+        query = request.query_params.get("q", "").strip()
+        if not query:
+            return ResponseHandler.bad_request(errors={"q": "A search query is required."})
+        try:
+            thread_id = request.query_params.get("thread")
+            thread_id = int(thread_id) if thread_id else None
+            limit = int(request.query_params.get("limit", SEARCH_DEFAULT_LIMIT))
+        except (TypeError, ValueError):
+            return ResponseHandler.bad_request(errors={"thread": "thread and limit must be integers."})
+
+        results = search_messages(request.user.pk, query, thread_id, limit)
+        return ResponseHandler.success(data={"query": query, "results": results})
+
+
+class UnreadCountAPIView(APIView):
+    """Total unread badge plus per-thread counts."""
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request):
+        counts = UnreadCounterService.counts(request.user.pk)
+        return ResponseHandler.success(data={"total": sum(counts.values()), "threads": counts})
+
+
+class ChatMetricsAPIView(APIView):
+    """Socket frames refused by the rate limiter (see chat.ratelimit)."""
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        return ResponseHandler.success(data=ratelimit.read_metrics())
@@ -13,13 +13,14 @@ import os
 import django
 from django.core.asgi import get_asgi_application
 from channels.routing import ProtocolTypeRouter, URLRouter
-from channels.auth import AuthMiddlewareStack
 
 # ✅ Set settings before importing anything Django-related
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
 django.setup()
 
 import chat.routing  # safe to import now
+from account.middleware import JWTAuthMiddleware
+from chat.buffer import LifespanApp
 
 # ✅ Only call this once
 django_asgi_app = get_asgi_application()
@@ -36,5 +37,8 @@ django_asgi_app = get_asgi_application()
 
 application = ProtocolTypeRouter({
     "http": django_asgi_app,
-    "websocket": URLRouter(chat.routing.websocket_urlpatterns),
+    # access token validated once per connection, see account/middleware.py
+    "websocket": JWTAuthMiddleware(URLRouter(chat.routing.websocket_urlpatterns)),
+    # flushes write-behind chat messages on worker shutdown
+    "lifespan": LifespanApp(),
 })
\ No newline at end of file
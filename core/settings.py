@@ -170,6 +170,10 @@ STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 MEDIA_URL = "/media/"
 MEDIA_ROOT = BASE_DIR / "media"
 
+# Chunked story uploads (mutual_system.services.StoryUploadService)
+STORY_UPLOAD_CHUNK_SIZE = 4 * 1024 * 1024  # 4 MB per chunk
+STORY_UPLOAD_MAX_SIZE = 200 * 1024 * 1024  # 200 MB per file
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
@@ -252,6 +256,56 @@ CHANNEL_LAYERS = {
     },
 }
 
+# Chat write-behind: broadcast first, persist with bulk_create (needs PostgreSQL)
+CHAT_WRITE_BEHIND = env.bool("CHAT_WRITE_BEHIND", default=False)
+CHAT_WRITE_BEHIND_BATCH_SIZE = 200   # flush every N messages
+CHAT_WRITE_BEHIND_FLUSH_MS = 250     # ... or every M milliseconds
+CHAT_WRITE_BEHIND_MAX_PENDING = 5000 # buffered messages before sends save synchronously
+CHAT_WRITE_BEHIND_MAX_ATTEMPTS = 20  # failed flushes before a message is dead-lettered
+CHAT_SYNC_GAP_GRACE_SECONDS = 10     # sync waits this long for a seq taken but not written yet
+CHAT_ATTACHMENT_MAX_SIZE = 10 * 1024 * 1024  # per chat image upload
+CHAT_READ_CURSOR_FLUSH_SECONDS = 5.0  # read receipts reach Message.is_read this often
+CHAT_PRESENCE_HEARTBEAT_SECONDS = 30  # open sockets refresh their presence entry this often
+CHAT_PRESENCE_TIMEOUT_SECONDS = 90    # ... and count as gone after this long without one
+CHAT_RATE_LIMIT_PER_SECOND = 10       # frames per socket (0 disables)
+CHAT_RATE_LIMIT_BURST = 30
+CHAT_USER_RATE_LIMIT_PER_SECOND = 5   # DB-writing frames per user, all sockets (0 disables)
+CHAT_USER_RATE_LIMIT_BURST = 20
+CHAT_RATE_LIMIT_MAX_STRIKES = 50      # refused frames in a row before closing with 4429
+CHAT_ARCHIVE_AFTER_DAYS = 90          # messages older than this move to cold storage
+CHAT_ARCHIVE_MIN_MESSAGES = 200       # old messages a busy thread needs before it is archived
+CHAT_ARCHIVE_SEGMENT_MESSAGES = 5000  # messages per archive file
+CHAT_ARCHIVE_BLOCK_MESSAGES = 100     # messages per gzip member (the unit a page read inflates)
+CHAT_ARCHIVE_THREADS_PER_RUN = 500
+
+# Notifications are queued in Redis and written in coalesced batches
+NOTIFICATION_FLUSH_SECONDS = 2.0       # queued events become rows this often
+NOTIFICATION_BATCH_SIZE = 1000         # events folded per write
+NOTIFICATION_COALESCE_SECONDS = 3600   # bursts fold into a receiver's unread row this recent
+NOTIFICATION_MAX_ATTEMPTS = 5          # failed writes before an event is dead-lettered
+NOTIFICATION_RETENTION_READ_DAYS = 30
+NOTIFICATION_RETENTION_UNREAD_DAYS = 90
+NOTIFICATION_MAX_PER_USER = 500        # newest rows kept per receiver (0 disables)
+NOTIFICATION_PRUNE_CHUNK_SIZE = 1000   # primary-key range per DELETE
+
+# Push delivery: transports per provider are dotted paths, like EMAIL_BACKEND.
+# Required outside DEBUG, so a deploy cannot silently drop every push.
+PUSH_TRANSPORTS = {
+    "fcm": env("PUSH_FCM_TRANSPORT", default="notification.transports.LocalTransport") if DEBUG
+    else env("PUSH_FCM_TRANSPORT"),
+}
+PUSH_FLUSH_SECONDS = 2.0       # queued pushes are sent this often
+PUSH_BATCH_SIZE = 1000         # events de-duplicated and sent together
+PUSH_QUEUE_MAX = 100000        # queued events kept while delivery is down; the oldest are dropped
+PUSH_MAX_ATTEMPTS = 5
+PUSH_RETRY_BASE_SECONDS = 10   # retries after 10, 20, 40, ... seconds
+
+# RevenueCat webhook events are stored on receipt and applied by a Celery task
+REVENUECAT_EVENT_PROCESS_SECONDS = 5.0
+REVENUECAT_EVENT_BATCH_SIZE = 500      # events applied per run
+REVENUECAT_EVENT_MAX_ATTEMPTS = 10     # runs a failing event is retried for
+ENTITLEMENT_CACHE_MAX_SECONDS = 3600   # entitlements expire with the subscription, or after this
+
 # redis configuration
 CACHES = {
     "default": {
@@ -282,6 +336,38 @@ CELERY_BEAT_SCHEDULE = {
         "task": "mutual_system.tasks.sync_redis_view_counts",
         "schedule": 600.0,  # every 10 minutes
     },
+    "sync_redis_like_counts_every_minute": {
+        "task": "mutual_system.tasks.sync_redis_like_counts",
+        "schedule": 60.0,  # every 1 minute
+    },
+    "cleanup_stale_story_uploads_every_hour": {
+        "task": "mutual_system.tasks.cleanup_stale_story_uploads",
+        "schedule": 3600.0,  # every 1 hour
+    },
+    "flush_chat_read_cursors": {
+        "task": "chat.tasks.flush_read_cursors",
+        "schedule": CHAT_READ_CURSOR_FLUSH_SECONDS,
+    },
+    "flush_notifications": {
+        "task": "notification.tasks.flush_notifications",
+        "schedule": NOTIFICATION_FLUSH_SECONDS,
+    },
+    "deliver_push_notifications": {
+        "task": "notification.tasks.deliver_pushes",
+        "schedule": PUSH_FLUSH_SECONDS,
+    },
+    "prune_notifications_every_hour": {
+        "task": "notification.tasks.prune_notifications",
+        "schedule": 3600.0,  # every 1 hour
+    },
+    "process_revenuecat_events": {
+        "task": "subscription.tasks.process_revenuecat_events",
+        "schedule": REVENUECAT_EVENT_PROCESS_SECONDS,
+    },
+    "archive_old_chat_messages_daily": {
+        "task": "chat.tasks.archive_old_messages",
+        "schedule": 86400.0,  # every day
+    },
 }
 
 
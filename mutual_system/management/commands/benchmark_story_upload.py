@@ -0,0 +1,136 @@
+import gc
+import hashlib
+import io
+import os
+import resource
+import tempfile
+import time
+import tracemalloc
+import uuid
+
+from django.contrib.auth import get_user_model
+from django.core.handlers.wsgi import WSGIRequest
+from django.core.management.base import BaseCommand
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from mutual_system.models import Story, StoryUpload
+from mutual_system.services import STORY_UPLOAD_CHUNK_SIZE
+from mutual_system.views import StoryCreateAPIView, StoryUploadChunkAPIView, StoryUploadFinalizeAPIView, StoryUploadInitAPIView
+
+User = get_user_model()
+BLOCK = 1024 * 1024
+
+
+class MultipartFileStream(io.RawIOBase):
+    """wsgi.input that streams a multipart body from a file on disk."""
+
+    def __init__(self, path, boundary):
+        self.parts = [
+            io.BytesIO(
+                f"--{boundary}\r\nContent-Disposition: form-data; name=\"text\"\r\n\r\nbenchmark\r\n"
+                f"--{boundary}\r\nContent-Disposition: form-data; name=\"media\"; filename=\"bench.mp4\"\r\n"
+                f"Content-Type: video/mp4\r\n\r\n".encode()
+            ),
+            open(path, "rb"),
+            io.BytesIO(f"\r\n--{boundary}--\r\n".encode()),
+        ]
+        self.length = sum(len(p.getvalue()) for p in self.parts[::2]) + os.path.getsize(path)
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        out = b""
+        while self.parts and (size < 0 or len(out) < size):
+            data = self.parts[0].read(-1 if size < 0 else size - len(out))
+            if not data:
+                self.parts.pop(0).close()
+                continue
+            out += data
+        return out
+
+
+def _measure(fn):
+    tracemalloc.start()
+    started = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, peak, elapsed
+
+
+class Command(BaseCommand):
+    help = "Compare peak memory of a large story upload on the multipart path and the chunked upload path"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--size-mb", type=int, default=100)
+
+    def handle(self, *args, **options):
+        size = options["size_mb"] * BLOCK
+        user = User.objects.create(email=f"bench-{uuid.uuid4().hex[:8]}@example.com")
+        fd, path = tempfile.mkstemp(suffix=".mp4")
+        try:
+            with os.fdopen(fd, "wb") as fh:
+                for _ in range(options["size_mb"]):
+                    fh.write(os.urandom(BLOCK))
+
+            _, old_peak, old_time = _measure(lambda: self.multipart_upload(user, path))
+            _, new_peak, new_time = _measure(lambda: self.chunked_upload(user, path, size))
+
+            self.stdout.write(f"file size:        {options['size_mb']} MB, chunk size {STORY_UPLOAD_CHUNK_SIZE // BLOCK} MB")
+            self.stdout.write(f"multipart upload: peak {old_peak / BLOCK:8.2f} MB traced, {old_time:6.2f}s")
+            self.stdout.write(f"chunked upload:   peak {new_peak / BLOCK:8.2f} MB traced, {new_time:6.2f}s")
+            self.stdout.write(f"process max RSS:  {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:8.2f} MB")
+        finally:
+            os.remove(path)
+            for story in Story.objects.filter(user=user):
+                story.media.delete(save=False)
+            StoryUpload.objects.filter(user=user).delete()
+            user.delete()
+
+    def multipart_upload(self, user, path):
+        boundary = uuid.uuid4().hex
+        stream = MultipartFileStream(path, boundary)
+        request = WSGIRequest({
+            "REQUEST_METHOD": "POST",
+            "PATH_INFO": "/v1/mutual-system/create/story/",
+            "CONTENT_TYPE": f"multipart/form-data; boundary={boundary}",
+            "CONTENT_LENGTH": str(stream.length),
+            "SERVER_NAME": "testserver",
+            "SERVER_PORT": "80",
+            "wsgi.input": stream,
+            "wsgi.url_scheme": "http",
+        })
+        request._force_auth_user = user
+        response = StoryCreateAPIView.as_view()(request)
+        request.close()
+        assert response.status_code == 201, response.data
+
+    def chunked_upload(self, user, path, size):
+        factory = APIRequestFactory()
+
+        request = factory.post("/", {"filename": "bench.mp4", "total_size": size}, format="json")
+        force_authenticate(request, user=user)
+        upload_id = StoryUploadInitAPIView.as_view()(request).data["data"]["upload_id"]
+
+        with open(path, "rb") as fh:
+            index = 0
+            while chunk := fh.read(STORY_UPLOAD_CHUNK_SIZE):
+                request = factory.put(
+                    "/", chunk, content_type="application/octet-stream",
+                    HTTP_X_CHUNK_CHECKSUM=hashlib.sha256(chunk).hexdigest(),
+                )
+                force_authenticate(request, user=user)
+                response = StoryUploadChunkAPIView.as_view()(request, upload_id=upload_id, index=index)
+                assert response.status_code == 200, response.data
+                index += 1
+                # DRF request/response objects are reference cycles; collect them
+                # like a worker would between requests so chunks don't pile up.
+                del request, response
+                gc.collect()
+
+        request = factory.post("/")
+        force_authenticate(request, user=user)
+        response = StoryUploadFinalizeAPIView.as_view()(request, upload_id=upload_id)
+        assert response.status_code == 201, response.data
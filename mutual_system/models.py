@@ -61,6 +61,42 @@ class StoryLike(models.Model):
         return f"Like(story={self.story_id}, user={self.user_id})"
 
 
+class StoryUpload(models.Model):
+    """Resumable chunked upload session; the Story is created on finalize."""
+    STATUS_PENDING = "pending"
+    STATUS_COMPLETED = "completed"
+    STATUS_CHOICES = [(STATUS_PENDING, "Pending"), (STATUS_COMPLETED, "Completed")]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='story_uploads')
+    text = models.TextField(blank=True, null=True)
+    filename = models.CharField(max_length=255)
+    total_size = models.PositiveBigIntegerField()
+    chunk_size = models.PositiveIntegerField()
+    received_size = models.PositiveBigIntegerField(default=0)
+    next_chunk = models.PositiveIntegerField(default=0)
+    checksums = models.JSONField(default=list, blank=True)  # sha256 hex per chunk
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    story = models.OneToOneField(Story, on_delete=models.SET_NULL, null=True, blank=True, related_name='upload')
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'updated_at'])]
+
+    @property
+    def temp_name(self) -> str:
+        return f"story_uploads/{self.id}.part"
+
+    @property
+    def extension(self) -> str:
+        return self.filename.rsplit('.', 1)[-1].lower() if '.' in self.filename else ''
+
+    def __str__(self):
+        return f"Upload {self.id} ({self.received_size}/{self.total_size})"
+
+
 # PROFILE SHARING MODEL
 
 class ProfileShare(models.Model):
@@ -0,0 +1,20 @@
+from django.conf import settings
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+
+
+class ChunkParser(BaseParser):
+    """
+    Reads a raw `application/octet-stream` body of at most one upload chunk,
+    bypassing the multipart parser and DATA_UPLOAD_MAX_MEMORY_SIZE buffering.
+    """
+    media_type = "application/octet-stream"
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        if stream is None:
+            return b""
+        limit = getattr(settings, "STORY_UPLOAD_CHUNK_SIZE", 4 * 1024 * 1024)
+        data = stream.read(limit + 1)
+        if len(data) > limit:
+            raise ParseError(f"Chunk exceeds the maximum size of {limit} bytes.")
+        return data
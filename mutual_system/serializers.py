@@ -1,5 +1,5 @@
 from rest_framework import serializers
-from .models import Story
+from .models import Story, StoryUpload
 from .services import get_story_view_count, StoryLikeService
 from rest_framework import serializers
 from django.contrib.auth import get_user_model
@@ -34,9 +34,10 @@ class StorySerializer(serializers.ModelSerializer):
 
     def get_likes_count(self, obj):
         """
-        Returns the total number of likes for the story.
+        Returns the total number of likes for the story,
+        including likes not yet flushed from Redis.
         """
-        return obj.likes_count  # use cached field for efficiency
+        return StoryLikeService.get_likes_count(obj)
 
 
 class CreateStorySerializer(serializers.ModelSerializer):
@@ -55,6 +56,20 @@ class CreateStorySerializer(serializers.ModelSerializer):
 
 
 
+class StoryUploadInitSerializer(serializers.Serializer):
+    filename = serializers.CharField(max_length=255)
+    total_size = serializers.IntegerField(min_value=1)
+    text = serializers.CharField(required=False, allow_blank=True)
+
+
+class StoryUploadSerializer(serializers.ModelSerializer):
+    upload_id = serializers.UUIDField(source='id', read_only=True)
+
+    class Meta:
+        model = StoryUpload
+        fields = ['upload_id', 'filename', 'total_size', 'chunk_size', 'received_size', 'next_chunk', 'status']
+
+
 
 # PROFILE SHARING SERIALIZERS
 
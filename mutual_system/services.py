@@ -235,7 +235,8 @@ class ReportService:
 
 # stories/services/like_service.py
 from django.db import transaction
-from django.db.models import F
+from django.db.models import OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
 from django.shortcuts import get_object_or_404
 from django.utils import timezone
 import logging
@@ -244,41 +245,281 @@ from .models import Story, StoryLike
 
 logger = logging.getLogger(__name__)
 
+# Likes are written to Redis first and flushed to the DB by
+# `mutual_system.tasks.sync_redis_like_counts`:
+#   story:<id>:like_ops    hash  user_id -> "1" (liked) / "0" (unliked), pending vs DB
+#   story:<id>:like_delta  int   pending change to Story.likes_count
+#   story:likes:dirty      set   story ids with pending ops
+LIKE_DIRTY_SET = "story:likes:dirty"
+LIKE_KEYS_TTL = 86400 * 2
+
+
+def _like_ops_key(story_id) -> str:
+    return f"story:{story_id}:like_ops"
+
+
+def _like_delta_key(story_id) -> str:
+    return f"story:{story_id}:like_delta"
+
+
+# KEYS: ops hash, delta counter, dirty set
+# ARGV: user_id, wanted state ("1" like / "0" unlike), DB state ("1"/"0"), story_id, ttl
+_SET_LIKE_STATE = REDIS.register_script("""
+local cur = redis.call('HGET', KEYS[1], ARGV[1])
+local state = cur
+if not state then state = ARGV[3] end
+if state == ARGV[2] then return 0 end
+redis.call('HSET', KEYS[1], ARGV[1], ARGV[2])
+if ARGV[2] == '1' then
+    redis.call('INCR', KEYS[2])
+else
+    redis.call('DECR', KEYS[2])
+end
+redis.call('EXPIRE', KEYS[1], ARGV[5])
+redis.call('EXPIRE', KEYS[2], ARGV[5])
+redis.call('SADD', KEYS[3], ARGV[4])
+return 1
+""")
+
+# Drop flushed ops that were not changed again while the flush ran.
+# KEYS: ops hash, delta counter; ARGV: flushed delta, then user_id/state pairs
+_ACK_LIKE_FLUSH = REDIS.register_script("""
+for i = 2, #ARGV, 2 do
+    if redis.call('HGET', KEYS[1], ARGV[i]) == ARGV[i + 1] then
+        redis.call('HDEL', KEYS[1], ARGV[i])
+    end
+end
+redis.call('DECRBY', KEYS[2], ARGV[1])
+return 1
+""")
+
+
+def get_story_like_delta(story_id) -> int:
+    """Pending (not yet flushed) change to a story's likes_count."""
+    try:
+        delta = REDIS.get(_like_delta_key(story_id))
+        return int(delta) if delta else 0
+    except Exception as e:
+        logger.exception(f"Error fetching story like delta: {e}")
+        return 0
+
 
 class StoryLikeService:
     @staticmethod
-    @transaction.atomic
+    def _set_like_state(story_id: str, user, liked: bool) -> bool:
+        db_liked = StoryLike.objects.filter(story_id=story_id, user=user).exists()
+        changed = _SET_LIKE_STATE(
+            keys=[_like_ops_key(story_id), _like_delta_key(story_id), LIKE_DIRTY_SET],
+            args=[user.pk, "1" if liked else "0", "1" if db_liked else "0", str(story_id), LIKE_KEYS_TTL],
+        )
+        return bool(changed)
+
+    @staticmethod
     def like_story(story_id: str, user):
         story = get_object_or_404(
-            Story,
+            Story.objects.only("id", "user_id"),
             id=story_id,
             expires_at__gt=timezone.now(),
             is_deleted=False
         )
 
-        if story.user == user:
+        if story.user_id == user.pk:
             raise ValueError("You cannot like your own story.")
 
-        obj, created = StoryLike.objects.get_or_create(story=story, user=user)
-        if not created:
+        if not StoryLikeService._set_like_state(story_id, user, liked=True):
             raise ValueError("You have already liked this story.")
-
-        Story.objects.filter(id=story_id).update(likes_count=F("likes_count") + 1)
         return True
 
     @staticmethod
-    @transaction.atomic
     def unlike_story(story_id: str, user):
-        deleted, _ = StoryLike.objects.filter(story_id=story_id, user=user).delete()
-        if not deleted:
+        if not StoryLikeService._set_like_state(story_id, user, liked=False):
             raise ValueError("You have not liked this story yet.")
-
-        Story.objects.filter(id=story_id, likes_count__gt=0).update(likes_count=F("likes_count") - 1)
         return True
 
     @staticmethod
     def is_liked(story, user) -> bool:
         """
         Returns True if the given user has liked the story, False otherwise.
+        Pending likes/unlikes in Redis take precedence over the DB row.
         """
-        return StoryLike.objects.filter(story=story, user=user).exists()
\ No newline at end of file
+        try:
+            state = REDIS.hget(_like_ops_key(story.id), user.pk)
+        except Exception as e:
+            logger.exception(f"Error fetching story like state: {e}")
+            state = None
+        if state is not None:
+            return state == b"1"
+        return StoryLike.objects.filter(story=story, user=user).exists()
+
+    @staticmethod
+    def get_likes_count(story) -> int:
+        return max(story.likes_count + get_story_like_delta(story.id), 0)
+
+    @staticmethod
+    def flush_story_likes(story_id: str) -> int:
+        """
+        Apply pending like ops of one story to StoryLike in bulk and recount
+        Story.likes_count from the rows, so the stored count is exact.
+        Returns the number of ops applied.
+        """
+        ops_key, delta_key = _like_ops_key(story_id), _like_delta_key(story_id)
+        pipe = REDIS.pipeline(transaction=True)
+        pipe.hgetall(ops_key)
+        pipe.get(delta_key)
+        ops, delta = pipe.execute()
+        if not ops:
+            return 0
+
+        liked = [int(uid) for uid, state in ops.items() if state == b"1"]
+        unliked = [int(uid) for uid, state in ops.items() if state == b"0"]
+
+        with transaction.atomic():
+            if Story.objects.filter(id=story_id).exists():
+                if liked:
+                    StoryLike.objects.bulk_create(
+                        [StoryLike(story_id=story_id, user_id=uid) for uid in liked],
+                        ignore_conflicts=True,
+                    )
+                if unliked:
+                    StoryLike.objects.filter(story_id=story_id, user_id__in=unliked).delete()
+
+                likes = (
+                    StoryLike.objects.filter(story_id=OuterRef("id"))
+                    .order_by()
+                    .values("story_id")
+                    .annotate(total=Count("id"))
+                    .values("total")
+                )
+                Story.objects.filter(id=story_id).update(
+                    likes_count=Coalesce(Subquery(likes), Value(0))
+                )
+
+        args = [int(delta or 0)]
+        for uid, state in ops.items():
+            args.extend([uid, state])
+        _ACK_LIKE_FLUSH(keys=[ops_key, delta_key], args=args)
+        return len(ops)
+
+
+
+# chunked story upload services
+import hashlib
+import os
+import uuid
+from django.core.files.storage import default_storage
+from .models import StoryUpload
+
+STORY_UPLOAD_CHUNK_SIZE = getattr(settings, "STORY_UPLOAD_CHUNK_SIZE", 4 * 1024 * 1024)
+STORY_UPLOAD_MAX_SIZE = getattr(settings, "STORY_UPLOAD_MAX_SIZE", 200 * 1024 * 1024)
+STORY_UPLOAD_EXTENSIONS = ("mp4", "jpg", "jpeg", "png")
+
+
+class StoryUploadError(Exception):
+    pass
+
+
+class StoryUploadService:
+    """
+    Chunks are written in place at `index * chunk_size` of a part file in
+    storage, so a retried chunk overwrites itself and a worker never holds
+    more than one chunk in memory.
+    """
+
+    @staticmethod
+    def init_upload(user, filename: str, total_size: int, text: str = None) -> StoryUpload:
+        upload = StoryUpload(
+            user=user,
+            filename=os.path.basename(filename),
+            total_size=total_size,
+            chunk_size=STORY_UPLOAD_CHUNK_SIZE,
+            text=text or None,
+        )
+        if upload.extension not in STORY_UPLOAD_EXTENSIONS:
+            raise StoryUploadError(f"Unsupported file type. Allowed: {', '.join(STORY_UPLOAD_EXTENSIONS)}.")
+        if total_size <= 0 or total_size > STORY_UPLOAD_MAX_SIZE:
+            raise StoryUploadError(f"File size must be between 1 byte and {STORY_UPLOAD_MAX_SIZE} bytes.")
+
+        path = default_storage.path(upload.temp_name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        open(path, "wb").close()
+        upload.save()
+        return upload
+
+    @staticmethod
+    @transaction.atomic
+    def append_chunk(upload_id, user, index: int, data: bytes, checksum: str) -> StoryUpload:
+        upload = get_object_or_404(
+            StoryUpload.objects.select_for_update(),
+            id=upload_id,
+            user=user,
+            status=StoryUpload.STATUS_PENDING,
+        )
+
+        digest = hashlib.sha256(data).hexdigest()
+        if not checksum or digest != checksum.lower():
+            raise StoryUploadError("Chunk checksum mismatch.")
+
+        if index < upload.next_chunk:
+            # retry of a chunk we already stored
+            if upload.checksums[index] == digest:
+                return upload
+            raise StoryUploadError(f"Chunk {index} was already received with different content.")
+        if index != upload.next_chunk:
+            raise StoryUploadError(f"Expected chunk {upload.next_chunk}, got {index}.")
+
+        size = len(data)
+        remaining = upload.total_size - upload.received_size
+        if size == 0 or size > upload.chunk_size or size > remaining:
+            raise StoryUploadError("Invalid chunk size.")
+        if size < upload.chunk_size and size != remaining:
+            raise StoryUploadError("Only the last chunk may be smaller than chunk_size.")
+
+        with open(default_storage.path(upload.temp_name), "r+b") as fh:
+            fh.seek(index * upload.chunk_size)
+            fh.write(data)
+            fh.truncate()
+
+        upload.checksums = upload.checksums + [digest]
+        upload.next_chunk = index + 1
+        upload.received_size += size
+        upload.save(update_fields=["checksums", "next_chunk", "received_size", "updated_at"])
+        return upload
+
+    @staticmethod
+    @transaction.atomic
+    def finalize(upload_id, user) -> Story:
+        upload = get_object_or_404(
+            StoryUpload.objects.select_for_update(),
+            id=upload_id,
+            user=user,
+            status=StoryUpload.STATUS_PENDING,
+        )
+        if upload.received_size != upload.total_size:
+            raise StoryUploadError(
+                f"Upload incomplete: received {upload.received_size} of {upload.total_size} bytes."
+            )
+
+        media_name = default_storage.get_available_name(f"stories/{uuid.uuid4().hex}.{upload.extension}")
+        media_path = default_storage.path(media_name)
+        os.makedirs(os.path.dirname(media_path), exist_ok=True)
+        os.replace(default_storage.path(upload.temp_name), media_path)
+
+        story = Story.objects.create(user=user, text=upload.text, media=media_name)
+        upload.status = StoryUpload.STATUS_COMPLETED
+        upload.story = story
+        upload.save(update_fields=["status", "story", "updated_at"])
+        return story
+
+    @staticmethod
+    def cleanup_stale(max_age_hours: int = 24) -> int:
+        cutoff = timezone.now() - timezone.timedelta(hours=max_age_hours)
+        stale = StoryUpload.objects.filter(status=StoryUpload.STATUS_PENDING, updated_at__lt=cutoff)
+        count = 0
+        for upload in stale.iterator():
+            try:
+                default_storage.delete(upload.temp_name)
+            except Exception as e:
+                logger.exception(f"Error deleting stale upload file {upload.temp_name}: {e}")
+            upload.delete()
+            count += 1
+        return count
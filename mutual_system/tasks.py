@@ -2,7 +2,7 @@ from celery import shared_task
 from django.db.models import F
 from django.utils import timezone
 from .models import Story
-from .services import REDIS
+from .services import REDIS, LIKE_DIRTY_SET, StoryLikeService, StoryUploadService
 import logging
 
 logger = logging.getLogger(__name__)
@@ -29,3 +29,30 @@ def sync_redis_view_counts():
                 REDIS.delete(key)
         except Exception as e:
             logger.exception(f"Error syncing story view count: {e}")
+
+
+@shared_task
+def sync_redis_like_counts():
+    """
+    Periodically flush pending Redis story likes to StoryLike and Story.likes_count
+    """
+    pipe = REDIS.pipeline(transaction=True)
+    pipe.smembers(LIKE_DIRTY_SET)
+    pipe.delete(LIKE_DIRTY_SET)
+    story_ids, _ = pipe.execute()
+    flushed = 0
+    for raw_id in story_ids:
+        story_id = raw_id.decode()
+        try:
+            flushed += StoryLikeService.flush_story_likes(story_id)
+        except Exception as e:
+            # keep the story queued so the next run retries it
+            REDIS.sadd(LIKE_DIRTY_SET, story_id)
+            logger.exception(f"Error syncing story likes for {story_id}: {e}")
+    logger.info(f"Flushed {flushed} story like ops for {len(story_ids)} stories.")
+
+
+@shared_task
+def cleanup_stale_story_uploads():
+    count = StoryUploadService.cleanup_stale()
+    logger.info(f"Cleaned up {count} stale story uploads.")
@@ -4,7 +4,8 @@ from .views import (
     StoryViewAPIView, StoryViewersAPIView, GlobalStoriesAPIView, 
     ShareProfileAPIView, PublicProfileLinkAPIView,
     BlockedUserListView, BlockUserView, UnblockUserView, 
-    CreateReportAPIView, AdminAggregatedReportsAPIView, StoryLikeAPIView, StoryUnlikeAPIView, UserStoriesAPIView
+    CreateReportAPIView, AdminAggregatedReportsAPIView, StoryLikeAPIView, StoryUnlikeAPIView, UserStoriesAPIView,
+    StoryUploadInitAPIView, StoryUploadStatusAPIView, StoryUploadChunkAPIView, StoryUploadFinalizeAPIView
 )
 
 urlpatterns = [
@@ -15,6 +16,12 @@ urlpatterns = [
     path('story/<uuid:story_id>/viewers/', StoryViewersAPIView.as_view(), name='story-viewers'),
     path('story/global/', GlobalStoriesAPIView.as_view(), name='global-stories'),
     
+    # chunked story upload apis
+    path('stories/uploads/', StoryUploadInitAPIView.as_view(), name='story-upload-init'),
+    path('stories/uploads/<uuid:upload_id>/', StoryUploadStatusAPIView.as_view(), name='story-upload-status'),
+    path('stories/uploads/<uuid:upload_id>/chunks/<int:index>/', StoryUploadChunkAPIView.as_view(), name='story-upload-chunk'),
+    path('stories/uploads/<uuid:upload_id>/finalize/', StoryUploadFinalizeAPIView.as_view(), name='story-upload-finalize'),
+    
     # story like and unlike apis
     path('stories/<uuid:story_id>/like/', StoryLikeAPIView.as_view(), name='story-like'),
     path('stories/<uuid:story_id>/unlike/', StoryUnlikeAPIView.as_view(), name='story-unlike'),
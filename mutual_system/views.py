@@ -573,4 +573,93 @@ class UserStoriesAPIView(APIView):
 
         except Exception as e:
             logger.exception(f"Error fetching stories for story_id {story_id}")
-            return ResponseHandler.generic_error(exception=e)
\ No newline at end of file
+            return ResponseHandler.generic_error(exception=e)
+
+
+# ------------------ CHUNKED STORY UPLOAD ------------------
+from django.http import Http404
+from .parsers import ChunkParser
+from .serializers import StoryUploadInitSerializer, StoryUploadSerializer
+from .services import StoryUploadService, StoryUploadError
+from .models import StoryUpload
+
+
+class StoryUploadInitAPIView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        serializer = StoryUploadInitSerializer(data=request.data)
+        if not serializer.is_valid():
+            return ResponseHandler.bad_request(message="Validation failed.", errors=serializer.errors)
+        try:
+            upload = StoryUploadService.init_upload(request.user, **serializer.validated_data)
+            return ResponseHandler.created(
+                message="Upload initialized.",
+                data=StoryUploadSerializer(upload).data
+            )
+        except StoryUploadError as e:
+            return ResponseHandler.bad_request(message=str(e))
+        except Exception as e:
+            logger.exception(f"Error initializing story upload for user {request.user.user_id}")
+            return ResponseHandler.generic_error(exception=e)
+
+
+class StoryUploadStatusAPIView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, upload_id):
+        upload = get_object_or_404(StoryUpload, id=upload_id, user=request.user)
+        return ResponseHandler.success(
+            message="Upload status fetched.",
+            data=StoryUploadSerializer(upload).data
+        )
+
+
+class StoryUploadChunkAPIView(APIView):
+    """
+    PUT one chunk as a raw application/octet-stream body with its sha256
+    hex digest in the `X-Chunk-Checksum` header.
+    """
+    permission_classes = [IsAuthenticated]
+    parser_classes = [ChunkParser]
+
+    def put(self, request, upload_id, index):
+        try:
+            upload = StoryUploadService.append_chunk(
+                upload_id,
+                request.user,
+                index,
+                request.data,
+                request.headers.get("X-Chunk-Checksum", ""),
+            )
+            return ResponseHandler.success(
+                message="Chunk received.",
+                data=StoryUploadSerializer(upload).data
+            )
+        except Http404:
+            return ResponseHandler.not_found(message="Upload not found.")
+        except StoryUploadError as e:
+            return ResponseHandler.conflict(message=str(e))
+        except Exception as e:
+            logger.exception(f"Error storing chunk {index} of upload {upload_id}")
+            return ResponseHandler.generic_error(exception=e)
+
+
+class StoryUploadFinalizeAPIView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, upload_id):
+        try:
+            story = StoryUploadService.finalize(upload_id, request.user)
+            logger.info(f"User {request.user.user_id} posted a story {story.id} via chunked upload")
+            return ResponseHandler.created(
+                message="Story created successfully.",
+                data=StorySerializer(story, context={'request': request}).data
+            )
+        except Http404:
+            return ResponseHandler.not_found(message="Upload not found.")
+        except StoryUploadError as e:
+            return ResponseHandler.bad_request(message=str(e))
+        except Exception as e:
+            logger.exception(f"Error finalizing upload {upload_id}")
+            return ResponseHandler.generic_error(exception=e)
@@ -7,6 +7,9 @@ from django.utils import timezone
 User = get_user_model()
 
 class Notification(models.Model):
+    TYPE_LIKE = "like"
+    NOTIFICATION_TYPES = [(TYPE_LIKE, "Like")]
+
     sender = models.ForeignKey(
         User, on_delete=models.CASCADE, related_name="notifications_sent"
     )
@@ -20,6 +23,10 @@ class Notification(models.Model):
     object_id = models.PositiveIntegerField(null=True, blank=True)
     content_object = GenericForeignKey("content_type", "object_id")
 
+    notification_type = models.CharField(max_length=20, choices=NOTIFICATION_TYPES, default=TYPE_LIKE)
+    # distinct senders folded into this row ("Alex and 12 others ..."); sender is the latest
+    actor_count = models.PositiveIntegerField(default=1)
+    actor_ids = models.JSONField(default=list, blank=True)  # their ids, so a repeat sender is not counted twice
     message = models.TextField()
 
     is_read = models.BooleanField(default=False)
@@ -34,3 +41,26 @@ class Notification(models.Model):
 
     def __str__(self):
         return f"To {self.receiver} from {self.sender}"
+
+
+class DeviceToken(models.Model):
+    """A push token of one app install; a token moves to whoever registers it last."""
+    PROVIDER_FCM = "fcm"
+    PROVIDERS = [(PROVIDER_FCM, "Firebase Cloud Messaging")]
+    PLATFORMS = [("android", "Android"), ("ios", "iOS"), ("web", "Web")]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="device_tokens")
+    token = models.CharField(max_length=255, unique=True)
+    platform = models.CharField(max_length=10, choices=PLATFORMS)
+    provider = models.CharField(max_length=10, choices=PROVIDERS, default=PROVIDER_FCM)
+    is_active = models.BooleanField(default=True)  # cleared when the provider reports the token invalid
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_seen_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["user", "is_active"]),
+        ]
+
+    def __str__(self):
+        return f"{self.platform} device of {self.user_id}"
@@ -0,0 +1,244 @@
+"""
+Batched push delivery.
+
+Producers queue events with queue_pushes() (one RPUSH after commit) or add
+them to a pipeline they already run. notification.tasks.deliver_pushes pops
+the queue in batches and for each batch:
+
+* drops recipients with an open socket when the event is only for offline users,
+* keeps the newest event per (device, collapse_key), so a burst of chat
+  messages in one thread becomes one push per device,
+* sends one multicast per provider and distinct message.
+
+Tokens the provider rejects are deactivated; transient failures are retried
+by notification.tasks.retry_push with exponential backoff. Only a batch
+that fails before anything was sent goes back on the queue, so a retry
+never repeats a push; a multicast that fails is retried on its own.
+"""
+import json
+import logging
+
+from django.conf import settings
+from django.db import transaction
+from django_redis import get_redis_connection
+
+from account.cards import display_name, get_user_cards
+
+from .models import DeviceToken
+from .transports import PushResult, get_transport
+
+logger = logging.getLogger(__name__)
+
+PUSH_QUEUE_KEY = "push:pending"
+
+# KEYS: a Redis list queue; ARGV: batch size. Pop the oldest events in one
+# step. Shared by the push queue and notification.services' pending list.
+POP_BATCH = """
+local events = redis.call('LRANGE', KEYS[1], 0, tonumber(ARGV[1]) - 1)
+redis.call('LTRIM', KEYS[1], #events, -1)
+return events
+"""
+
+
+def push_event(user_ids, body, title=None, sender_id=None, data=None, collapse_key=None, only_offline=True) -> str:
+    """Encode a push for user_ids; without a title, the sender's name is used."""
+    return json.dumps({
+        "users": list(user_ids),
+        "title": title,
+        "sender": sender_id,
+        "body": body,
+        "data": data or {},
+        "collapse_key": collapse_key,
+        "only_offline": only_offline,
+    })
+
+
+def queue_pushes(events):
+    """Queue encoded events once the current transaction commits."""
+    if not events:
+        return
+
+    def push():
+        pipe = get_redis_connection("default").pipeline(transaction=False)
+        pipe.rpush(PUSH_QUEUE_KEY, *events)
+        trim_queue(pipe)
+        try:
+            pipe.execute()
+        except Exception:
+            logger.exception("Failed to queue %s push events", len(events))
+
+    transaction.on_commit(push)
+
+
+def trim_queue(pipe):
+    """
+    Cap the queue at PUSH_QUEUE_MAX, dropping the oldest events, so a
+    delivery outage cannot grow it without bound. Every RPUSH is followed by
+    this in the same pipeline.
+    """
+    pipe.ltrim(PUSH_QUEUE_KEY, -settings.PUSH_QUEUE_MAX, -1)
+
+
+def online_user_ids(client, user_ids) -> set:
+    # imported here: chat.services queues pushes through this module
+    from chat.presence import presence_key, stale_before
+
+    user_ids = list(user_ids)
+    if not user_ids:
+        return set()
+    since = stale_before()
+    pipe = client.pipeline(transaction=False)
+    for user_id in user_ids:
+        pipe.zcount(presence_key(user_id), since, "+inf")
+    return {user_id for user_id, count in zip(user_ids, pipe.execute()) if count}
+
+
+def render(event, cards) -> dict:
+    title = event.get("title")
+    if not title and event.get("sender") in cards:
+        title = display_name(cards[event["sender"]])
+    return {"title": title, "body": event["body"], "data": event["data"], "collapse_key": event["collapse_key"]}
+
+
+def resolve_transports() -> dict:
+    """{provider: transport} for every configured provider; raises on a bad configuration."""
+    return {provider: get_transport(provider) for provider in settings.PUSH_TRANSPORTS}
+
+
+def plan(events, client, transports) -> dict:
+    """
+    Resolve, filter and de-duplicate one batch of decoded events into
+    {(provider, encoded message): [tokens]}. Sends nothing.
+    """
+    online = online_user_ids(client, {user for event in events if event["only_offline"] for user in event["users"]})
+    devices = {}
+    rows = DeviceToken.objects.filter(
+        user_id__in={user for event in events for user in event["users"]}, is_active=True
+    ).values_list("user_id", "token", "provider")
+    for user_id, token, provider in rows:
+        if provider not in transports:
+            logger.warning("No push transport for provider %r; skipping a device", provider)
+            continue
+        devices.setdefault(user_id, []).append((token, provider))
+    if not devices:
+        return {}
+    cards = get_user_cards(event["sender"] for event in events if event["sender"] and not event["title"])
+
+    # queue order, so a newer event with the same collapse key replaces the older one
+    latest = {}
+    for index, event in enumerate(events):
+        message = render(event, cards)
+        collapse = event["collapse_key"] or f"#{index}"
+        for user_id in event["users"]:
+            if event["only_offline"] and user_id in online:
+                continue
+            for token, provider in devices.get(user_id, ()):
+                latest[(token, collapse)] = (provider, message)
+
+    multicasts = {}
+    for (token, _), (provider, message) in latest.items():
+        multicasts.setdefault((provider, json.dumps(message, sort_keys=True)), []).append(token)
+    return multicasts
+
+
+def send_multicasts(multicasts) -> int:
+    """Send planned multicasts; one that fails is retried alone and never stops the others."""
+    delivered = 0
+    for (provider, encoded), tokens in multicasts.items():
+        message = json.loads(encoded)
+        try:
+            delivered += send(provider, tokens, message)
+        except Exception:
+            logger.exception("Push to %s %s devices failed", len(tokens), provider)
+            schedule_retry(provider, tokens, message, 1)
+    return delivered
+
+
+def deliver(events, client=None, transports=None) -> int:
+    """Send one batch of decoded events; returns devices reached."""
+    client = client or get_redis_connection("default")
+    return send_multicasts(plan(events, client, transports or resolve_transports()))
+
+
+def send(provider, tokens, message, attempt=0) -> int:
+    """Multicast in chunks of the transport's max_batch; returns devices reached."""
+    transport = get_transport(provider)
+    delivered = 0
+    for start in range(0, len(tokens), transport.max_batch):
+        chunk = tokens[start:start + transport.max_batch]
+        try:
+            result = transport.send_multicast(chunk, message)
+        except Exception:
+            logger.exception("Push multicast to %s %s devices failed", len(chunk), provider)
+            result = PushResult(failed=chunk)
+        # the chunk is sent; bookkeeping errors must not make it look unsent
+        try:
+            if result.invalid:
+                DeviceToken.objects.filter(token__in=result.invalid).update(is_active=False)
+            if result.failed:
+                schedule_retry(provider, result.failed, message, attempt + 1)
+        except Exception:
+            logger.exception("Failed to record the results of a push to %s %s devices", len(chunk), provider)
+        delivered += len(chunk) - len(result.invalid) - len(result.failed)
+    return delivered
+
+
+def schedule_retry(provider, tokens, message, attempt):
+    if attempt >= settings.PUSH_MAX_ATTEMPTS:
+        logger.warning("Giving up on a push to %s %s devices after %s attempts", len(tokens), provider, attempt)
+        return
+    from .tasks import retry_push
+
+    try:
+        retry_push.apply_async(
+            (provider, tokens, message, attempt),
+            countdown=settings.PUSH_RETRY_BASE_SECONDS * 2 ** (attempt - 1),
+        )
+    except Exception:
+        logger.exception("Failed to schedule a push retry to %s %s devices", len(tokens), provider)
+
+
+_EVENT_KEYS = {"users", "title", "sender", "body", "data", "collapse_key", "only_offline"}
+
+
+def decode(raw) -> list:
+    """Decoded events; malformed ones are dropped, not retried forever."""
+    events = []
+    for item in raw:
+        try:
+            event = json.loads(item)
+        except ValueError:
+            event = None
+        if not isinstance(event, dict) or not _EVENT_KEYS <= event.keys():
+            logger.error("Dropping malformed push event %r", item)
+            continue
+        events.append(event)
+    return events
+
+
+def deliver_pending(batch_size=None) -> int:
+    """Pop queued events batch by batch and deliver them."""
+    batch_size = batch_size or settings.PUSH_BATCH_SIZE
+    try:
+        # before popping anything: a configuration error leaves the queue as it is
+        transports = resolve_transports()
+    except Exception:
+        logger.exception("Push transports are misconfigured; leaving queued pushes in place")
+        return 0
+    client = get_redis_connection("default")
+    delivered = 0
+    while True:
+        raw = client.eval(POP_BATCH, 1, PUSH_QUEUE_KEY, batch_size)
+        if not raw:
+            break
+        try:
+            multicasts = plan(decode(raw), client, transports)
+        except Exception:
+            logger.exception("Failed to prepare %s push events", len(raw))
+            # nothing was sent: back to the head of the queue for the next run, in order
+            client.lpush(PUSH_QUEUE_KEY, *reversed(raw))
+            break
+        delivered += send_multicasts(multicasts)
+        if len(raw) < batch_size:
+            break
+    return delivered
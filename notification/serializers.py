@@ -1,5 +1,5 @@
 from rest_framework import serializers
-from .models import Notification
+from .models import DeviceToken, Notification
 
 class NotificationSerializer(serializers.ModelSerializer):
     sender_name = serializers.SerializerMethodField()
@@ -12,6 +12,8 @@ class NotificationSerializer(serializers.ModelSerializer):
             "sender",
             "sender_name",
             "sender_profile",
+            "notification_type",
+            "actor_count",
             "message",
             "is_read",
             "created_at",
@@ -24,3 +26,9 @@ class NotificationSerializer(serializers.ModelSerializer):
         return obj.sender.profile_pic_url or (
             obj.sender.profile_pic.url if obj.sender.profile_pic else None
         )
+
+
+class DeviceTokenSerializer(serializers.Serializer):
+    # not a ModelSerializer: re-registering an existing token is an update, not a unique error
+    token = serializers.CharField(max_length=255)
+    platform = serializers.ChoiceField(choices=DeviceToken.PLATFORMS)
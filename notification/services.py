@@ -0,0 +1,450 @@
+"""
+Batched, coalescing notification writes.
+
+Producers only append an event to a Redis list once their transaction
+commits (enqueue_notification); notification.tasks.flush_notifications pops
+the list in batches and folds bursts per (receiver, type) into a single row:
+"Alex and 12 others liked your profile". A burst that lands while the
+receiver still has a recent unread row of the same type updates that row
+instead of adding another one.
+
+Every write is pushed to the receiver's ws/user/ socket (group user_<id>)
+as a "notification" frame with the unread-count delta, and the socket opens
+with a snapshot (latest rows + unread count), so clients no longer poll
+NotificationListAPI. The unread count itself is a Redis counter per user,
+moved by the same deltas (see NotificationUnreadCounter).
+
+Rows expire after the read/unread retention periods and every user keeps
+at most NOTIFICATION_MAX_PER_USER of them (notification.tasks.prune_notifications).
+"""
+import json
+import logging
+from datetime import timedelta
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.db.models import Count, Q
+from django.utils import timezone
+from django_redis import get_redis_connection
+from rest_framework import serializers
+
+from account.cards import display_name, get_user_cards, picture_url
+
+from .models import Notification
+from .push import POP_BATCH, push_event, queue_pushes
+
+logger = logging.getLogger(__name__)
+
+PENDING_KEY = "notifications:pending"
+DEAD_LETTER_KEY = "notifications:dead"  # events that kept failing, kept for inspection
+
+VERBS = {
+    Notification.TYPE_LIKE: "liked your profile",
+}
+
+# model the object_id of each type points at, as a ContentType natural key
+CONTENT_MODELS = {
+    Notification.TYPE_LIKE: ("account", "userlike"),
+}
+
+# push events
+CREATED = "created"
+UPDATED = "updated"
+READ = "read"
+READ_ALL = "read_all"
+DELETED = "deleted"
+
+SNAPSHOT_SIZE = 20
+# Notification columns of a payload; the sender comes from account.cards
+PAYLOAD_FIELDS = ("id", "sender_id", "notification_type", "actor_count", "message", "is_read", "created_at")
+
+_datetime_field = serializers.DateTimeField()
+
+
+def enqueue_notification(receiver_id, sender_id, notification_type, object_id=None):
+    """Queue a notification event; it is only pushed if the current transaction commits."""
+    event = json.dumps({
+        "receiver": receiver_id,
+        "sender": sender_id,
+        "type": notification_type,
+        "object_id": object_id,
+    })
+
+    def push():
+        try:
+            get_redis_connection("default").rpush(PENDING_KEY, event)
+        except Exception:
+            logger.exception("Failed to queue %s notification for user %s", notification_type, receiver_id)
+
+    transaction.on_commit(push)
+
+
+class NotificationUnreadCounter:
+    """
+    Unread notifications per user in Redis, notifications:unread:{user_id}.
+    A missing key means "unknown": it is recounted from the (receiver, is_read)
+    index on the next read, and deltas never create it, so a lost update or a
+    flushed Redis heals itself instead of drifting.
+    """
+    TTL = 24 * 3600
+
+    # KEYS: counter; ARGV: delta. Only moves an existing counter; drops it if it went negative.
+    _ADJUST = """
+    if redis.call('EXISTS', KEYS[1]) == 0 then return nil end
+    local value = redis.call('INCRBY', KEYS[1], ARGV[1])
+    if value < 0 then redis.call('DEL', KEYS[1]) end
+    return value
+    """
+
+    @staticmethod
+    def key(user_id) -> str:
+        return f"notifications:unread:{user_id}"
+
+    @staticmethod
+    def _redis():
+        return get_redis_connection("default")
+
+    @classmethod
+    def get(cls, user_id) -> int:
+        client = cls._redis()
+        try:
+            value = client.get(cls.key(user_id))
+        except Exception:
+            logger.exception("Failed to read the notification badge of user %s", user_id)
+            value = None
+        if value is not None:
+            return int(value)
+        count = Notification.objects.filter(receiver_id=user_id, is_read=False).count()
+        try:
+            client.set(cls.key(user_id), count, ex=cls.TTL, nx=True)
+        except Exception:
+            logger.exception("Failed to cache the notification badge of user %s", user_id)
+        return count
+
+    @classmethod
+    def adjust(cls, deltas):
+        """Apply {user_id: delta} to the counters that exist."""
+        deltas = {user_id: delta for user_id, delta in deltas.items() if delta}
+        if not deltas:
+            return
+        pipe = cls._redis().pipeline(transaction=False)
+        for user_id, delta in deltas.items():
+            pipe.eval(cls._ADJUST, 1, cls.key(user_id), delta)
+        try:
+            pipe.execute()
+        except Exception:
+            logger.exception("Failed to adjust notification badges")
+            cls.reset(*deltas)
+
+    @classmethod
+    def reset(cls, *user_ids):
+        try:
+            cls._redis().delete(*(cls.key(user_id) for user_id in user_ids))
+        except Exception:
+            logger.exception("Failed to reset notification badges")
+
+
+def mark_read(user_id, notification_id) -> bool:
+    """Mark one notification read with a conditional UPDATE; False if it was not unread."""
+    marked = Notification.objects.filter(id=notification_id, receiver_id=user_id, is_read=False).update(is_read=True)
+    if marked:
+        NotificationUnreadCounter.adjust({user_id: -1})
+        push([(user_id, READ, {"id": notification_id, "is_read": True}, -1)])
+    return bool(marked)
+
+
+def mark_all_read(user_id, up_to_id=None) -> int:
+    """Mark every unread notification (up to and including up_to_id) read in one UPDATE."""
+    unread = Notification.objects.filter(receiver_id=user_id, is_read=False)
+    if up_to_id is not None:
+        unread = unread.filter(id__lte=up_to_id)
+    marked = unread.update(is_read=True)
+    if marked:
+        if up_to_id is None:
+            NotificationUnreadCounter.reset(user_id)  # recounted as 0 on the next read
+        else:
+            NotificationUnreadCounter.adjust({user_id: -marked})
+        push([(user_id, READ_ALL, {"up_to_id": up_to_id}, -marked)])
+    return marked
+
+
+def notification_payload(row: dict, card) -> dict:
+    """NotificationSerializer representation from a PAYLOAD_FIELDS values() row and the sender's card."""
+    return {
+        "id": row["id"],
+        "sender": row["sender_id"],
+        "sender_name": display_name(card) if card else None,
+        "sender_profile": picture_url(card) if card else None,
+        "notification_type": row["notification_type"],
+        "actor_count": row["actor_count"],
+        "message": row["message"],
+        "is_read": row["is_read"],
+        "created_at": _datetime_field.to_representation(row["created_at"]),
+    }
+
+
+def push(events):
+    """Send (receiver_id, event, payload, unread_delta) tuples to the receivers' sockets."""
+    if not events:
+        return
+
+    async def send_all(layer):
+        for receiver_id, event, payload, unread_delta in events:
+            await layer.group_send(f"user_{receiver_id}", {
+                "type": "notification_message",
+                "event": event,
+                "notification": payload,
+                "unread_delta": unread_delta,
+            })
+
+    try:
+        async_to_sync(send_all)(get_channel_layer())
+    except Exception:
+        # the rows are committed; clients catch up from the snapshot on reconnect
+        logger.exception("Failed to push %s notification events", len(events))
+
+
+def notification_payloads(rows) -> list:
+    """Payloads for PAYLOAD_FIELDS rows, with all sender cards fetched in bulk."""
+    rows = list(rows)
+    cards = get_user_cards(row["sender_id"] for row in rows)
+    return [notification_payload(row, cards.get(row["sender_id"])) for row in rows]
+
+
+def snapshot(user_id, limit=SNAPSHOT_SIZE) -> dict:
+    """Latest notifications and the unread count, sent when a user socket opens."""
+    rows = Notification.objects.filter(receiver_id=user_id).order_by("-created_at").values(*PAYLOAD_FIELDS)[:limit]
+    return {
+        "notifications": notification_payloads(rows),
+        "unread_count": NotificationUnreadCounter.get(user_id),
+    }
+
+
+def build_message(sender_name, notification_type, actor_count) -> str:
+    verb = VERBS.get(notification_type, notification_type)
+    others = actor_count - 1
+    if others <= 0:
+        return f"{sender_name} {verb}"
+    return f"{sender_name} and {others} other{'s' if others > 1 else ''} {verb}"
+
+
+def coalesce(events) -> dict:
+    """(receiver, type) -> {"senders": distinct senders oldest first, "object_id": latest}."""
+    groups = {}
+    for event in events:
+        if event["sender"] == event["receiver"]:
+            continue
+        group = groups.setdefault((event["receiver"], event["type"]), {"senders": [], "object_id": None})
+        if event["sender"] in group["senders"]:
+            group["senders"].remove(event["sender"])
+        group["senders"].append(event["sender"])
+        group["object_id"] = event.get("object_id") or group["object_id"]
+    return groups
+
+
+def write_notifications(events) -> int:
+    """Fold events into Notification rows: update recent unread ones, bulk_create the rest."""
+    groups = coalesce(events)
+    if not groups:
+        return 0
+
+    now = timezone.now()
+    window_start = now - timedelta(seconds=settings.NOTIFICATION_COALESCE_SECONDS)
+    open_rows = {}
+    recent = (
+        Notification.objects.filter(
+            receiver_id__in={receiver for receiver, _ in groups},
+            notification_type__in={kind for _, kind in groups},
+            is_read=False,
+            created_at__gte=window_start,
+        )
+        .order_by("created_at")
+    )
+    for row in recent:
+        open_rows[(row.receiver_id, row.notification_type)] = row  # the newest wins
+
+    latest_senders = {group["senders"][-1] for group in groups.values()}
+    receivers = {receiver for receiver, _ in groups}
+    # one bulk card lookup also tells which receivers still exist
+    senders = get_user_cards(latest_senders | receivers)
+
+    to_create, to_update = [], []
+    for (receiver_id, kind), group in groups.items():
+        sender_id = group["senders"][-1]
+        if sender_id not in senders or receiver_id not in senders:  # deleted meanwhile
+            continue
+        row = open_rows.get((receiver_id, kind))
+        content_type = ContentType.objects.get_by_natural_key(*CONTENT_MODELS[kind])  # cached by the manager
+        if row is None:
+            row = Notification(receiver_id=receiver_id, notification_type=kind, created_at=now)
+            actor_ids = list(group["senders"])
+            actor_count = len(actor_ids)
+            to_create.append(row)
+        else:
+            # rows folded before actor_ids existed only know their latest sender
+            actor_ids = row.actor_ids or [row.sender_id]
+            new_senders = [s for s in group["senders"] if s not in actor_ids]
+            actor_ids = actor_ids + new_senders
+            actor_count = row.actor_count + len(new_senders)
+            row.created_at = now
+            to_update.append(row)
+        row.sender_id = sender_id
+        row.actor_ids = actor_ids
+        row.actor_count = actor_count
+        row.content_type = content_type
+        row.object_id = group["object_id"]
+        sender = senders[sender_id]
+        row.message = build_message(display_name(sender) or "Someone", kind, actor_count)
+
+    with transaction.atomic():
+        Notification.objects.bulk_create(to_create, batch_size=500)
+        Notification.objects.bulk_update(
+            to_update,
+            ["sender", "actor_count", "actor_ids", "content_type", "object_id", "message", "created_at"],
+            batch_size=500,
+        )
+
+    def payload(row):
+        return notification_payload({field: getattr(row, field) for field in PAYLOAD_FIELDS}, senders[row.sender_id])
+
+    # an updated row was already unread, so only new rows move the count
+    increments = {}
+    for row in to_create:
+        increments[row.receiver_id] = increments.get(row.receiver_id, 0) + 1
+    NotificationUnreadCounter.adjust(increments)
+    push(
+        [(row.receiver_id, CREATED, payload(row), 1) for row in to_create]
+        + [(row.receiver_id, UPDATED, payload(row), 0) for row in to_update]
+    )
+    # and to the devices of receivers without an open socket
+    queue_pushes([
+        push_event(
+            [row.receiver_id], row.message,
+            data={"type": "notification", "notification_id": row.id, "notification_type": row.notification_type},
+            collapse_key=f"notification:{row.id}",
+        )
+        for row in to_create + to_update
+    ])
+    return len(to_create) + len(to_update)
+
+
+def flush_pending(batch_size=None) -> int:
+    """Pop queued events batch by batch and write them; returns notifications written."""
+    batch_size = batch_size or settings.NOTIFICATION_BATCH_SIZE
+    client = get_redis_connection("default")
+    written = 0
+    while True:
+        raw = client.eval(POP_BATCH, 1, PENDING_KEY, batch_size)
+        if not raw:
+            break
+        try:
+            written += write_notifications([json.loads(item) for item in raw])
+        except Exception:
+            logger.exception("Failed to write %s notification events; writing them one by one", len(raw))
+            written += _write_each(client, raw)
+            # retried events are back on the list; leave them for the next run
+            break
+        if len(raw) < batch_size:
+            break
+    return written
+
+
+def _write_each(client, raw) -> int:
+    """
+    Write a failed batch one event at a time so a bad event cannot hold
+    back the rest. Failing events go back on the list with an attempt
+    count, and to DEAD_LETTER_KEY after NOTIFICATION_MAX_ATTEMPTS.
+    """
+    written, retry, dead = 0, [], []
+    for item in raw:
+        try:
+            event = json.loads(item)
+        except ValueError:
+            logger.error("Dropping malformed notification event %r", item)
+            dead.append(item)
+            continue
+        try:
+            written += write_notifications([event])
+        except Exception:
+            logger.exception("Failed to write notification event %s", item)
+            event["attempts"] = event.get("attempts", 0) + 1
+            if event["attempts"] >= settings.NOTIFICATION_MAX_ATTEMPTS:
+                dead.append(json.dumps(event))
+            else:
+                retry.append(json.dumps(event))
+
+    pipe = client.pipeline(transaction=False)
+    if retry:
+        pipe.rpush(PENDING_KEY, *retry)
+    if dead:
+        pipe.rpush(DEAD_LETTER_KEY, *dead)
+        logger.error(f"Moved {len(dead)} notification events to {DEAD_LETTER_KEY}")
+    pipe.execute()
+    return written
+
+
+# retention
+
+def _delete_rows(rows) -> int:
+    """Delete (id, receiver_id, is_read) rows by id and take the unread ones off the badges."""
+    if not rows:
+        return 0
+    Notification.objects.filter(pk__in=[pk for pk, _, _ in rows]).delete()
+    unread = {}
+    for _, receiver_id, is_read in rows:
+        if not is_read:
+            unread[receiver_id] = unread.get(receiver_id, 0) - 1
+    NotificationUnreadCounter.adjust(unread)
+    return len(rows)
+
+
+def prune_expired(now=None) -> int:
+    """
+    Delete read rows older than NOTIFICATION_RETENTION_READ_DAYS and unread
+    ones older than NOTIFICATION_RETENTION_UNREAD_DAYS, walking the primary
+    key in NOTIFICATION_PRUNE_CHUNK_SIZE ranges so every DELETE is small.
+    """
+    now = now or timezone.now()
+    expired = (
+        Q(is_read=True, created_at__lt=now - timedelta(days=settings.NOTIFICATION_RETENTION_READ_DAYS))
+        | Q(is_read=False, created_at__lt=now - timedelta(days=settings.NOTIFICATION_RETENTION_UNREAD_DAYS))
+    )
+    first = Notification.objects.order_by("id").values_list("id", flat=True).first()
+    last = Notification.objects.order_by("-id").values_list("id", flat=True).first()
+    if first is None:
+        return 0
+
+    chunk, deleted = settings.NOTIFICATION_PRUNE_CHUNK_SIZE, 0
+    for start in range(first, last + 1, chunk):
+        rows = list(
+            Notification.objects.filter(expired, id__gte=start, id__lt=start + chunk)
+            .values_list("id", "receiver_id", "is_read")
+        )
+        deleted += _delete_rows(rows)
+    return deleted
+
+
+def enforce_user_cap() -> int:
+    """Keep only the newest NOTIFICATION_MAX_PER_USER rows of every receiver (0 disables)."""
+    cap, chunk = settings.NOTIFICATION_MAX_PER_USER, settings.NOTIFICATION_PRUNE_CHUNK_SIZE
+    if not cap:
+        return 0
+    over = (
+        Notification.objects.values("receiver_id").annotate(n=Count("id")).filter(n__gt=cap)
+        .order_by().values_list("receiver_id", flat=True)
+    )
+    deleted = 0
+    for receiver_id in list(over):
+        rows = Notification.objects.filter(receiver_id=receiver_id)
+        # the oldest row that is kept, on the (receiver, created_at) index
+        created_at, pk = rows.order_by("-created_at", "-id").values_list("created_at", "id")[cap - 1]
+        older = rows.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk))
+        while True:
+            batch = list(older.order_by("created_at", "id").values_list("id", "receiver_id", "is_read")[:chunk])
+            deleted += _delete_rows(batch)
+            if len(batch) < chunk:
+                break
+    return deleted
@@ -0,0 +1,48 @@
+from celery import shared_task
+from .models import DeviceToken
+from .push import deliver_pending, send
+from .services import enforce_user_cap, flush_pending, prune_expired
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task
+def flush_notifications():
+    """
+    Write notification events queued in Redis, coalesced per receiver and type
+    """
+    written = flush_pending()
+    if written:
+        logger.info(f"Wrote {written} coalesced notifications.")
+
+
+@shared_task
+def prune_notifications():
+    """
+    Delete notifications past their retention and beyond the per-user cap, in small chunks
+    """
+    expired = prune_expired()
+    capped = enforce_user_cap()
+    if expired or capped:
+        logger.info(f"Pruned {expired} expired and {capped} over-cap notifications.")
+
+
+@shared_task
+def deliver_pushes():
+    """
+    Send queued push notifications in per-provider multicast batches
+    """
+    delivered = deliver_pending()
+    if delivered:
+        logger.info(f"Delivered push notifications to {delivered} devices.")
+
+
+@shared_task
+def retry_push(provider, tokens, message, attempt):
+    """
+    Resend a push to the devices whose previous attempt failed transiently
+    """
+    tokens = list(DeviceToken.objects.filter(token__in=tokens, is_active=True).values_list("token", flat=True))
+    if tokens:
+        send(provider, tokens, message, attempt)
@@ -1,3 +1,136 @@
-from django.test import TestCase
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
+
+from account.models import User
+from . import transports
+from .models import DeviceToken, Notification
+from .push import decode, deliver, push_event
+from .services import write_notifications
+
+LOCMEM_CACHES = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class NotificationListQueryBudgetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.receiver = User.objects.create(email="receiver@example.com", username="receiver")
+        senders = [
+            User.objects.create(email=f"sender{i}@example.com", username=f"sender{i}", full_name=f"Sender {i}")
+            for i in range(30)
+        ]
+        Notification.objects.bulk_create([
+            Notification(sender=sender, receiver=cls.receiver, message=f"{sender.full_name} liked your profile")
+            for sender in senders
+        ])
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.receiver)
+
+    def test_page_costs_the_same_queries_whatever_its_size(self):
+        # page rows, COUNT, one bulk fetch of the sender cards
+        with self.assertNumQueries(3):
+            response = self.client.get("/v1/notification/list/")
+        results = response.json()["results"]
+        self.assertEqual(len(results), 20)
+        self.assertTrue(all(row["sender_name"].startswith("Sender") for row in results))
+
+    def test_cached_sender_cards_are_not_fetched_again(self):
+        self.client.get("/v1/notification/list/")
+        with self.assertNumQueries(2):
+            self.client.get("/v1/notification/list/")
+
+    def test_saving_a_user_refreshes_their_card(self):
+        self.client.get("/v1/notification/list/")
+        sender = User.objects.get(email="sender29@example.com")
+        sender.full_name = "Renamed"
+        sender.save()
+        results = self.client.get("/v1/notification/list/").json()["results"]
+        self.assertIn("Renamed", [row["sender_name"] for row in results])
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+@mock.patch("notification.services.NotificationUnreadCounter.adjust")
+class NotificationCoalescingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.receiver = User.objects.create(email="receiver@example.com", username="receiver")
+        self.alex, self.sam = (
+            User.objects.create(email=f"{name}@example.com", username=name, full_name=name.title())
+            for name in ("alex", "sam")
+        )
+
+    def like(self, sender):
+        return {"receiver": self.receiver.pk, "sender": sender.pk, "type": Notification.TYPE_LIKE}
+
+    def test_repeat_senders_in_a_later_batch_are_not_counted_again(self, adjust):
+        write_notifications([self.like(self.alex), self.like(self.sam)])
+        write_notifications([self.like(self.alex)])
+        write_notifications([self.like(self.sam), self.like(self.alex)])
+
+        row = Notification.objects.get(receiver=self.receiver)
+        self.assertEqual(row.actor_count, 2)
+        self.assertEqual(row.sender_id, self.alex.pk)
+        self.assertEqual(row.message, "Alex and 1 other liked your profile")
+
+
+@override_settings(CACHES=LOCMEM_CACHES, PUSH_TRANSPORTS={"fcm": "notification.transports.LocalTransport"})
+@mock.patch("notification.push.online_user_ids", return_value=set())
+class PushDeliveryTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        transports._transports.clear()
+        transports.LocalTransport.outbox.clear()
+        self.transport = transports.get_transport("fcm")
+        self.user = User.objects.create(email="receiver@example.com", username="receiver")
+        for token in ("phone", "tablet"):
+            DeviceToken.objects.create(user=self.user, token=token, platform="android")
+
+    def deliver(self, *events):
+        return deliver(decode(events), client=mock.Mock())
+
+    def sent(self):
+        return [(push["body"], sorted(push["tokens"])) for push in self.transport.outbox]
+
+    def test_newest_event_per_device_and_collapse_key_is_sent(self, online_user_ids):
+        self.deliver(
+            push_event([self.user.pk], "first", title="Alex", collapse_key="chat:1"),
+            push_event([self.user.pk], "other thread", title="Sam", collapse_key="chat:2"),
+            push_event([self.user.pk], "second", title="Alex", collapse_key="chat:1"),
+        )
+        self.assertCountEqual(self.sent(), [
+            ("other thread", ["phone", "tablet"]),
+            ("second", ["phone", "tablet"]),
+        ])
+
+    def test_invalid_tokens_are_deactivated(self, online_user_ids):
+        self.transport.invalid_tokens = {"tablet"}
+        delivered = self.deliver(push_event([self.user.pk], "hi", title="Alex"))
+
+        self.assertEqual(delivered, 1)
+        self.assertEqual(self.sent(), [("hi", ["phone"])])
+        self.assertFalse(DeviceToken.objects.get(token="tablet").is_active)
+        self.assertTrue(DeviceToken.objects.get(token="phone").is_active)
+
+    @mock.patch("notification.tasks.retry_push.apply_async")
+    def test_failed_tokens_are_retried(self, apply_async, online_user_ids):
+        self.transport.failing_tokens = {"tablet"}
+        self.deliver(push_event([self.user.pk], "hi", title="Alex"))
+
+        self.assertEqual(self.sent(), [("hi", ["phone"])])
+        apply_async.assert_called_once()
+        (provider, tokens, message, attempt), = apply_async.call_args.args
+        self.assertEqual((provider, tokens, message["body"], attempt), ("fcm", ["tablet"], "hi", 1))
+
+    def test_online_users_are_skipped_unless_the_push_is_for_everyone(self, online_user_ids):
+        online_user_ids.return_value = {self.user.pk}
+        self.deliver(
+            push_event([self.user.pk], "chat message", title="Alex"),
+            push_event([self.user.pk], "call", title="Alex", only_offline=False),
+        )
+        self.assertEqual(self.sent(), [("call", ["phone", "tablet"])])
@@ -0,0 +1,97 @@
+"""
+Push transports, one per provider, configured in settings.PUSH_TRANSPORTS as
+dotted paths (like EMAIL_BACKEND). A transport sends one message to many
+device tokens and reports which tokens are invalid (to deactivate) and
+which failed transiently (to retry).
+"""
+import logging
+from collections import deque
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+
+class PushResult:
+    def __init__(self, invalid=(), failed=()):
+        self.invalid = list(invalid)  # tokens the provider no longer accepts
+        self.failed = list(failed)    # tokens worth retrying
+
+
+class BaseTransport:
+    max_batch = 500  # tokens per multicast request
+
+    def send_multicast(self, tokens, message) -> PushResult:
+        """message: {"title", "body", "data", "collapse_key"}."""
+        raise NotImplementedError
+
+
+class LocalTransport(BaseTransport):
+    """
+    Records the latest pushes in memory instead of sending them, for
+    development and tests. Tokens listed in invalid_tokens / failing_tokens
+    are reported as such so callers can exercise deactivation and retries.
+    """
+    outbox = deque(maxlen=1000)
+    invalid_tokens = set()
+    failing_tokens = set()
+
+    def __init__(self):
+        logger.warning("Push notifications are recorded locally, not sent; set PUSH_FCM_TRANSPORT to deliver them.")
+
+    def send_multicast(self, tokens, message) -> PushResult:
+        invalid = [token for token in tokens if token in self.invalid_tokens]
+        failed = [token for token in tokens if token in self.failing_tokens]
+        delivered = [token for token in tokens if token not in invalid and token not in failed]
+        if delivered:
+            self.outbox.append({"tokens": delivered, **message})
+            logger.info("Local push to %s devices: %s", len(delivered), message.get("body"))
+        return PushResult(invalid, failed)
+
+
+class FCMTransport(BaseTransport):
+    """Firebase Cloud Messaging through firebase-admin (credentials from GOOGLE_APPLICATION_CREDENTIALS)."""
+
+    def __init__(self):
+        try:
+            import firebase_admin
+            from firebase_admin import messaging
+        except ImportError:
+            raise ImproperlyConfigured("FCMTransport requires the firebase-admin package.")
+        if not firebase_admin._apps:
+            firebase_admin.initialize_app()
+        self.messaging = messaging
+
+    def send_multicast(self, tokens, message) -> PushResult:
+        messaging = self.messaging
+        response = messaging.send_each_for_multicast(messaging.MulticastMessage(
+            tokens=list(tokens),
+            notification=messaging.Notification(title=message.get("title"), body=message.get("body")),
+            data={key: str(value) for key, value in (message.get("data") or {}).items()},
+            android=messaging.AndroidConfig(collapse_key=message.get("collapse_key")),
+            apns=messaging.APNSConfig(headers={"apns-collapse-id": message.get("collapse_key") or ""}),
+        ))
+        invalid, failed = [], []
+        for token, result in zip(tokens, response.responses):
+            if result.success:
+                continue
+            if isinstance(result.exception, (messaging.UnregisteredError, messaging.SenderIdMismatchError)):
+                invalid.append(token)
+            else:
+                failed.append(token)
+        return PushResult(invalid, failed)
+
+
+_transports = {}
+
+
+def get_transport(provider) -> BaseTransport:
+    if provider not in _transports:
+        try:
+            path = settings.PUSH_TRANSPORTS[provider]
+        except KeyError:
+            raise ImproperlyConfigured(f"No push transport configured for {provider!r}.")
+        _transports[provider] = import_string(path)()
+    return _transports[provider]
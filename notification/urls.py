@@ -3,10 +3,16 @@ from .views import (
     NotificationListAPI,
     NotificationMarkReadAPI,
     NotificationDeleteAPI,
+    NotificationMarkAllReadAPI,
+    NotificationUnreadCountAPI,
+    DeviceTokenAPI,
 )
 
 urlpatterns = [
     path("list/", NotificationListAPI.as_view(), name="notifications"),
     path("<int:pk>/read/", NotificationMarkReadAPI.as_view(), name="notification-read"),
     path("<int:pk>/delete/", NotificationDeleteAPI.as_view(), name="notification-delete"),
+    path("read-all/", NotificationMarkAllReadAPI.as_view(), name="notification-read-all"),
+    path("unread-count/", NotificationUnreadCountAPI.as_view(), name="notification-unread-count"),
+    path("devices/", DeviceTokenAPI.as_view(), name="notification-devices"),
 ]
@@ -4,8 +4,17 @@ from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.pagination import PageNumberPagination
 
-from .models import Notification
-from .serializers import NotificationSerializer
+from .models import DeviceToken, Notification
+from .serializers import DeviceTokenSerializer
+from .services import (
+    DELETED,
+    PAYLOAD_FIELDS,
+    NotificationUnreadCounter,
+    mark_all_read,
+    mark_read,
+    notification_payloads,
+    push,
+)
 
 
 class NotificationListAPI(APIView):
@@ -15,29 +24,25 @@ class NotificationListAPI(APIView):
         paginator = PageNumberPagination()
         paginator.page_size = 20
 
-        qs = Notification.objects.filter(receiver=request.user)
+        # plain rows; sender names and pictures come from the shared card cache
+        qs = Notification.objects.filter(receiver=request.user).values(*PAYLOAD_FIELDS)
 
         result = paginator.paginate_queryset(qs, request)
-        serializer = NotificationSerializer(result, many=True)
-
-        return paginator.get_paginated_response(serializer.data)
+        return paginator.get_paginated_response(notification_payloads(result))
 
 
 class NotificationMarkReadAPI(APIView):
     permission_classes = [IsAuthenticated]
 
     def post(self, request, pk):
-        try:
-            notification = Notification.objects.get(id=pk, receiver=request.user)
-        except Notification.DoesNotExist:
+        # one conditional UPDATE; the existence check only runs when nothing changed
+        marked = mark_read(request.user.pk, pk)
+        if not marked and not Notification.objects.filter(id=pk, receiver=request.user).exists():
             return Response(
                 {"error": "Notification not found"},
                 status=status.HTTP_404_NOT_FOUND
             )
 
-        notification.is_read = True
-        notification.save(update_fields=["is_read"])
-
         return Response({"message": "Marked as read"}, status=status.HTTP_200_OK)
 
 
@@ -54,4 +59,53 @@ class NotificationDeleteAPI(APIView):
             )
 
         notification.delete()
+        if not notification.is_read:
+            NotificationUnreadCounter.adjust({request.user.pk: -1})
+        push([(request.user.pk, DELETED, {"id": pk}, 0 if notification.is_read else -1)])
         return Response({"message": "Deleted"}, status=status.HTTP_200_OK)
+
+
+class NotificationMarkAllReadAPI(APIView):
+    """Mark every unread notification read, or only those with id <= up_to_id, in one UPDATE."""
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        up_to_id = request.data.get("up_to_id")
+        if up_to_id is not None:
+            try:
+                up_to_id = int(up_to_id)
+            except (TypeError, ValueError):
+                return Response({"error": "up_to_id must be a notification id"}, status=status.HTTP_400_BAD_REQUEST)
+
+        marked = mark_all_read(request.user.pk, up_to_id)
+        return Response({"message": "Marked as read", "marked_read": marked}, status=status.HTTP_200_OK)
+
+
+class NotificationUnreadCountAPI(APIView):
+    """The unread badge, from Redis (recounted on the index when unknown)."""
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        return Response({"unread_count": NotificationUnreadCounter.get(request.user.pk)}, status=status.HTTP_200_OK)
+
+
+class DeviceTokenAPI(APIView):
+    """Register (POST) or unregister (DELETE) the device that receives push notifications."""
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        serializer = DeviceTokenSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        # a token moves to whoever signed in on the device last
+        DeviceToken.objects.update_or_create(
+            token=serializer.validated_data["token"],
+            defaults={"user": request.user, "platform": serializer.validated_data["platform"], "is_active": True},
+        )
+        return Response({"message": "Device registered"}, status=status.HTTP_200_OK)
+
+    def delete(self, request):
+        token = request.data.get("token") or request.query_params.get("token")
+        if not token:
+            return Response({"error": "token is required"}, status=status.HTTP_400_BAD_REQUEST)
+        DeviceToken.objects.filter(token=token, user=request.user).delete()
+        return Response({"message": "Device unregistered"}, status=status.HTTP_200_OK)
@@ -59,6 +59,7 @@ class UserSubscription(models.Model):
     # Additional metadata
     store = models.CharField(max_length=20)  # 'app_store' or 'play_store'
     metadata = models.JSONField(default=dict, blank=True)
+    last_event_ms = models.BigIntegerField(null=True, blank=True)  # newest RevenueCat event applied
     
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -110,4 +111,26 @@ class SubscriptionEvent(models.Model):
         ordering = ['-event_timestamp']
         indexes = [
             models.Index(fields=['user_subscription', '-event_timestamp']),
-        ]
\ No newline at end of file
+        ]
+
+
+class RevenueCatEvent(models.Model):
+    """Raw webhook events, stored as received and processed later by a Celery task"""
+    event_id = models.CharField(max_length=255, unique=True)  # RevenueCat retries resend the same id
+    app_user_id = models.CharField(max_length=255)
+    event_type = models.CharField(max_length=50)
+    event_timestamp_ms = models.BigIntegerField()
+    payload = models.JSONField()
+
+    attempts = models.PositiveSmallIntegerField(default=0)
+    error = models.TextField(blank=True)
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['processed_at', 'app_user_id', 'event_timestamp_ms']),
+        ]
+
+    def __str__(self):
+        return f"{self.event_type} {self.event_id}"
@@ -0,0 +1,18 @@
+from rest_framework import permissions
+
+from .services import EntitlementService
+
+
+class HasActiveSubscription(permissions.BasePermission):
+    """
+    Allow users with an active subscription. Set `required_feature` on the
+    view to also require that feature in the plan's features. Checks hit
+    the entitlement cache, not the database.
+    """
+    message = "An active subscription is required."
+
+    def has_permission(self, request, view):
+        user = request.user
+        if not (user and user.is_authenticated):
+            return False
+        return EntitlementService.allows(user.pk, getattr(view, "required_feature", None))
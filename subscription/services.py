@@ -0,0 +1,352 @@
+"""
+RevenueCat webhook ingestion.
+
+The webhook only verifies the signature and stores the raw event with
+store_event(): one INSERT ... ON CONFLICT DO NOTHING on the event id, so a
+provider retry is a no-op and the response never waits on subscription
+lookups. process_pending_events(), run by a Celery beat task, applies the
+stored events in batches, oldest first per subscriber.
+
+Events can still arrive out of order (RevenueCat does not guarantee
+ordering across retries), so UserSubscription.last_event_ms records the
+newest event applied and older events are only logged.
+
+EntitlementService answers "what does this user's plan unlock" from the
+cache; the handlers drop a user's entry when their subscription changes.
+"""
+import json
+import logging
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import RevenueCatEvent, SubscriptionEvent, SubscriptionPlan, UserSubscription
+
+logger = logging.getLogger(__name__)
+
+User = get_user_model()
+
+
+def from_ms(value):
+    """RevenueCat timestamps are epoch milliseconds."""
+    if value in (None, ""):
+        return None
+    return datetime.fromtimestamp(int(value) / 1000, tz=dt_timezone.utc)
+
+
+def store_event(body):
+    """Store a raw webhook body; RevenueCat retries of a stored event are ignored."""
+    payload = json.loads(body)
+    event = payload["event"]
+    RevenueCatEvent.objects.bulk_create([
+        RevenueCatEvent(
+            event_id=event["id"],
+            app_user_id=event["app_user_id"],
+            event_type=event["type"],
+            event_timestamp_ms=event.get("event_timestamp_ms") or int(timezone.now().timestamp() * 1000),
+            payload=payload,
+        )
+    ], ignore_conflicts=True)
+
+
+def process_pending_events(batch_size=None) -> int:
+    """Apply up to about batch_size stored events, grouped per subscriber; returns events applied."""
+    batch_size = batch_size or settings.REVENUECAT_EVENT_BATCH_SIZE
+    pending = (
+        RevenueCatEvent.objects
+        .filter(processed_at__isnull=True, attempts__lt=settings.REVENUECAT_EVENT_MAX_ATTEMPTS)
+        .order_by("event_timestamp_ms")
+        .values_list("app_user_id", flat=True)[:batch_size]
+    )
+    return sum(process_subscriber_events(app_user_id) for app_user_id in dict.fromkeys(pending))
+
+
+def process_subscriber_events(app_user_id) -> int:
+    """
+    Apply one subscriber's pending events in event order. A failing event
+    is retried on a later run (up to REVENUECAT_EVENT_MAX_ATTEMPTS) and
+    holds back the newer ones until then.
+    """
+    with transaction.atomic():
+        # rows another worker holds are skipped, not waited for
+        events = list(
+            RevenueCatEvent.objects.select_for_update(skip_locked=True)
+            .filter(
+                app_user_id=app_user_id,
+                processed_at__isnull=True,
+                attempts__lt=settings.REVENUECAT_EVENT_MAX_ATTEMPTS,
+            )
+            .order_by("event_timestamp_ms", "id")
+        )
+        applied = []
+        for event in events:
+            try:
+                with transaction.atomic():
+                    apply_event(event.payload)
+            except Exception as exc:
+                logger.exception("Failed to apply RevenueCat event %s", event.event_id)
+                RevenueCatEvent.objects.filter(pk=event.pk).update(attempts=F("attempts") + 1, error=str(exc))
+                break
+            applied.append(event.pk)
+        if applied:
+            RevenueCatEvent.objects.filter(pk__in=applied).update(processed_at=timezone.now(), error="")
+    return len(applied)
+
+
+def apply_event(payload):
+    event = payload["event"]
+    handler = EVENT_HANDLERS.get(event["type"])
+    if handler is None:
+        # TEST, PRODUCT_CHANGE, TRANSFER, ...: kept in RevenueCatEvent only
+        return
+    handler(event, payload)
+
+
+def resolve_user(event):
+    """Our user for an event: the app logs in to RevenueCat with the user_id, anonymous ids are aliases."""
+    candidates = [event.get("app_user_id"), event.get("original_app_user_id"), *(event.get("aliases") or [])]
+    ids = [int(candidate) for candidate in candidates if str(candidate or "").isdigit()]
+    if not ids:
+        return None
+    users = User.objects.in_bulk(ids)
+    return next((users[pk] for pk in ids if pk in users), None)
+
+
+def get_subscription(event, create=False):
+    """The locked subscription an event applies to; created for purchases and renewals."""
+    subscription = (
+        UserSubscription.objects.select_for_update()
+        .filter(revenuecat_subscriber_id=event["app_user_id"])
+        .first()
+    )
+    if subscription is not None:
+        return subscription
+
+    user = resolve_user(event)
+    if user is None:
+        logger.warning(f"RevenueCat event {event['id']} for unknown subscriber {event['app_user_id']}")
+        return None
+    if not create:
+        return UserSubscription.objects.select_for_update().filter(user=user).first()
+    subscription, _ = UserSubscription.objects.select_for_update().get_or_create(
+        user=user,
+        defaults={
+            "revenuecat_subscriber_id": event["app_user_id"],
+            "store": (event.get("store") or "").lower(),
+        },
+    )
+    return subscription
+
+
+def record_event(subscription, event, payload, event_type, **changes):
+    """Apply changes unless a newer event was applied already, and log the event."""
+    timestamp_ms = event.get("event_timestamp_ms") or 0
+    if subscription.last_event_ms is None or timestamp_ms >= subscription.last_event_ms:
+        for field, value in changes.items():
+            setattr(subscription, field, value)
+        subscription.last_event_ms = timestamp_ms
+        subscription.save()
+        # keep the denormalised User flags in step and drop the cached entitlement
+        User.objects.filter(pk=subscription.user_id).update(
+            is_subscribed=subscription.is_valid, subscription_expiry=subscription.expires_at
+        )
+        transaction.on_commit(lambda: EntitlementService.invalidate(subscription.user_id))
+
+    SubscriptionEvent.objects.bulk_create([
+        SubscriptionEvent(
+            user_subscription=subscription,
+            event_type=event_type,
+            event_timestamp=from_ms(timestamp_ms) or timezone.now(),
+            revenuecat_event_id=event["id"],
+            raw_data=payload,
+            transaction_id=event.get("transaction_id") or "",
+            price=event.get("price"),
+            currency=event.get("currency") or "USD",
+        )
+    ], ignore_conflicts=True)
+
+
+def handle_initial_purchase(event, payload):
+    subscription = get_subscription(event, create=True)
+    if subscription is None:
+        return
+
+    is_trial = event.get("period_type") == "TRIAL"
+    purchased_at = from_ms(event.get("purchased_at_ms")) or timezone.now()
+    expires_at = from_ms(event.get("expiration_at_ms"))
+    record_event(
+        subscription, event, payload,
+        "trial_started" if is_trial else "initial_purchase",
+        plan=SubscriptionPlan.objects.filter(plan_id=event.get("product_id")).first(),
+        status="trial" if is_trial else "active",
+        is_active=True,
+        will_renew=True,
+        started_at=purchased_at,
+        expires_at=expires_at,
+        cancelled_at=None,
+        is_trial=is_trial,
+        trial_started_at=purchased_at if is_trial else None,
+        trial_expires_at=expires_at if is_trial else None,
+        original_transaction_id=event.get("original_transaction_id") or "",
+        store=(event.get("store") or "").lower(),
+    )
+
+
+def handle_renewal(event, payload):
+    subscription = get_subscription(event, create=True)
+    if subscription is None:
+        return
+
+    changes = {
+        "status": "active",
+        "is_active": True,
+        "will_renew": True,
+        "expires_at": from_ms(event.get("expiration_at_ms")),
+        "cancelled_at": None,
+        "is_trial": False,
+    }
+    plan = SubscriptionPlan.objects.filter(plan_id=event.get("product_id")).first()
+    if plan is not None:
+        changes["plan"] = plan
+    event_type = "trial_converted" if event.get("is_trial_conversion") else "renewal"
+    record_event(subscription, event, payload, event_type, **changes)
+
+
+def handle_cancellation(event, payload):
+    """Auto-renew turned off: access lasts until expires_at, unless the purchase was refunded."""
+    subscription = get_subscription(event)
+    if subscription is None:
+        return
+
+    cancelled_at = from_ms(event.get("event_timestamp_ms")) or timezone.now()
+    if event.get("cancel_reason") == "CUSTOMER_SUPPORT":
+        record_event(
+            subscription, event, payload, "refund",
+            status="cancelled", is_active=False, will_renew=False, cancelled_at=cancelled_at,
+        )
+    else:
+        record_event(
+            subscription, event, payload, "cancellation",
+            status="cancelled", will_renew=False, cancelled_at=cancelled_at,
+        )
+
+
+def handle_reactivation(event, payload):
+    subscription = get_subscription(event)
+    if subscription is None:
+        return
+    record_event(
+        subscription, event, payload, "reactivation",
+        status="trial" if subscription.is_trial else "active", will_renew=True, cancelled_at=None,
+    )
+
+
+def handle_expiration(event, payload):
+    subscription = get_subscription(event)
+    if subscription is None:
+        return
+    record_event(
+        subscription, event, payload, "expiration",
+        status="expired", is_active=False, will_renew=False,
+    )
+
+
+def handle_billing_issue(event, payload):
+    """Renewal payment failed; access continues through the store's grace period, if any."""
+    subscription = get_subscription(event)
+    if subscription is None:
+        return
+
+    grace_until = from_ms(event.get("grace_period_expiration_at_ms"))
+    changes = {"status": "grace_period", "expires_at": grace_until} if grace_until else {}
+    record_event(subscription, event, payload, "billing_issue", **changes)
+
+
+EVENT_HANDLERS = {
+    "INITIAL_PURCHASE": handle_initial_purchase,
+    "RENEWAL": handle_renewal,
+    "CANCELLATION": handle_cancellation,
+    "UNCANCELLATION": handle_reactivation,
+    "EXPIRATION": handle_expiration,
+    "BILLING_ISSUE": handle_billing_issue,
+}
+
+
+class EntitlementService:
+    """
+    A user's active plan and its SubscriptionPlan.features, cached per user
+    under entitlement:{user_id}. The entry expires with the subscription
+    (TTL = expires_at, capped at ENTITLEMENT_CACHE_MAX_SECONDS so plan
+    feature edits show up), so premium checks on a warm cache cost no query
+    and expiry is enforced without anything writing the row.
+    """
+    FREE = {"is_active": False, "plan_id": None, "plan_type": "free", "features": {}, "expires_at": None}
+
+    @staticmethod
+    def key(user_id) -> str:
+        return f"entitlement:{user_id}"
+
+    @staticmethod
+    def active_subscriptions():
+        """Subscriptions granting access right now; the rule every premium check shares."""
+        return UserSubscription.objects.filter(is_active=True).filter(
+            Q(expires_at__isnull=True) | Q(expires_at__gt=timezone.now())
+        )
+
+    @classmethod
+    def get(cls, user_id) -> dict:
+        """{"is_active", "plan_id", "plan_type", "features", "expires_at"}."""
+        entitlement = cache.get(cls.key(user_id))
+        if entitlement is not None and not cls._expired(entitlement):
+            return entitlement
+        entitlement = cls.resolve(user_id)
+        cache.set(cls.key(user_id), entitlement, cls.ttl(entitlement))
+        return entitlement
+
+    @classmethod
+    def resolve(cls, user_id) -> dict:
+        """One query for the subscription and its plan."""
+        row = (
+            cls.active_subscriptions().filter(user_id=user_id)
+            .values("expires_at", "plan__plan_id", "plan__plan_type", "plan__features")
+            .first()
+        )
+        if row is None:
+            return dict(cls.FREE)
+        return {
+            "is_active": True,
+            "plan_id": row["plan__plan_id"],
+            "plan_type": row["plan__plan_type"] or "free",
+            "features": row["plan__features"] or {},
+            "expires_at": row["expires_at"],
+        }
+
+    @staticmethod
+    def ttl(entitlement) -> int:
+        ttl = settings.ENTITLEMENT_CACHE_MAX_SECONDS
+        if entitlement["is_active"] and entitlement["expires_at"]:
+            remaining = (entitlement["expires_at"] - timezone.now()).total_seconds()
+            ttl = min(ttl, max(1, int(remaining)))
+        return ttl
+
+    @staticmethod
+    def _expired(entitlement) -> bool:
+        return entitlement["expires_at"] is not None and entitlement["expires_at"] <= timezone.now()
+
+    @classmethod
+    def allows(cls, user_id, feature=None) -> bool:
+        """Any active plan, or one whose features turn `feature` on."""
+        entitlement = cls.get(user_id)
+        if not entitlement["is_active"]:
+            return False
+        return feature is None or bool(entitlement["features"].get(feature))
+
+    @classmethod
+    def invalidate(cls, user_id):
+        cache.delete(cls.key(user_id))
+
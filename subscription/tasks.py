@@ -0,0 +1,15 @@
+from celery import shared_task
+from .services import process_pending_events
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task
+def process_revenuecat_events():
+    """
+    Apply stored RevenueCat webhook events to subscriptions, in event order per subscriber
+    """
+    applied = process_pending_events()
+    if applied:
+        logger.info(f"Applied {applied} RevenueCat events.")